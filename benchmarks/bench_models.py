@@ -0,0 +1,347 @@
+''' Scaling benchmarks for fitting and predicting with the models.
+
+The suites follow the asv conventions: params and param_names give
+the grid, setup builds the inputs, and time_, peakmem_, and track_
+methods are measured. Run them with benchmarks/run.py (or asv).
+'''
+
+import time
+from concurrent import futures
+
+import numpy as np
+
+from gpmodel import gpkernel
+from gpmodel import gpmodel
+from gpmodel import gpentropy
+from gpmodel import gpprofile
+from gpmodel import gpparallel
+
+from benchmarks import generators
+
+N_TEST = 200
+
+
+def make_kernel(name):
+    """ A new kernel by benchmark name. """
+    if name == 'SE':
+        return gpkernel.SEKernel()
+    if name == 'Matern52':
+        return gpkernel.MaternKernel('5/2')
+    if name == 'Linear':
+        return gpkernel.LinearKernel()
+    raise ValueError(name)
+
+
+def chimera_split(n, n_blocks, seed=0):
+    """ Training and test chimeras from one library. """
+    X, y, _ = generators.chimera_data(n + N_TEST, n_blocks=n_blocks,
+                                      seed=seed)
+    return X[:-N_TEST], y[:-N_TEST], X[-N_TEST:], y[-N_TEST:]
+
+
+class RegressorSuite(object):
+
+    """ Exact GPRegressor on chimera one-hot features. """
+
+    params = [[100, 400, 1000], [6, 10], ['SE', 'Matern52', 'Linear']]
+    param_names = ['n', 'n_blocks', 'kernel']
+    timeout = 600
+
+    def setup(self, n, n_blocks, kernel):
+        self.X, self.y, self.X_test, _ = chimera_split(n, n_blocks)
+        self.model = gpmodel.GPRegressor(make_kernel(kernel))
+        self.model.fit(self.X, self.y)
+
+    def time_fit(self, n, n_blocks, kernel):
+        gpmodel.GPRegressor(make_kernel(kernel)).fit(self.X, self.y)
+
+    def peakmem_fit(self, n, n_blocks, kernel):
+        gpmodel.GPRegressor(make_kernel(kernel)).fit(self.X, self.y)
+
+    def time_predict(self, n, n_blocks, kernel):
+        self.model.predict(self.X_test, return_cov=False)
+
+    def time_predict_cov(self, n, n_blocks, kernel):
+        self.model.predict(self.X_test)
+
+    def track_objective_evaluations(self, n, n_blocks, kernel):
+        profiler = gpprofile.Profiler()
+        model = gpmodel.GPRegressor(make_kernel(kernel), profiler=profiler)
+        model.fit(self.X, self.y)
+        return profiler.counts['objective']
+
+
+class ClassifierSuite(object):
+
+    """ GPClassifier with the Laplace approximation. """
+
+    params = [[100, 400], ['SE', 'Matern52']]
+    param_names = ['n', 'kernel']
+    timeout = 600
+
+    def setup(self, n, kernel):
+        X, y, self.X_test, _ = chimera_split(n, 8)
+        self.X = X
+        self.y = generators.classes(y)
+        self.model = gpmodel.GPClassifier(make_kernel(kernel))
+        self.model.fit(self.X, self.y)
+
+    def time_fit(self, n, kernel):
+        gpmodel.GPClassifier(make_kernel(kernel)).fit(self.X, self.y)
+
+    def peakmem_fit(self, n, kernel):
+        gpmodel.GPClassifier(make_kernel(kernel)).fit(self.X, self.y)
+
+    def time_predict(self, n, kernel):
+        self.model.predict(self.X_test, return_cov=False)
+
+
+class MultiClassifierSuite(object):
+
+    """ GPMultiClassifier with one kernel per class.
+
+    Prediction integrates the softmax for each input separately, so
+    it is timed on only n_test inputs.
+    """
+
+    n_test = 5
+
+    params = [[100, 200], [3]]
+    param_names = ['n', 'n_classes']
+    timeout = 600
+
+    def setup(self, n, n_classes):
+        X, y, self.X_test, _ = chimera_split(n, 8)
+        self.X = X
+        self.Y = generators.classes(y, n_classes=n_classes)
+        self.model = self._model(n_classes)
+        self.model.fit(self.X, self.Y)
+
+    def _model(self, n_classes):
+        return gpmodel.GPMultiClassifier([gpkernel.SEKernel()
+                                          for _ in range(n_classes)])
+
+    def time_fit(self, n, n_classes):
+        self._model(n_classes).fit(self.X, self.Y)
+
+    def peakmem_fit(self, n, n_classes):
+        self._model(n_classes).fit(self.X, self.Y)
+
+    def time_predict(self, n, n_classes):
+        self.model.predict(self.X_test[:self.n_test])
+
+
+class LassoSuite(object):
+
+    """ LassoGPRegressor, which refits the GP for each penalty. """
+
+    params = [[100, 400]]
+    param_names = ['n']
+    timeout = 900
+
+    def setup(self, n):
+        self.X, self.y, self.X_test, _ = chimera_split(n, 8)
+
+    def time_fit(self, n):
+        gpmodel.LassoGPRegressor(gpkernel.SEKernel()).fit(self.X, self.y)
+
+    def peakmem_fit(self, n):
+        gpmodel.LassoGPRegressor(gpkernel.SEKernel()).fit(self.X, self.y)
+
+
+class EntropySuite(object):
+
+    """ Lazy-greedy entropy maximization over candidate chimeras. """
+
+    params = [[100, 400], [10]]
+    param_names = ['n_candidates', 'n_select']
+    timeout = 600
+
+    def setup(self, n_candidates, n_select):
+        X, _, _ = generators.chimera_data(n_candidates + 50, n_blocks=8)
+        self.candidates = X[50:]
+        self.entropy = gpentropy.GPEntropy(gpkernel.SEKernel(), (1.0, 2.0),
+                                           var_n=0.1, observations=X[:50])
+
+    def time_maximize_entropy(self, n_candidates, n_select):
+        self.entropy.maximize_entropy(self.candidates, n_select)
+
+    def peakmem_maximize_entropy(self, n_candidates, n_select):
+        self.entropy.maximize_entropy(self.candidates, n_select)
+
+
+# Starting (var_n, sigma_f, ell) for EngineSuite. With the default
+# guesses of 0.9 the SE kernel is nearly zero between one-hot chimeras,
+# and engines fit without analytic gradients stall there.
+ENGINE_GUESSES = (0.1, 1.0, 10.0)
+
+
+def make_engine(name):
+    """ A regression model by engine name, all with the SE kernel. """
+    kernel = gpkernel.SEKernel()
+    if name == 'exact':
+        model = gpmodel.GPRegressor(kernel)
+    elif name == 'float32':
+        model = gpmodel.GPRegressor(kernel, dtype='float32')
+    elif name == 'sparse':
+        model = gpmodel.SparseGPRegressor(kernel, inducing=100)
+    elif name == 'random_features':
+        model = gpmodel.RandomFeatureGPRegressor(kernel, n_features=500)
+    elif name == 'iterative':
+        model = gpmodel.IterativeGPRegressor(kernel)
+    elif name == 'out_of_core':
+        model = gpmodel.OutOfCoreGPRegressor(kernel, tile_size=256)
+    else:
+        raise ValueError(name)
+    model.guesses = ENGINE_GUESSES
+    return model
+
+
+# Exact predictions for EngineSuite, by n
+_exact_means = {}
+
+
+class EngineSuite(object):
+
+    """ Each regression engine against the exact baseline.
+
+    track_rmse_vs_exact is the RMSE between the engine's predictive
+    means and those of the exact GPRegressor on the same data, in
+    units of the standard deviation of y.
+    """
+
+    params = [[400, 1000], ['exact', 'float32', 'sparse', 'random_features',
+                            'iterative', 'out_of_core']]
+    param_names = ['n', 'engine']
+    timeout = 900
+
+    def setup(self, n, engine):
+        self.X, self.y, self.X_test, _ = chimera_split(n, 10)
+        self.model = make_engine(engine)
+        self.model.fit(self.X, self.y)
+        if n not in _exact_means:
+            exact = make_engine('exact')
+            exact.fit(self.X, self.y)
+            _exact_means[n] = exact.predict(self.X_test, return_cov=False)[0]
+
+    def time_fit(self, n, engine):
+        make_engine(engine).fit(self.X, self.y)
+
+    def peakmem_fit(self, n, engine):
+        make_engine(engine).fit(self.X, self.y)
+
+    def time_predict(self, n, engine):
+        self.model.predict(self.X_test, return_cov=False)
+
+    def track_rmse_vs_exact(self, n, engine):
+        E = self.model.predict(self.X_test, return_cov=False)[0]
+        return float(np.sqrt(np.mean((E - _exact_means[n]) ** 2)) /
+                     np.std(self.y))
+
+
+# Cached fitted models for ThreadedPredictSuite, by n
+_threaded_models = {}
+
+
+class ThreadedPredictSuite(object):
+
+    """ Concurrent predictions from one shared GPRegressor.
+
+    Each thread predicts batches of batch_size inputs from the
+    model's published snapshot, so throughput should grow with the
+    number of threads while NumPy and BLAS release the GIL.
+    track_predictions_per_second is the best of three runs over
+    n_candidates inputs.
+    """
+
+    n_candidates = 4000
+    batch_size = 20
+
+    params = [[400, 2000], [1, 2, 4, 8]]
+    param_names = ['n', 'n_threads']
+    timeout = 900
+
+    def setup(self, n, n_threads):
+        X, y, _ = generators.chimera_data(n + self.n_candidates, n_blocks=10)
+        if n not in _threaded_models:
+            model = gpmodel.GPRegressor(gpkernel.SEKernel(),
+                                        guesses=ENGINE_GUESSES)
+            model.fit(X[:n], y[:n])
+            _threaded_models[n] = model
+        self.model = _threaded_models[n]
+        candidates = X[n:]
+        self.batches = [candidates[i:i + self.batch_size]
+                        for i in range(0, len(candidates), self.batch_size)]
+        self.pool = futures.ThreadPoolExecutor(n_threads)
+
+    def teardown(self, n, n_threads):
+        self.pool.shutdown()
+
+    def _predict_all(self):
+        predict = lambda X: self.model.predict(X, return_cov=False)
+        list(self.pool.map(predict, self.batches))
+
+    def time_predict(self, n, n_threads):
+        self._predict_all()
+
+    def track_predictions_per_second(self, n, n_threads):
+        best = np.inf
+        for _ in range(3):
+            start = time.perf_counter()
+            self._predict_all()
+            best = min(best, time.perf_counter() - start)
+        return self.n_candidates / best
+
+    track_predictions_per_second.unit = 'predictions/s'
+
+
+def make_executor(name, n_workers):
+    """ A new gpparallel executor by benchmark name. """
+    if name == 'serial':
+        return gpparallel.SerialExecutor()
+    if name == 'threads':
+        return gpparallel.ThreadExecutor(n_workers)
+    if name == 'processes':
+        return gpparallel.ProcessExecutor(n_workers)
+    raise ValueError(name)
+
+
+class ExecutorSuite(object):
+
+    """ Multi-start fits and out-of-core Gram matrices by backend.
+
+    Each executor has four workers (fewer if the thread budget is
+    smaller). The out-of-core model has tiles of n / 4 rows, so the
+    last row of tiles has four independent tiles.
+    """
+
+    n_workers = 4
+
+    params = [[400, 2000], ['serial', 'threads', 'processes']]
+    param_names = ['n', 'backend']
+    timeout = 900
+
+    def setup(self, n, backend):
+        self.X, self.y, _ = generators.chimera_data(n, n_blocks=10)
+        self.executor = make_executor(backend, self.n_workers)
+        self.out_of_core = gpmodel.OutOfCoreGPRegressor(
+            gpkernel.SEKernel(), tile_size=n // 4)
+        self.out_of_core.X = self.X
+        self.out_of_core.Y = self.y
+        self.out_of_core._ell = n
+        self.out_of_core._fit_kernel(self.X)
+        self.out_of_core._set_targets()
+        # Activate the executor and start its pool before timing
+        self.executor.__enter__()
+        self.executor.map(len, [[0], [0]])
+
+    def teardown(self, n, backend):
+        self.executor.__exit__(None, None, None)
+
+    def time_multistart_fit(self, n, backend):
+        model = gpmodel.GPRegressor(gpkernel.SEKernel(),
+                                    n_starts=self.n_workers)
+        model.fit(self.X, self.y)
+
+    def time_out_of_core_gram(self, n, backend):
+        self.out_of_core._gram(np.ones(3))
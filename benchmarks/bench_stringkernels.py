@@ -0,0 +1,147 @@
+''' Microbenchmarks for the string kernels, checked against oracles.
+
+Each suite sweeps the parameters that drive the kernel's cost and
+reports the time for an n x n covariance, the throughput in kernel
+entries per second, and the largest difference from the slow
+reference implementation in benchmarks/oracles.py on the first
+n_check sequences. A difference above oracles.TOLERANCE is reported
+as an error, so an optimization that changes the kernel fails the
+run:
+
+    python -m benchmarks.run --filter stringkernels
+'''
+
+import time
+
+import numpy as np
+
+from gpmodel import stringkernel
+
+from benchmarks import generators
+from benchmarks import oracles
+
+N_SEQS = 100
+
+
+def throughput(f, n_entries, repeat=3):
+    """ Entries per second for the fastest of repeat calls to f. """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return n_entries / best
+
+
+def coded_sequences(n, length, n_letters, seed=0):
+    """ Integer-coded point mutants over the first n_letters letters. """
+    alphabet = generators.AMINO_ACIDS[:n_letters]
+    seqs = generators.protein_sequences(n, length, n_mutations=length // 5,
+                                        alphabet=alphabet, seed=seed)
+    return generators.encode(seqs, alphabet=alphabet)
+
+
+class WeightedDecompositionSuite(object):
+
+    """ WeightedDecompositionKernel by length, alphabet, and contacts. """
+
+    n_check = 20
+
+    params = [[50, 200], [4, 20], [1, 4]]
+    param_names = ['length', 'n_letters', 'contacts_per_position']
+    timeout = 600
+
+    def setup(self, length, n_letters, contacts_per_position):
+        self.X = coded_sequences(N_SEQS, length, n_letters)
+        self.S = generators.substitution_matrix(n_letters)
+        contacts = generators.contact_map(length,
+                                          contacts_per_position * length)
+        self.kernel = stringkernel.WeightedDecompositionKernel(
+            contacts, self.S, length)
+
+    def time_cov(self, length, n_letters, contacts_per_position):
+        self.kernel.cov(self.X, self.X)
+
+    def track_entries_per_second(self, length, n_letters,
+                                 contacts_per_position):
+        return throughput(lambda: self.kernel.cov(self.X, self.X),
+                          len(self.X) ** 2)
+
+    track_entries_per_second.unit = 'entries/s'
+
+    def track_oracle_error(self, length, n_letters, contacts_per_position):
+        X = self.X[:self.n_check]
+        return oracles.check(self.kernel.cov(X, X),
+                             oracles.weighted_decomposition(
+                                 X, X, self.S, self.kernel.graph))[0]
+
+
+class SmoothDecompositionSuite(object):
+
+    """ SmoothDecompositionKernel by length and alphabet. """
+
+    n_check = 20
+
+    params = [[50, 200], [4, 20]]
+    param_names = ['length', 'n_letters']
+    timeout = 600
+
+    def setup(self, length, n_letters):
+        self.X = coded_sequences(N_SEQS, length, n_letters)
+        self.S = generators.substitution_matrix(n_letters)
+        self.kernel = stringkernel.SmoothDecompositionKernel(
+            generators.distance_matrix(length), self.S)
+
+    def time_cov(self, length, n_letters):
+        self.kernel.cov(self.X, self.X)
+
+    def track_entries_per_second(self, length, n_letters):
+        return throughput(lambda: self.kernel.cov(self.X, self.X),
+                          len(self.X) ** 2)
+
+    track_entries_per_second.unit = 'entries/s'
+
+    def track_oracle_error(self, length, n_letters):
+        X = self.X[:self.n_check]
+        return oracles.check(self.kernel.cov(X, X),
+                             oracles.smooth_decomposition(
+                                 X, X, self.S, self.kernel.adj))[0]
+
+
+class MismatchSuite(object):
+
+    """ MismatchKernel by length, k, m, and alphabet.
+
+    The kmer tree has n_letters ** k leaves, so k is kept small for
+    the protein alphabet.
+    """
+
+    n_check = 10
+
+    params = [[20, 50], [3, 4], [1, 2], [4, 20]]
+    param_names = ['length', 'k', 'm', 'n_letters']
+    timeout = 900
+
+    def setup(self, length, k, m, n_letters):
+        if m >= k:
+            raise NotImplementedError
+        self.alphabet = list(generators.AMINO_ACIDS[:n_letters])
+        self.seqs = generators.protein_sequences(
+            N_SEQS, length, n_mutations=length // 5,
+            alphabet=self.alphabet)
+        self.kernel = stringkernel.MismatchKernel(k, self.alphabet, m)
+
+    def time_cov(self, length, k, m, n_letters):
+        self.kernel.cov(self.seqs, self.seqs)
+
+    def track_entries_per_second(self, length, k, m, n_letters):
+        return throughput(lambda: self.kernel.cov(self.seqs, self.seqs),
+                          len(self.seqs) ** 2)
+
+    track_entries_per_second.unit = 'entries/s'
+
+    def track_oracle_error(self, length, k, m, n_letters):
+        seqs = self.seqs[:self.n_check]
+        return oracles.check(self.kernel.cov(seqs, seqs),
+                             oracles.mismatch(seqs, seqs, k, m,
+                                              self.alphabet))[0]
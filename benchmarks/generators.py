@@ -0,0 +1,189 @@
+''' Synthetic SCHEMA-style chimera libraries and protein sequences.
+
+Every generator takes a seed, so benchmark inputs are reproducible
+across runs and machines.
+'''
+
+import itertools
+
+import numpy as np
+
+from gpmodel import chimera_tools
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def parents(n_parents, length, identity=0.6, seed=0):
+    """ Random parent sequences that share a fraction of positions.
+
+    Parameters:
+        n_parents (int)
+        length (int)
+        identity (float): fraction of positions where every parent
+            has the same residue
+        seed (int)
+
+    Returns:
+        sample_space (list): length tuples of the parental residues
+    """
+    rng = np.random.RandomState(seed)
+    conserved = rng.random_sample(length) < identity
+    sample_space = []
+    for pos in range(length):
+        if conserved[pos]:
+            aa = AMINO_ACIDS[rng.randint(len(AMINO_ACIDS))]
+            sample_space.append((aa, ) * n_parents)
+        else:
+            residues = rng.choice(list(AMINO_ACIDS), size=n_parents)
+            sample_space.append(tuple(residues))
+    return sample_space
+
+
+def chimera_library(n_parents=3, n_blocks=8, block_length=10,
+                    identity=0.6, seed=0):
+    """ Parents, contiguous block assignments, and contacts.
+
+    Contacts are drawn between random pairs of positions, more
+    often between nearby ones.
+
+    Returns:
+        sample_space (list)
+        assignments (dict): position to zero-indexed block
+        contacts (list): (pos1, pos2) pairs
+    """
+    length = n_blocks * block_length
+    sample_space = parents(n_parents, length, identity=identity, seed=seed)
+    assignments = {pos: pos // block_length for pos in range(length)}
+    rng = np.random.RandomState(seed + 1)
+    contacts = set()
+    while len(contacts) < 2 * length:
+        i = rng.randint(length)
+        j = int(np.clip(i + rng.geometric(0.1) * rng.choice([-1, 1]),
+                        0, length - 1))
+        if i != j:
+            contacts.add((min(i, j), max(i, j)))
+    return sample_space, assignments, sorted(contacts)
+
+
+def chimera_codes(n, n_parents=3, n_blocks=8, seed=0):
+    """ n distinct random chimera codes (all of them if n is larger). """
+    n_total = n_parents ** n_blocks
+    rng = np.random.RandomState(seed)
+    if n >= n_total:
+        inds = np.arange(n_total)
+    else:
+        inds = rng.choice(n_total, size=n, replace=False)
+    shape = (n_parents, ) * n_blocks
+    codes = np.array(np.unravel_index(inds, shape)).T
+    return [''.join(str(c) for c in code) for code in codes]
+
+
+def chimera_data(n, n_parents=3, n_blocks=8, block_length=10,
+                 contacts=True, noise=0.1, seed=0):
+    """ One-hot chimera features with a sparse additive response.
+
+    The features are the sequence terms (and, optionally, the
+    contact terms) of chimera_tools.make_X, collapsed so that no two
+    columns covary completely. The response is a sparse linear
+    function of the features plus Gaussian noise.
+
+    Returns:
+        X (np.ndarray): n x d binary features
+        y (np.ndarray): n
+        seqs (list): the chimera sequences as strings
+    """
+    sample_space, assignments, library_contacts = chimera_library(
+        n_parents=n_parents, n_blocks=n_blocks, block_length=block_length,
+        seed=seed)
+    codes = chimera_codes(n, n_parents=n_parents, n_blocks=n_blocks,
+                          seed=seed)
+    seqs = [''.join(chimera_tools.make_sequence(code, assignments,
+                                                sample_space))
+            for code in codes]
+    X, _ = chimera_tools.make_X(
+        seqs, sample_space=sample_space,
+        contacts=library_contacts if contacts else None)
+    X = np.asarray(X, dtype=float)
+    rng = np.random.RandomState(seed + 2)
+    weights = rng.standard_normal(X.shape[1])
+    weights[rng.random_sample(X.shape[1]) < 0.7] = 0
+    y = X @ weights
+    y = (y - y.mean()) / (y.std() + 1e-12)
+    y += rng.normal(scale=noise, size=len(y))
+    return X, y, seqs
+
+
+def classes(y, n_classes=2):
+    """ Class labels from quantiles of y.
+
+    Returns:
+        labels (np.ndarray): -1 and 1 if n_classes is 2, otherwise
+            an n x n_classes one-hot array
+    """
+    edges = np.percentile(y, np.linspace(0, 100, n_classes + 1)[1:-1])
+    inds = np.searchsorted(edges, y)
+    if n_classes == 2:
+        return np.where(inds == 1, 1, -1)
+    return np.eye(n_classes)[inds]
+
+
+def protein_sequences(n, length, n_mutations=5, alphabet=AMINO_ACIDS,
+                      seed=0):
+    """ Point mutants of one random parent sequence.
+
+    Returns:
+        seqs (list): n strings of the given length
+    """
+    rng = np.random.RandomState(seed)
+    parent = rng.choice(list(alphabet), size=length)
+    seqs = []
+    for _ in range(n):
+        seq = parent.copy()
+        positions = rng.choice(length, size=n_mutations, replace=False)
+        seq[positions] = rng.choice(list(alphabet), size=n_mutations)
+        seqs.append(''.join(seq))
+    return seqs
+
+
+def encode(seqs, alphabet=AMINO_ACIDS):
+    """ Integer-code sequences for the string kernels.
+
+    Returns:
+        X (np.ndarray): n x length integer array
+    """
+    index = {aa: i for i, aa in enumerate(alphabet)}
+    return np.array([[index[aa] for aa in seq] for seq in seqs])
+
+
+def contact_map(length, n_contacts, seed=0):
+    """ Random (pos1, pos2) contacts between distinct positions. """
+    rng = np.random.RandomState(seed)
+    pairs = list(itertools.combinations(range(length), 2))
+    inds = rng.choice(len(pairs), size=min(n_contacts, len(pairs)),
+                      replace=False)
+    return sorted(pairs[i] for i in inds)
+
+
+def substitution_matrix(n_letters, seed=0):
+    """ A random symmetric substitution matrix with a unit diagonal.
+
+    Off-diagonal entries are uniform in [0, 1), so the decomposition
+    kernels built from it are positive on every pair.
+    """
+    rng = np.random.RandomState(seed)
+    S = rng.random_sample((n_letters, n_letters))
+    S = (S + S.T) / 2
+    np.fill_diagonal(S, 1.0)
+    return S
+
+
+def distance_matrix(length, seed=0):
+    """ Pairwise distances between random positions in a 3D chain.
+
+    Consecutive positions are 3.8 apart, as for alpha carbons.
+    """
+    rng = np.random.RandomState(seed)
+    steps = rng.standard_normal((length, 3))
+    steps *= 3.8 / np.linalg.norm(steps, axis=1, keepdims=True)
+    coords = np.cumsum(steps, axis=0)
+    return np.linalg.norm(coords[:, None] - coords[None, :], axis=-1)
@@ -0,0 +1,95 @@
+''' Slow reference implementations of the string kernels.
+
+Each oracle computes the normalized kernel directly from its
+definition, one pair of sequences at a time, so it can be trusted to
+check optimized implementations. They are only practical for small
+inputs.
+'''
+
+import itertools
+from collections import Counter
+
+import numpy as np
+
+from gpmodel import stringkernel
+
+# Largest difference from an oracle that still counts as agreement
+TOLERANCE = 1e-10
+
+
+def _normalize(K12, K11, K22):
+    return K12 / np.sqrt(K11)[:, None] / np.sqrt(K22)[None, :]
+
+
+def _pairwise(f, X1, X2):
+    K12 = np.array([[f(x1, x2) for x2 in X2] for x1 in X1])
+    K11 = np.array([f(x, x) for x in X1])
+    K22 = np.array([f(x, x) for x in X2])
+    return _normalize(K12, K11, K22)
+
+
+def weighted_decomposition(X1, X2, S, graph):
+    """ WeightedDecompositionKernel from the padded contact graph.
+
+    Parameters:
+        X1, X2 (np.ndarray): integer-coded sequences
+        S (np.ndarray): substitution matrix
+        graph (np.ndarray): neighbors of each position, padded with -1
+    """
+    def f(x1, x2):
+        subs = np.zeros(len(x1) + 1)
+        subs[:-1] = S[x1, x2]
+        return stringkernel.wdk(subs, graph)
+    return _pairwise(f, X1, X2)
+
+
+def smooth_decomposition(X1, X2, S, adj):
+    """ SmoothDecompositionKernel from the smoothed adjacency matrix. """
+    return _pairwise(lambda x1, x2: stringkernel.sdk(S[x1, x2], adj), X1, X2)
+
+
+def mismatch(seqs1, seqs2, k, m, alphabet):
+    """ MismatchKernel from the explicit (k, m)-mismatch feature map.
+
+    The feature for each of the len(alphabet) ** k kmers counts the
+    kmers in the sequence within m mismatches of it.
+    """
+    index = {a: i for i, a in enumerate(alphabet)}
+    kmers = np.array(list(itertools.product(range(len(alphabet)), repeat=k)))
+
+    def features(seq):
+        counts = Counter(seq[i:i + k] for i in range(len(seq) - k + 1))
+        phi = np.zeros(len(kmers))
+        for kmer, count in counts.items():
+            coded = np.array([index[a] for a in kmer])
+            close = np.sum(kmers != coded, axis=1) <= m
+            phi += count * close
+        return phi
+
+    F1 = np.array([features(seq) for seq in seqs1])
+    F2 = np.array([features(seq) for seq in seqs2])
+    return _normalize(F1 @ F2.T, np.sum(F1 ** 2, axis=1),
+                      np.sum(F2 ** 2, axis=1))
+
+
+def check(K, K_oracle, tolerance=TOLERANCE):
+    """ Compare a kernel to its oracle.
+
+    Returns:
+        max_error (float): largest absolute difference
+        bitwise (Boolean): whether every entry is identical
+
+    Raises:
+        AssertionError if the difference exceeds tolerance or the
+            shapes differ.
+    """
+    K = np.asarray(K)
+    K_oracle = np.asarray(K_oracle)
+    if K.shape != K_oracle.shape:
+        raise AssertionError('Shape %s does not match the oracle %s'
+                             % (K.shape, K_oracle.shape))
+    max_error = float(np.max(np.abs(K - K_oracle), initial=0.0))
+    if not max_error <= tolerance:
+        raise AssertionError('Kernel differs from the oracle by %g'
+                             % max_error)
+    return max_error, bool(np.array_equal(K, K_oracle))
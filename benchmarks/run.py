@@ -0,0 +1,225 @@
+''' Run the benchmark suites, store the results, and compare runs.
+
+The suites in the bench_*.py modules follow the asv conventions, so
+they can also be run with asv. This runner needs nothing beyond the
+package's own dependencies:
+
+    python -m benchmarks.run --quick
+    python -m benchmarks.run --filter Engine --output new.json \\
+        --compare benchmarks/results/baseline.json
+
+time_ methods report the best of --repeat wall-clock runs in
+seconds, peakmem_ methods the peak memory allocated during one run
+in bytes (traced with tracemalloc, so it counts NumPy arrays but not
+memory held by BLAS), and track_ methods their return value, in the
+method's unit attribute if it has one. A
+comparison flags time_ and peakmem_ results that grew by more than
+--threshold times, and exits with status 1 if there were any.
+'''
+
+import argparse
+import datetime
+import importlib
+import itertools
+import json
+import os
+import pkgutil
+import platform
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'results')
+PREFIXES = ('time_', 'peakmem_', 'track_')
+
+
+def suites():
+    """ (name, class) for every suite in the bench_ modules. """
+    package = os.path.dirname(os.path.abspath(__file__))
+    found = []
+    for info in sorted(pkgutil.iter_modules([package]),
+                       key=lambda m: m.name):
+        if not info.name.startswith('bench_'):
+            continue
+        module = importlib.import_module('benchmarks.' + info.name)
+        for name, obj in sorted(vars(module).items()):
+            if isinstance(obj, type) and name.endswith('Suite') and \
+                    obj.__module__ == module.__name__:
+                found.append(('%s.%s' % (info.name, name), obj))
+    return found
+
+
+def param_grid(suite, quick=False):
+    """ Every combination of the suite's params.
+
+    With quick, only the first value of each parameter is used.
+    """
+    params = getattr(suite, 'params', [])
+    if params and not isinstance(params[0], (list, tuple)):
+        params = [params]
+    if quick:
+        params = [p[:1] for p in params]
+    names = getattr(suite, 'param_names', ['p%d' % i
+                                           for i in range(len(params))])
+    return names, list(itertools.product(*params))
+
+
+def measure(method, args, kind, repeat):
+    """ Run one benchmark method and return its result dict. """
+    if kind == 'time_':
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            method(*args)
+            times.append(time.perf_counter() - start)
+        return {'value': min(times), 'unit': 's',
+                'median': float(np.median(times)), 'repeat': repeat}
+    if kind == 'peakmem_':
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        method(*args)
+        peak = tracemalloc.get_traced_memory()[1] - base
+        if not tracing:
+            tracemalloc.stop()
+        return {'value': peak, 'unit': 'bytes'}
+    return {'value': method(*args), 'unit': getattr(method, 'unit', 'value')}
+
+
+def run(pattern=None, quick=False, repeat=3, log=print):
+    """ Run the matching benchmarks.
+
+    Parameters:
+        pattern (string): regular expression matched against
+            'module.Suite.method'
+        quick (Boolean): only the first value of each parameter
+        repeat (int): runs of each time_ method
+        log (function): called with a line for each result
+
+    Returns:
+        results (dict): benchmark key to result dict
+    """
+    results = {}
+    for suite_name, suite in suites():
+        methods = [m for m in sorted(dir(suite)) if m.startswith(PREFIXES)]
+        methods = [m for m in methods if pattern is None or
+                   re.search(pattern, '%s.%s' % (suite_name, m))]
+        if not methods:
+            continue
+        names, grid = param_grid(suite, quick=quick)
+        for args in grid:
+            label = ', '.join('%s=%s' % kv for kv in zip(names, args))
+            bench = suite()
+            try:
+                if hasattr(bench, 'setup'):
+                    bench.setup(*args)
+            except NotImplementedError:
+                continue
+            except Exception as e:
+                for m in methods:
+                    key = '%s.%s(%s)' % (suite_name, m, label)
+                    results[key] = {'error': 'setup: %r' % e}
+                    log('%-70s ERROR %r' % (key, e))
+                continue
+            for m in methods:
+                key = '%s.%s(%s)' % (suite_name, m, label)
+                kind = next(p for p in PREFIXES if m.startswith(p))
+                try:
+                    result = measure(getattr(bench, m), args, kind, repeat)
+                except Exception as e:
+                    result = {'error': repr(e)}
+                    log('%-70s ERROR %r' % (key, e))
+                else:
+                    log('%-70s %12.4g %s' % (key, result['value'],
+                                             result['unit']))
+                results[key] = result
+            if hasattr(bench, 'teardown'):
+                bench.teardown(*args)
+    return results
+
+
+def machine():
+    """ A description of the machine and the code being measured. """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'scipy': scipy.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds')}
+
+
+def compare(new, old, threshold=1.25):
+    """ Ratios of new to old for the time_ and peakmem_ results.
+
+    Parameters:
+        new, old (dict): results from run
+        threshold (float): ratio above which a result regressed
+
+    Returns:
+        rows (list): (key, old value, new value, ratio, regressed)
+    """
+    rows = []
+    for key in sorted(set(new) & set(old)):
+        method = key.split('(')[0].split('.')[-1]
+        if not method.startswith(('time_', 'peakmem_')):
+            continue
+        if 'value' not in new[key] or 'value' not in old[key]:
+            continue
+        before, after = old[key]['value'], new[key]['value']
+        ratio = after / before if before else float('inf')
+        rows.append((key, before, after, ratio, ratio > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--filter', help='regular expression for '
+                        'module.Suite.method')
+    parser.add_argument('--quick', action='store_true',
+                        help='only the first value of each parameter')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='where to write the results. '
+                        'Default is benchmarks/results/<commit>-<date>.json')
+    parser.add_argument('--compare', help='earlier results to compare with')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args(argv)
+    results = run(args.filter, quick=args.quick, repeat=args.repeat)
+    info = machine()
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = info['date'].replace(':', '')
+        output = os.path.join(RESULTS_DIR, '%s-%s.json' %
+                              ((info['commit'] or 'local')[:8], stamp))
+    with open(output, 'w') as f:
+        json.dump({'machine': info, 'results': results}, f, indent=2,
+                  default=float)
+    print('Results written to ' + output)
+    if args.compare is None:
+        return 0
+    with open(args.compare) as f:
+        old = json.load(f)['results']
+    rows = compare(results, old, threshold=args.threshold)
+    regressed = [row for row in rows if row[4]]
+    for key, before, after, ratio, bad in rows:
+        print('%-70s %10.4g -> %10.4g  x%.2f%s' %
+              (key, before, after, ratio, '  REGRESSION' if bad else ''))
+    print('%d of %d results regressed by more than x%.2f' %
+          (len(regressed), len(rows), args.threshold))
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
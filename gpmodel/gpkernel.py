@@ -4,8 +4,12 @@ import numpy as np
 import pandas as pd
 from sys import exit
 import abc
+import copy
 
 from scipy.spatial import distance
+from scipy import linalg
+
+from gpmodel import gplinalg
 
 
 class BaseKernel(abc.ABC):
@@ -30,6 +34,105 @@ class BaseKernel(abc.ABC):
     def fit(self, X):
         return self._n_hypers
 
+    def extend(self, X, X_new):
+        """ Extend the precomputed values for X to include X_new.
+
+        Equivalent to fit(X + X_new), which kernels override to only
+        compute the values involving X_new.
+
+        Parameters:
+            X (np.ndarray): inputs the kernel was fit on
+            X_new (np.ndarray): new inputs
+
+        Returns:
+            n_hypers (int)
+        """
+        return self.fit(np.concatenate((X, X_new)))
+
+    @staticmethod
+    def _extend_saved(saved, cross, new):
+        """ Return the block matrix [[saved, cross], [cross.T, new]]. """
+        return np.block([[saved, cross], [cross.T, new]])
+
+    def astype(self, dtype):
+        """ Store the floating point values saved by fit as dtype.
+
+        Returns:
+            self
+        """
+        saved = getattr(self, '_saved', None)
+        if isinstance(saved, list):
+            self._saved = [self._cast(s, dtype) for s in saved]
+        elif saved is not None:
+            self._saved = self._cast(saved, dtype)
+        return self
+
+    def compact(self):
+        """ Return a copy without the values saved by fit.
+
+        The copy can still compute the covariance between given
+        inputs, which is all a fitted model needs to predict.
+        """
+        kernel = copy.copy(self)
+        if getattr(kernel, '_saved', None) is not None:
+            kernel._saved = None
+        return kernel
+
+    @staticmethod
+    def _cast(A, dtype):
+        """ Cast A to dtype if it is a floating point array. """
+        A = np.asarray(A)
+        if A.dtype.kind == 'f':
+            return A.astype(dtype, copy=False)
+        return A
+
+    def diag(self, X, hypers=None):
+        """ Calculate the variance of each input.
+
+        Equivalent to np.diag(self.cov(X, X, hypers)), which kernels
+        override to avoid forming the full covariance matrix.
+
+        Returns:
+            k (np.ndarray): n
+        """
+        if hypers is None:
+            return np.diag(self.cov(X, X))
+        return np.diag(self.cov(X, X, hypers=hypers))
+
+    def grad(self, X1=None, X2=None, hypers=None):
+        """ Calculate the gradient of the covariance.
+
+        Returns:
+            dK (np.ndarray): n_hypers x n1 x n2 derivatives of the
+                covariance with respect to each hyperparameter
+        """
+        raise NotImplementedError(type(self).__name__ +
+                                  ' does not implement grad')
+
+    def grad_iter(self, X1=None, X2=None, hypers=None):
+        """ Generate the gradient one hyperparameter at a time.
+
+        Kernels with many hyperparameters override this so that only
+        one n1 x n2 derivative is held in memory at once.
+
+        Yields:
+            dK_j (np.ndarray): n1 x n2
+        """
+        if hypers is None:
+            yield from self.grad(X1, X2)
+        else:
+            yield from self.grad(X1, X2, hypers=hypers)
+
+    def has_grad(self):
+        """ Whether the kernel implements grad or grad_iter.
+
+        Models fit kernels without them by differentiating the
+        objective numerically.
+        """
+        cls = type(self)
+        return cls.grad is not BaseKernel.grad or \
+            cls.grad_iter is not BaseKernel.grad_iter
+
 
 class PolynomialKernel(BaseKernel):
 
@@ -60,6 +163,12 @@ class PolynomialKernel(BaseKernel):
         self._saved = X @ X.T
         return self._n_hypers
 
+    def extend(self, X, X_new):
+        """ Extend the remembered input with X_new. """
+        self._saved = self._extend_saved(self._saved, X @ X_new.T,
+                                         X_new @ X_new.T)
+        return self._n_hypers
+
     def cov(self, X1=None, X2=None, hypers=(1.0, 1.0)):
         """ Calculate the polynomial covariance matrix between X1 and X2.
 
@@ -79,6 +188,41 @@ class PolynomialKernel(BaseKernel):
                             self._deg)
         return np.power(sigma_0 ** 2 + sigma_p ** 2 * X1 @ X2.T, self._deg)
 
+    def diag(self, X, hypers=(1.0, 1.0)):
+        """ Calculate the polynomial variance of each row of X.
+
+        Parameters:
+            X (np.ndarray):
+            hypers (iterable):
+
+        Returns:
+            k (np.ndarray): n
+        """
+        sigma_0, sigma_p = hypers
+        return np.power(sigma_0 ** 2 + sigma_p ** 2 * np.sum(X ** 2, axis=1),
+                        self._deg)
+
+    def grad(self, X1=None, X2=None, hypers=(1.0, 1.0)):
+        """ Calculate the gradient of the polynomial covariance.
+
+        Parameters:
+            X1 (np.ndarray):
+            X2 (np.ndarray):
+            hypers (iterable):
+
+        Returns:
+            dK (np.ndarray): 2 x n1 x n2
+        """
+        sigma_0, sigma_p = hypers
+        if X1 is None and X2 is None:
+            S = self._saved
+        else:
+            S = X1 @ X2.T
+        d_inside = self._deg * np.power(sigma_0 ** 2 + sigma_p ** 2 * S,
+                                        self._deg - 1)
+        return np.stack((2 * sigma_0 * d_inside,
+                         2 * sigma_p * S * d_inside))
+
 
 class BaseRadialKernel(BaseKernel):
 
@@ -95,6 +239,50 @@ class BaseRadialKernel(BaseKernel):
         self._saved = self._distance(X, X)
         return self._n_hypers
 
+    def extend(self, X, X_new):
+        self._saved = self._extend_saved(self._saved,
+                                         self._distance(X, X_new),
+                                         self._distance(X_new, X_new))
+        return self._n_hypers
+
+    def fit_features(self, X, n_features, seed=0):
+        """ Draw the random frequencies used by features.
+
+        The frequencies are drawn for unit lengthscales from a
+        generator seeded with seed, so the same seed always gives
+        the same feature map.
+
+        Parameters:
+            X (np.ndarray): n x d
+            n_features (int): number of features. Half are cosines
+                and half are sines of the same frequencies.
+            seed (int)
+
+        Returns:
+            n_hypers (int)
+        """
+        rng = np.random.RandomState(seed)
+        self._omega = self._spectral_sample(rng, X.shape[1],
+                                            n_features // 2)
+        return self._n_hypers
+
+    def _spectral_sample(self, rng, d, m):
+        """ Draw m frequencies from the kernel's spectral density. """
+        raise NotImplementedError(type(self).__name__ +
+                                  ' does not implement features')
+
+    def _fourier(self, X, L, sigma_f=1.0):
+        """ Random Fourier features with lengthscales L.
+
+        Returns:
+            Phi (np.ndarray): n x n_features, with Phi @ Phi.T
+                approximately equal to the kernel
+        """
+        L = np.reshape(np.asarray(L, dtype=float), (-1, 1))
+        P = X @ (self._omega / L)
+        scale = sigma_f / np.sqrt(P.shape[1])
+        return scale * np.concatenate((np.cos(P), np.sin(P)), axis=1)
+
     def _distance(self, X1, X2):
         """ Calculates the squared distances between rows of X1 and X2.
 
@@ -119,6 +307,13 @@ class BaseRadialARDKernel(BaseRadialKernel):
         self._saved = X
         return self._n_hypers + X.shape[1] - 1
 
+    def extend(self, X, X_new):
+        return self.fit(np.concatenate((self._saved, X_new)))
+
+    def fit_features(self, X, n_features, seed=0):
+        BaseRadialKernel.fit_features(self, X, n_features, seed=seed)
+        return self._n_hypers + X.shape[1] - 1
+
     def _distance(self, X1, X2, L):
         """ Calculates squared Mahalanobis distances between rows of X1 and X2.
 
@@ -135,11 +330,10 @@ class BaseRadialARDKernel(BaseRadialKernel):
         """
         if isinstance(L, float) or len(L) == 1:
             L = np.ones(X1.shape[1]) * L
-        L2 = L**2
-        A = np.sum(X1 ** 2 / L2, axis=1).reshape((len(X1), 1))
-        B = np.sum(X2 ** 2 / L2, axis=1).reshape((len(X2), 1)).T
-        C = 2 * (X1 / L2) @ X2.T
-        return np.abs(A + B - C)
+        # Scaling before taking differences avoids the cancellation in
+        # expanding |x1|^2 + |x2|^2 - 2 x1.x2, which is severe in float32
+        L = np.asarray(L, dtype=float)
+        return distance.cdist(X1 / L, X2 / L, metric='sqeuclidean')
 
 
 class MaternKernel(BaseRadialKernel):
@@ -168,6 +362,13 @@ class MaternKernel(BaseRadialKernel):
         self._saved = np.sqrt(self._saved)
         return self._n_hypers
 
+    def extend(self, X, X_new):
+        self._saved = self._extend_saved(
+            self._saved,
+            np.sqrt(self._distance(X, X_new)),
+            np.sqrt(self._distance(X_new, X_new)))
+        return self._n_hypers
+
     def cov(self, X1=None, X2=None, hypers=(1.0, )):
         """ Calculate the Matern kernel between X1 and X2.
 
@@ -190,6 +391,47 @@ class MaternKernel(BaseRadialKernel):
         elif self.nu == '5/2':
             return self._m52(D_L)
 
+    def diag(self, X, hypers=(1.0, )):
+        """ The Matern kernel has unit variance. """
+        return np.ones(len(X))
+
+    def grad(self, X1=None, X2=None, hypers=(1.0, )):
+        """ Calculate the gradient of the Matern kernel.
+
+        Parameters:
+            X1 (np.ndarray):
+            X2 (np.ndarray)
+            hypers (iterable): default is ell=1.0.
+
+        Returns:
+            dK (np.ndarray): 1 x n1 x n2
+        """
+        if X1 is None and X2 is None:
+            D = self._saved
+        else:
+            D = np.sqrt(self._distance(X1, X2))
+        L = hypers[0]
+        D_L = D / L
+        return np.expand_dims(self._dm(D_L) * D_L ** 2 / L, 0)
+
+    def features(self, X, hypers=(1.0, )):
+        """ Random Fourier features for the Matern kernel.
+
+        Parameters:
+            X (np.ndarray): n x d
+            hypers (iterable): default is ell=1.0.
+
+        Returns:
+            Phi (np.ndarray): n x n_features
+        """
+        return self._fourier(X, hypers[0])
+
+    def _spectral_sample(self, rng, d, m):
+        """ Multivariate t frequencies with 2 nu degrees of freedom. """
+        dof = 3.0 if self.nu == '3/2' else 5.0
+        Z = rng.standard_normal((d, m))
+        return Z / np.sqrt(rng.chisquare(dof, size=(1, m)) / dof)
+
     def _m32(self, D_L):
         return (1.0 + np.sqrt(3.0) * D_L) * np.exp(-np.sqrt(3) * D_L)
 
@@ -198,6 +440,14 @@ class MaternKernel(BaseRadialKernel):
         second = np.exp(-np.sqrt(5.0) * D_L)
         return first * second
 
+    def _dm(self, D_L):
+        """ -dk/dr / r for the Matern kernel, evaluated at r = D_L. """
+        if self.nu == '3/2':
+            return 3.0 * np.exp(-np.sqrt(3.0) * D_L)
+        elif self.nu == '5/2':
+            return 5.0 / 3.0 * (1.0 + np.sqrt(5.0) * D_L) * \
+                np.exp(-np.sqrt(5.0) * D_L)
+
 
 class ARDMaternKernel(MaternKernel, BaseRadialARDKernel):
 
@@ -215,6 +465,9 @@ class ARDMaternKernel(MaternKernel, BaseRadialARDKernel):
     def fit(self, X):
         return BaseRadialARDKernel.fit(self, X)
 
+    def extend(self, X, X_new):
+        return BaseRadialARDKernel.extend(self, X, X_new)
+
     def cov(self, X1=None, X2=None, hypers=1.0):
         """ Calculate the Matern kernel between X1 and X2.
 
@@ -234,6 +487,52 @@ class ARDMaternKernel(MaternKernel, BaseRadialARDKernel):
         elif self.nu == '5/2':
             return self._m52(D)
 
+    def diag(self, X, hypers=1.0):
+        """ The Matern kernel has unit variance. """
+        return np.ones(len(X))
+
+    def features(self, X, hypers=1.0):
+        """ Random Fourier features for the ARD Matern kernel.
+
+        Parameters:
+            X (np.ndarray): n x d
+            hypers (float or iterable): default is ell=1.0.
+
+        Returns:
+            Phi (np.ndarray): n x n_features
+        """
+        return self._fourier(X, np.atleast_1d(hypers))
+
+    def grad(self, X1=None, X2=None, hypers=1.0):
+        """ Calculate the gradient of the ARD Matern kernel.
+
+        Parameters:
+            X1 (np.ndarray):
+            X2 (np.ndarray)
+            hypers (float or iterable): default is ell=1.0.
+
+        Returns:
+            dK (np.ndarray): n_hypers x n1 x n2
+        """
+        return np.stack(list(self.grad_iter(X1, X2, hypers)))
+
+    def grad_iter(self, X1=None, X2=None, hypers=1.0):
+        """ Generate the gradient one length scale at a time.
+
+        Yields:
+            dK_j (np.ndarray): n1 x n2
+        """
+        if X1 is None and X2 is None:
+            X1, X2 = self._saved, self._saved
+        L = np.atleast_1d(hypers)
+        D = np.sqrt(super()._distance(X1, X2, L))
+        dm = self._dm(D)
+        if len(L) == 1:
+            yield dm * D ** 2 / L[0]
+            return
+        for i, ell in enumerate(L):
+            yield dm * (X1[:, [i]] - X2[:, i]) ** 2 / ell ** 3
+
 
 class SEKernel(BaseRadialKernel):
 
@@ -269,6 +568,46 @@ class SEKernel(BaseRadialKernel):
         D_L2 = D / L ** 2
         return self._se(D_L2, sigma_f)
 
+    def diag(self, X, hypers=(1.0, 1.0)):
+        """ The squared exponential kernel has variance sigma_f ** 2. """
+        return np.full(len(X), hypers[0] ** 2)
+
+    def grad(self, X1=None, X2=None, hypers=(1.0, 1.0)):
+        """ Calculate the gradient of the squared exponential kernel.
+
+        Parameters:
+            X1 (np.ndarray):
+            X2 (np.ndarray)
+            hypers (iterable): default is (1.0, 1.0)
+
+        Returns:
+            dK (np.ndarray): 2 x n1 x n2
+        """
+        if X1 is None and X2 is None:
+            D = self._saved
+        else:
+            D = self._distance(X1, X2)
+        sigma_f, L = hypers
+        E = np.exp(-0.5 * D / L ** 2)
+        return np.stack((2 * sigma_f * E, sigma_f ** 2 * E * D / L ** 3))
+
+    def features(self, X, hypers=(1.0, 1.0)):
+        """ Random Fourier features for the squared exponential kernel.
+
+        Parameters:
+            X (np.ndarray): n x d
+            hypers (iterable): default is (1.0, 1.0)
+
+        Returns:
+            Phi (np.ndarray): n x n_features
+        """
+        sigma_f, L = hypers
+        return self._fourier(X, L, sigma_f)
+
+    def _spectral_sample(self, rng, d, m):
+        """ Standard normal frequencies. """
+        return rng.standard_normal((d, m))
+
     def _se(self, D_L2, sigma_f):
         return sigma_f ** 2 * np.exp(-0.5 * D_L2)
 
@@ -305,6 +644,52 @@ class ARDSEKernel(SEKernel, BaseRadialARDKernel):
         D = super()._distance(X1, X2, L)
         return self._se(D, sigma_f)
 
+    def features(self, X, hypers=(1.0, 1.0)):
+        """ Random Fourier features for the ARD squared exponential kernel.
+
+        Parameters:
+            X (np.ndarray): n x d
+            hypers (iterable): default is ell=1.0.
+
+        Returns:
+            Phi (np.ndarray): n x n_features
+        """
+        return self._fourier(X, hypers[1::], hypers[0])
+
+    def grad(self, X1=None, X2=None, hypers=(1.0, 1.0)):
+        """ Calculate the gradient of the ARD squared exponential kernel.
+
+        Parameters:
+            X1 (np.ndarray):
+            X2 (np.ndarray)
+            hypers (iterable): default is ell=1.0.
+
+        Returns:
+            dK (np.ndarray): n_hypers x n1 x n2
+        """
+        return np.stack(list(self.grad_iter(X1, X2, hypers)))
+
+    def grad_iter(self, X1=None, X2=None, hypers=(1.0, 1.0)):
+        """ Generate the gradient one hyperparameter at a time.
+
+        Yields:
+            dK_j (np.ndarray): n1 x n2, for sigma_f and then each
+                length scale
+        """
+        if X1 is None and X2 is None:
+            X1, X2 = self._saved, self._saved
+        sigma_f = hypers[0]
+        L = np.atleast_1d(hypers[1::])
+        D = super()._distance(X1, X2, L)
+        E = np.exp(-0.5 * D)
+        yield 2 * sigma_f * E
+        K = sigma_f ** 2 * E
+        if len(L) == 1:
+            yield K * D / L[0]
+            return
+        for i, ell in enumerate(L):
+            yield K * (X1[:, [i]] - X2[:, i]) ** 2 / ell ** 3
+
 
 class SumKernel(BaseKernel):
 
@@ -332,6 +717,22 @@ class SumKernel(BaseKernel):
             n_hypers += kernel.fit(X)
         return n_hypers
 
+    def extend(self, X, X_new):
+        n_hypers = 0
+        for kernel in self._kernels:
+            n_hypers += kernel.extend(X, X_new)
+        return n_hypers
+
+    def astype(self, dtype):
+        for kernel in self._kernels:
+            kernel.astype(dtype)
+        return self
+
+    def compact(self):
+        kernel = copy.copy(self)
+        kernel._kernels = [ke.compact() for ke in self._kernels]
+        return kernel
+
     def cov(self, X1=None, X2=None, hypers=None):
         """ Calculate the sum kernel between two inputs.
 
@@ -355,6 +756,70 @@ class SumKernel(BaseKernel):
                   for i, kern in enumerate(self._kernels)]
         return sum(Ks)
 
+    def diag(self, X, hypers=None):
+        """ Calculate the sum kernel variance of each input.
+
+        Parameters:
+            X (np.ndarray):
+            hypers (iterable): the hyperparameters. Default is to use
+                the defaults for each kernel.
+
+        Returns:
+            k (np.ndarray): n
+        """
+        if hypers is None:
+            ks = [kern.diag(X) for kern in self._kernels]
+        else:
+            hypers_inds = [k._n_hypers for k in self._kernels]
+            hypers_inds = np.cumsum(np.array(hypers_inds))
+            hypers_inds = np.insert(hypers_inds, 0, 0)
+            ks = [kern.diag(X, hypers[hypers_inds[i]:hypers_inds[i+1]])
+                  for i, kern in enumerate(self._kernels)]
+        return sum(ks)
+
+    def grad(self, X1=None, X2=None, hypers=None):
+        """ Calculate the gradient of the sum kernel.
+
+        Parameters:
+            X1 (np.ndarray):
+            X2
+            hypers (iterable): the hyperparameters. Default is to use
+                the defaults for each kernel.
+
+        Returns:
+            dK (np.ndarray): n_hypers x n1 x n2
+        """
+        if hypers is None:
+            dKs = [kern.grad(X1, X2) for kern in self._kernels]
+        else:
+            hypers_inds = [k._n_hypers for k in self._kernels]
+            hypers_inds = np.cumsum(np.array(hypers_inds))
+            hypers_inds = np.insert(hypers_inds, 0, 0)
+            dKs = [kern.grad(X1, X2, hypers[hypers_inds[i]:
+                                            hypers_inds[i+1]])
+                   for i, kern in enumerate(self._kernels)]
+        return np.concatenate(dKs, axis=0)
+
+    def grad_iter(self, X1=None, X2=None, hypers=None):
+        """ Generate each member kernel's gradient in turn.
+
+        Yields:
+            dK_j (np.ndarray): n1 x n2
+        """
+        if hypers is None:
+            for kern in self._kernels:
+                yield from kern.grad_iter(X1, X2)
+            return
+        hypers_inds = [k._n_hypers for k in self._kernels]
+        hypers_inds = np.cumsum(np.array(hypers_inds))
+        hypers_inds = np.insert(hypers_inds, 0, 0)
+        for i, kern in enumerate(self._kernels):
+            yield from kern.grad_iter(X1, X2,
+                                      hypers[hypers_inds[i]:hypers_inds[i+1]])
+
+    def has_grad(self):
+        return all(kern.has_grad() for kern in self._kernels)
+
 
 class LinearKernel(BaseKernel):
 
@@ -368,6 +833,11 @@ class LinearKernel(BaseKernel):
         self._saved = X @ X.T
         return self._n_hypers
 
+    def extend(self, X, X_new):
+        self._saved = self._extend_saved(self._saved, X @ X_new.T,
+                                         X_new @ X_new.T)
+        return self._n_hypers
+
     def cov(self, X1=None, X2=None, hypers=(1.0, )):
         """ Calculate the linear kernel between x1 and x2.
 
@@ -386,3 +856,272 @@ class LinearKernel(BaseKernel):
         if X1 is None and X2 is None:
             return vp * self._saved
         return vp * X1 @ X2.T
+
+    def diag(self, X, hypers=(1.0, )):
+        """ Calculate the linear kernel variance of each row of X.
+
+        Parameters:
+            X (np.ndarray)
+            hypers (iterable): default is var_p=1.0.
+
+        Returns:
+            k (np.ndarray): n
+        """
+        return hypers[0] * np.sum(X ** 2, axis=1)
+
+    def grad(self, X1=None, X2=None, hypers=(1.0, )):
+        """ Calculate the gradient of the linear kernel.
+
+        Parameters:
+            x1 (np.ndarray)
+            x2 (np.ndarray)
+            hypers (iterable): default is var_p=1.0.
+
+        Returns:
+            dK (np.ndarray): 1 x n1 x n2
+        """
+        if X1 is None and X2 is None:
+            return np.expand_dims(self._saved, 0)
+        return np.expand_dims(X1 @ X2.T, 0)
+
+
+class LowRankKernel(BaseKernel):
+
+    """ A Nystrom low-rank approximation of another kernel.
+
+    fit chooses pivot inputs by greedy pivoted Cholesky at the
+    wrapped kernel's default hyperparameters, evaluating only one
+    column of the Gram matrix per pivot. The kernel is then
+    k(x, P) K_PP^-1 k(P, y) for the pivot inputs P, which has the
+    explicit feature map features. This is useful for kernels such as
+    WeightedDecompositionKernel, SmoothDecompositionKernel,
+    MismatchKernel, and MultipleKernel, whose fit would otherwise
+    compute the full n x n Gram matrix. It has no grad, so models
+    differentiate their objective numerically.
+
+    Attributes:
+        kernel (BaseKernel): the wrapped kernel
+        max_rank (int): maximum number of pivots
+        tol (float): pivoting stops once the trace of the residual
+            is at most tol times the trace of the Gram matrix
+        jitter (float): added to the diagonal of K_PP, relative to
+            its mean diagonal
+    """
+
+    def __init__(self, kernel, max_rank=500, tol=1e-6):
+        self.kernel = kernel
+        self.max_rank = max_rank
+        self.tol = tol
+        self.jitter = 1e-10
+        self._n_hypers = kernel._n_hypers
+
+    def fit(self, X):
+        """ Choose the pivots and fit the wrapped kernel on them. """
+        X = np.asarray(X)
+        d = self.kernel.diag(X)
+        _, self._pivots = gplinalg.pivoted_cholesky(
+            d, lambda j: self.kernel.cov(X, X[[j]])[:, 0],
+            self.max_rank, tol=self.tol * np.sum(d))
+        self._X_pivot = X[self._pivots]
+        self._X = X
+        self._saved_features = None
+        self._n_hypers = self.kernel.fit(self._X_pivot)
+        return self._n_hypers
+
+    def extend(self, X, X_new):
+        """ Keep the pivots and add X_new to the fitted inputs. """
+        self._X = np.concatenate((self._X, np.asarray(X_new)))
+        self._saved_features = None
+        return self._n_hypers
+
+    def compact(self):
+        """ Return a copy without the fitted inputs.
+
+        The wrapped kernel keeps its values for the pivots, which the
+        features of new inputs need.
+        """
+        kernel = copy.copy(self)
+        kernel._X = None
+        kernel._saved_features = None
+        return kernel
+
+    def features(self, X=None, hypers=None):
+        """ Nystrom features for X.
+
+        The features of the fitted inputs are remembered for the
+        last hyperparameters, so kernels without hyperparameters
+        only evaluate the n x r cross-covariance once.
+
+        Parameters:
+            X (np.ndarray): inputs. Default is the fitted inputs.
+            hypers (iterable): hyperparameters of the wrapped kernel.
+                Default is the wrapped kernel's defaults.
+
+        Returns:
+            Phi (np.ndarray): n x r
+        """
+        kw = {} if hypers is None else {'hypers': hypers}
+        key = None if hypers is None else tuple(np.asarray(hypers, float))
+        if X is None or X is self._X:
+            if self._saved_features is not None and \
+                    self._saved_features[0] == key:
+                return self._saved_features[1]
+            Phi = self._nystrom(self._X, kw)
+            self._saved_features = (key, Phi)
+            return Phi
+        return self._nystrom(np.asarray(X), kw)
+
+    def _nystrom(self, X, kw):
+        """ L_PP^-1 k(P, X), transposed, where K_PP = L_PP L_PP^T. """
+        K_pp = self.kernel.cov(**kw)
+        K_pp = K_pp + np.identity(len(K_pp)) * \
+            self.jitter * np.mean(np.diag(K_pp))
+        L_pp = np.linalg.cholesky(K_pp)
+        K_xp = self.kernel.cov(X, self._X_pivot, **kw)
+        return linalg.solve_triangular(L_pp, K_xp.T, lower=True).T
+
+    def cov(self, X1=None, X2=None, hypers=None):
+        """ Calculate the low-rank kernel between X1 and X2.
+
+        If no inputs are given, then uses the fitted inputs.
+
+        Returns:
+            K (np.ndarray)
+        """
+        P1 = self.features(X1, hypers=hypers)
+        if X1 is None and X2 is None:
+            return P1 @ P1.T
+        return P1 @ self.features(X2, hypers=hypers).T
+
+    def diag(self, X, hypers=None):
+        """ Calculate the low-rank kernel variance of each input. """
+        return np.sum(self.features(X, hypers=hypers) ** 2, axis=1)
+
+
+class BlockSEKernel(BaseKernel):
+
+    """ A squared exponential kernel on chimera codes.
+
+    Equal to SEKernel on the uncollapsed one-hot encodings of the
+    chimera sequences (chimera_tools.make_sequence_X), but computed
+    from the codes. Each block contributes a p x p factor, so the
+    Gram matrix over a full-factorial library is the Kronecker
+    product of the factors.
+
+    Attributes:
+        n_blocks (int)
+        n_parents (int)
+        D (np.ndarray): n_blocks x p x p squared distances between
+            the parents' one-hot encodings within each block
+    """
+
+    def __init__(self, assignments, sample_space):
+        """ Instantiate a BlockSEKernel.
+
+        Parameters:
+            assignments (dict): maps sequence position to block, as
+                returned by chimera_tools.load_assignments
+            sample_space (iterable): ith term should be a tuple
+                listing the parental residues at the ith position.
+        """
+        self.n_blocks = max(assignments.values()) + 1
+        self.n_parents = len(sample_space[0])
+        self.D = np.zeros((self.n_blocks, self.n_parents, self.n_parents))
+        for pos, block in assignments.items():
+            aa = np.array(sample_space[pos])
+            self.D[block] += 2.0 * (aa[:, None] != aa[None, :])
+        self._n_hypers = 2
+
+    def codes(self, X):
+        """ Convert chimera codes to an n x n_blocks integer array.
+
+        Parameters:
+            X (iterable): zero-indexed codes as strings, or an
+                integer array
+
+        Returns:
+            C (np.ndarray)
+        """
+        if isinstance(X, np.ndarray) and X.dtype.kind in 'iu':
+            return X
+        return np.array([[int(c) for c in code] for code in X])
+
+    def fit(self, X):
+        self._saved = self.codes(X)
+        return self._n_hypers
+
+    def extend(self, X, X_new):
+        return self.fit(np.concatenate((self._saved, self.codes(X_new))))
+
+    def _distance(self, X1, X2):
+        """ Squared distances between the chimeras' one-hot encodings. """
+        if X1 is None and X2 is None:
+            X1, X2 = self._saved, self._saved
+        X1, X2 = self.codes(X1), self.codes(X2)
+        D = np.zeros((len(X1), len(X2)))
+        for b, D_b in enumerate(self.D):
+            D += D_b[np.ix_(X1[:, b], X2[:, b])]
+        return D
+
+    def cov(self, X1=None, X2=None, hypers=(1.0, 1.0)):
+        """ Calculate the squared exponential kernel between codes.
+
+        Parameters:
+            X1 (iterable): codes
+            X2 (iterable): codes
+            hypers (iterable): default is (1.0, 1.0)
+
+        Returns:
+            K (np.ndarray)
+        """
+        sigma_f, L = hypers
+        return sigma_f ** 2 * np.exp(-0.5 * self._distance(X1, X2) / L ** 2)
+
+    def diag(self, X, hypers=(1.0, 1.0)):
+        """ The squared exponential kernel has variance sigma_f ** 2. """
+        return np.full(len(X), hypers[0] ** 2)
+
+    def grad(self, X1=None, X2=None, hypers=(1.0, 1.0)):
+        """ Calculate the gradient of the kernel.
+
+        Returns:
+            dK (np.ndarray): 2 x n1 x n2
+        """
+        D = self._distance(X1, X2)
+        sigma_f, L = hypers
+        E = np.exp(-0.5 * D / L ** 2)
+        return np.stack((2 * sigma_f * E, sigma_f ** 2 * E * D / L ** 3))
+
+    def factors(self, hypers=(1.0, 1.0)):
+        """ The per-block factors of the full-factorial Gram matrix.
+
+        The full-factorial library is ordered with the first block
+        varying slowest, and sigma_f ** 2 is folded into the first
+        factor.
+
+        Returns:
+            Ks (list): n_blocks p x p matrices
+        """
+        sigma_f, L = hypers
+        Ks = [np.exp(-0.5 * D_b / L ** 2) for D_b in self.D]
+        Ks[0] = Ks[0] * sigma_f ** 2
+        return Ks
+
+    def factor_grads(self, hypers=(1.0, 1.0)):
+        """ Derivatives of the factors with respect to each hyperparameter.
+
+        The derivative of the Gram matrix with respect to the kth
+        hyperparameter is the sum over blocks b of the Kronecker
+        product of the factors with factor b replaced by
+        dKs[k][b]. Blocks whose factor does not depend on the
+        hyperparameter are None.
+
+        Returns:
+            dKs (list): for each hyperparameter, a list of n_blocks
+                p x p matrices or None
+        """
+        sigma_f, L = hypers
+        Ks = self.factors(hypers)
+        d_sigma = [2.0 / sigma_f * Ks[0]] + [None] * (self.n_blocks - 1)
+        d_L = [K_b * D_b / L ** 3 for K_b, D_b in zip(Ks, self.D)]
+        return [d_sigma, d_L]
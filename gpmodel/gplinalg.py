@@ -0,0 +1,289 @@
+"""Linear algebra routines for large Gaussian process models."""
+
+import functools
+
+import numpy as np
+from scipy import linalg
+
+
+def pivoted_cholesky(diag, column, max_rank, tol=0.0):
+    """ Greedy pivoted Cholesky decomposition of a PSD matrix A.
+
+    Only the diagonal and the chosen pivot columns of A are ever
+    evaluated, so A does not need to be formed. At each step the
+    pivot is the row with the largest remaining residual variance.
+
+    Parameters:
+        diag (np.ndarray): n. The diagonal of A.
+        column (function): column(j) returns the jth column of A.
+        max_rank (int): maximum number of pivots
+        tol (float): stop once the trace of the residual
+            A - L @ L.T is at most tol
+
+    Returns:
+        L (np.ndarray): n x r, with A approximately L @ L.T
+        pivots (np.ndarray): r indices of the pivot columns
+    """
+    d = np.array(diag, dtype=float)
+    n = len(d)
+    max_rank = min(max_rank, n)
+    L = np.zeros((n, max_rank))
+    pivots = []
+    for k in range(max_rank):
+        j = np.argmax(d)
+        if d[j] <= 0 or np.sum(d) <= tol:
+            break
+        pivots.append(j)
+        L[:, k] = (column(j) - L[:, :k] @ L[j, :k]) / np.sqrt(d[j])
+        d -= L[:, k] ** 2
+        d[pivots] = 0
+    return L[:, :len(pivots)], np.array(pivots, dtype=int)
+
+
+def jitter_cholesky(A, eps, max_tries=6):
+    """ Cholesky decomposition, adding jitter to the diagonal if needed.
+
+    If A is not numerically positive definite, eps times its mean
+    diagonal is added to the diagonal, increasing tenfold on each
+    try.
+
+    Parameters:
+        A (np.ndarray): n x n. Not modified.
+        eps (float): the relative jitter for the first retry
+        max_tries (int)
+
+    Returns:
+        L (np.ndarray): lower Cholesky factor
+    """
+    try:
+        return np.linalg.cholesky(A)
+    except np.linalg.LinAlgError:
+        pass
+    scale = eps * np.mean(np.diag(A))
+    for i in range(max_tries):
+        A_j = A.copy()
+        A_j.flat[::len(A) + 1] += scale * 10 ** i
+        try:
+            return np.linalg.cholesky(A_j)
+        except np.linalg.LinAlgError:
+            continue
+    raise np.linalg.LinAlgError('Matrix is not positive definite')
+
+
+def woodbury_factor(V, lam, y):
+    """ Factorize C = V.T @ V + diag(lam) through an r x r matrix.
+
+    With A = I + V diag(lam)^-1 V.T = L_A L_A.T, the Woodbury identity
+    and the matrix determinant lemma give y.T C^-1 y and log|C| in
+    O(nr^2) time without forming C.
+
+    Parameters:
+        V (np.ndarray): r x n
+        lam (np.ndarray): n. Positive diagonal.
+        y (np.ndarray): n
+
+    Returns:
+        L_A (np.ndarray): r x r lower Cholesky factor of A
+        b (np.ndarray): r. L_A^-1 V diag(lam)^-1 y
+        quad (float): y.T C^-1 y
+        logdet (float): log|C|
+    """
+    V_lam = V / lam
+    L_A = np.linalg.cholesky(np.identity(len(V)) + V_lam @ V.T)
+    b = linalg.solve_triangular(L_A, V_lam @ y, lower=True)
+    quad = np.sum(y ** 2 / lam) - b @ b
+    logdet = np.sum(np.log(lam)) + 2 * np.sum(np.log(np.diag(L_A)))
+    return L_A, b, quad, logdet
+
+
+def woodbury_solve(V, lam, L_A, B):
+    """ Solve (V.T @ V + diag(lam)) X = B given L_A from woodbury_factor.
+
+    Parameters:
+        V (np.ndarray): r x n
+        lam (np.ndarray): n
+        L_A (np.ndarray): r x r
+        B (np.ndarray): n or n x t
+
+    Returns:
+        X (np.ndarray): same shape as B
+    """
+    lam = np.reshape(lam, (-1, ) + (1, ) * (np.ndim(B) - 1))
+    B_lam = B / lam
+    C = linalg.cho_solve((L_A, True), V @ B_lam)
+    return B_lam - (V.T @ C) / lam
+
+
+def pcg(matvec, B, precond=None, tol=1e-6, max_iter=1000):
+    """ Batched preconditioned conjugate gradients.
+
+    Solves A X = B for every column of B at once, so each iteration
+    costs one matrix product with A. The CG coefficients of each
+    column are also returned, from which the Lanczos tridiagonal
+    matrix of the preconditioned system can be recovered (the mBCG
+    algorithm of Gardner et al., 2018). Columns that converge stop
+    updating while the others continue.
+
+    Parameters:
+        matvec (function): matvec(V) returns A @ V for V n x t
+        B (np.ndarray): n x t
+        precond (function): precond(R) returns P^-1 @ R. Default is
+            no preconditioning.
+        tol (float): relative residual norm at which a column has
+            converged
+        max_iter (int)
+
+    Returns:
+        X (np.ndarray): n x t
+        alphas (np.ndarray): k x t step sizes
+        betas (np.ndarray): k x t conjugation coefficients
+        n_iter (np.ndarray): t. Iterations taken by each column.
+    """
+    if precond is None:
+        precond = lambda R: R
+    X = np.zeros_like(B)
+    R = B.copy()
+    Z = precond(R)
+    P = Z.copy()
+    rz = np.sum(R * Z, axis=0)
+    norm_B = np.linalg.norm(B, axis=0)
+    active = norm_B > 0
+    n_iter = np.zeros(B.shape[1], dtype=int)
+    alphas = []
+    betas = []
+    for _ in range(max_iter):
+        if not np.any(active):
+            break
+        AP = matvec(P)
+        pAp = np.sum(P * AP, axis=0)
+        alpha = np.where(active, rz / np.where(active, pAp, 1.0), 0.0)
+        X += alpha * P
+        R -= alpha * AP
+        Z = precond(R)
+        rz_new = np.sum(R * Z, axis=0)
+        beta = np.where(active, rz_new / np.where(active, rz, 1.0), 0.0)
+        P = Z + beta * P
+        rz = rz_new
+        alphas.append(alpha)
+        betas.append(beta)
+        n_iter += active
+        active &= np.linalg.norm(R, axis=0) > tol * norm_B
+    return X, np.array(alphas), np.array(betas), n_iter
+
+
+def lanczos_quadrature(alphas, betas, n_iter):
+    """ Gauss quadrature estimates of e1.T log(T) e1 from mBCG.
+
+    Parameters:
+        alphas, betas, n_iter: as returned by pcg
+
+    Returns:
+        q (np.ndarray): t. One estimate for each column.
+    """
+    q = np.zeros(len(n_iter))
+    for j, k in enumerate(n_iter):
+        if k == 0:
+            continue
+        a = alphas[:k, j]
+        b = betas[:k, j]
+        diag = 1.0 / a
+        diag[1:] += b[:-1] / a[:-1]
+        off = np.sqrt(b[:-1]) / a[:-1]
+        evals, evecs = linalg.eigh_tridiagonal(diag, off)
+        q[j] = np.sum(evecs[0] ** 2 * np.log(evals))
+    return q
+
+
+def kron_mvprod(As, B):
+    """ (As[0] kron As[1] kron ...) @ B without forming the product.
+
+    Costs O(N sum(n_i)) for N = prod(n_i), instead of O(N^2).
+
+    Parameters:
+        As (list): square n_i x n_i matrices
+        B (np.ndarray): N or N x t
+
+    Returns:
+        C (np.ndarray): same shape as B
+    """
+    shape = [len(A) for A in As]
+    X = np.reshape(B, shape + list(B.shape[1:]))
+    for i, A in enumerate(As):
+        X = np.moveaxis(np.tensordot(A, X, axes=([1], [i])), 0, i)
+    return np.reshape(X, B.shape)
+
+
+def kron_diag(ds):
+    """ The diagonal of a Kronecker product of diagonal matrices. """
+    return functools.reduce(np.kron, ds)
+
+
+def tiled_cholesky(A, tile_size):
+    """ In-place right-looking blocked Cholesky decomposition.
+
+    Only tile_size x tile_size tiles of the lower triangle of A are
+    read and written at a time, so A can be an np.memmap larger than
+    memory. On return the lower triangle of A holds L. The strict
+    upper triangle is not referenced, except that of the diagonal
+    tiles, which is zeroed.
+
+    Parameters:
+        A (np.ndarray): n x n, symmetric positive definite
+        tile_size (int)
+
+    Returns:
+        A (np.ndarray): the same array
+    """
+    n = len(A)
+    starts = range(0, n, tile_size)
+    for k in starts:
+        kk = slice(k, k + tile_size)
+        A[kk, kk] = np.linalg.cholesky(A[kk, kk])
+        L_kk = A[kk, kk]
+        for i in range(k + tile_size, n, tile_size):
+            ii = slice(i, i + tile_size)
+            A[ii, kk] = linalg.solve_triangular(L_kk, A[ii, kk].T,
+                                                lower=True).T
+        for i in range(k + tile_size, n, tile_size):
+            ii = slice(i, i + tile_size)
+            L_ik = A[ii, kk]
+            for j in range(k + tile_size, i + 1, tile_size):
+                jj = slice(j, j + tile_size)
+                A[ii, jj] -= L_ik @ A[jj, kk].T
+    return A
+
+
+def tiled_solve_triangular(L, B, tile_size, trans=False):
+    """ Solve L X = B, or L.T X = B, streaming L by row tiles.
+
+    L is read one tile_size row strip at a time, so it can be an
+    np.memmap larger than memory.
+
+    Parameters:
+        L (np.ndarray): n x n lower triangular, as from tiled_cholesky
+        B (np.ndarray): n or n x t
+        tile_size (int)
+        trans (Boolean): whether to solve with L.T
+
+    Returns:
+        X (np.ndarray): same shape as B
+    """
+    X = np.array(B, dtype=float)
+    n = len(L)
+    starts = list(range(0, n, tile_size))
+    if not trans:
+        for i in starts:
+            ii = slice(i, i + tile_size)
+            strip = np.asarray(L[ii, :i + tile_size])
+            if i:
+                X[ii] -= strip[:, :i] @ X[:i]
+            X[ii] = linalg.solve_triangular(strip[:, i:], X[ii], lower=True)
+        return X
+    for i in reversed(starts):
+        ii = slice(i, i + tile_size)
+        strip = np.asarray(L[ii, :i + tile_size])
+        X[ii] = linalg.solve_triangular(strip[:, i:], X[ii], lower=True,
+                                        trans='T')
+        if i:
+            X[:i] -= strip[:, :i].T @ X[ii]
+    return X
@@ -1,30 +1,195 @@
 ''' Classes for doing Gaussian process models of proteins.'''
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+import itertools
+import multiprocessing as mp
 import pickle
+import tempfile
+import time
 import abc
+import contextlib
+import copy
+import os
 
 import numpy as np
 from scipy.optimize import minimize
 from scipy import stats, integrate, linalg
 from scipy.special import expit
+from scipy.spatial import distance
 import pandas as pd
 from sklearn import linear_model
 from sklearn import metrics
+from sklearn import cluster
 
 from gpmodel import gpmean
 from gpmodel import gpkernel
 from gpmodel import gptools
 from gpmodel import chimera_tools
+from gpmodel import gplinalg
+from gpmodel import gpthreads
+from gpmodel import gpparallel
+
+
+StartResult = namedtuple('StartResult',
+                         ['x0', 'x', 'fun', 'success', 'wall_time'])
+_Factorization = namedtuple('_Factorization',
+                            ['K', 'L', 'alpha', 'ML', 'grad'])
+_LowRankFactorization = namedtuple('_LowRankFactorization',
+                                   ['L_u', 'L_A', 'w', 'ML', 'grad'])
+_IterativeFactorization = namedtuple('_IterativeFactorization',
+                                     ['V', 'lam', 'L_A', 'alpha', 'ML',
+                                      'grad'])
+_KroneckerFactorization = namedtuple('_KroneckerFactorization',
+                                     ['Q', 's', 'alpha', 'ML', 'grad'])
+
+# Version of the directory format written by GPRegressor.dump_compact
+COMPACT_VERSION = 1
+
+# Model shared with the workers of a multi-start pool
+_start_model = None
+
+# Returned by _phase when the model has no profiler
+_NO_PHASE = contextlib.nullcontext()
+
+# Marks the end of the iterator in BaseGPModel._timed
+_EXHAUSTED = object()
+
+
+def _init_start_worker(model, n_threads):
+    """ Remember the model in a multi-start worker process and cap
+    its BLAS and numba threads. """
+    global _start_model
+    _start_model = model
+    gpthreads.limit(n_threads)
+
+
+def _run_start(model, x0, bounds, jac):
+    """ Run L-BFGS-B on the model's objective from one starting point. """
+    start = time.perf_counter()
+    args = (True, ) if jac else ()
+    with model._phase('minimize'):
+        res = minimize(model.objective, x0, args=args, jac=jac,
+                       method='L-BFGS-B', bounds=bounds)
+    return StartResult(np.array(x0), res['x'], float(np.squeeze(res['fun'])),
+                       res['success'], time.perf_counter() - start)
+
+
+def _pool_start(args):
+    """ Run one multi-start in a worker process. """
+    return _run_start(_start_model, *args)
+
+
+def _fresh_copy(model):
+    """ A shallow copy of the model with its own factorization cache. """
+    model = copy.copy(model)
+    if hasattr(model, '_cache'):
+        model._cache = OrderedDict()
+    return model
+
+
+def _copy_kernel(kernel):
+    """ A copy of kernel that fit, extend and astype leave unchanged.
+
+    Kernels replace the arrays they save rather than modify them, so
+    the copy shares them. Member kernels are copied in turn.
+    """
+    kernel = copy.copy(kernel)
+    for key, value in list(vars(kernel).items()):
+        if isinstance(value, gpkernel.BaseKernel):
+            setattr(kernel, key, _copy_kernel(value))
+        elif isinstance(value, list) and \
+                any(isinstance(v, gpkernel.BaseKernel) for v in value):
+            setattr(kernel, key,
+                    [_copy_kernel(v) if isinstance(v, gpkernel.BaseKernel)
+                     else v for v in value])
+    return kernel
+
+
+def _executor_start(model, x0, bounds, jac):
+    """ Run one multi-start on its own copy of the model. """
+    return _run_start(_fresh_copy(model), x0, bounds, jac)
+
+
+def _cov_tile(kernel, X1, X2, hypers, dtype):
+    """ One tile of the kernel covariance, in dtype. """
+    K = kernel.cov(X1, X2, hypers=hypers)
+    return np.asarray(K).astype(dtype, copy=False)
+
+
+def _class_factor(p, K):
+    """ Factor the Laplace approximation for one class.
+
+    Parameters:
+        p (np.ndarray): the class's probabilities at f
+        K (np.ndarray): the class's covariance
+
+    Returns:
+        L (np.ndarray): Cholesky factor of I + D^1/2 K D^1/2
+        E (np.ndarray): D^1/2 (I + D^1/2 K D^1/2)^-1 D^1/2
+    """
+    Dc_root = np.sqrt(np.diag(p))
+    DKD = Dc_root @ K @ Dc_root
+    L = np.linalg.cholesky(np.eye(len(p)) + DKD)
+    first = np.linalg.lstsq(L, Dc_root)[0]
+    E = Dc_root @ np.linalg.lstsq(L.T, first)[0]
+    return L, E
+
+
+def _iter_chunks(X_source, chunk_size):
+    """ Yield successive arrays of at most chunk_size inputs.
+
+    Parameters:
+        X_source: an array (including np.memmap), a DataFrame, or
+            any iterable of inputs
+        chunk_size (int)
+    """
+    if isinstance(X_source, pd.DataFrame):
+        X_source = X_source.values
+    if hasattr(X_source, 'shape'):
+        for start in range(0, len(X_source), chunk_size):
+            yield np.asarray(X_source[start:start + chunk_size])
+        return
+    iterator = iter(X_source)
+    while True:
+        rows = list(itertools.islice(iterator, chunk_size))
+        if len(rows) == 0:
+            return
+        yield np.array(rows)
 
 
 class BaseGPModel(abc.ABC):
 
-    """ Base class for Gaussian process models. """
+    """ Base class for Gaussian process models.
+
+    Attributes:
+        n_starts (int): number of starting points for the
+            hyperparameter optimization. Default is 1.
+        n_jobs (int): number of processes used for multiple starts
+            when no gpparallel executor is active. Default is 1.
+        starts (list): StartResult for each start of the last fit
+        profiler (gpprofile.Profiler): records the phases of fit and
+            predict if given. Default is None.
+        n_threads (int): thread budget for fitting, shared between
+            the multi-start workers and their BLAS and numba threads.
+            It covers all of fit, from fitting the kernel to the
+            final factorization. Default is None (the active
+            gpthreads.ThreadBudget, or every core).
+
+    Fitting publishes a snapshot of the fitted model, which predict
+    reads from. Fitting again or adding observations replaces the
+    snapshot only once it is complete, so many threads can predict
+    with one model, even while it is being refit.
+    """
+
+    profiler = None
+    n_threads = None
+    _snapshot = None
 
     @abc.abstractmethod
     def __init__(self, kernel):
         self.kernel = kernel
+        self.n_starts = 1
+        self.n_jobs = 1
 
     @abc.abstractmethod
     def predict(self, X):
@@ -44,6 +209,121 @@ class BaseGPModel(abc.ABC):
         for key, value in kwargs.items():
             setattr(self, key, value)
 
+    def __getstate__(self):
+        """ Pickle and copy the model without its snapshot. """
+        state = self.__dict__.copy()
+        state.pop('_snapshot', None)
+        return state
+
+    def _publish(self):
+        """ Publish the fitted state that predict reads.
+
+        The snapshot is a shallow copy of the model, so it shares the
+        fitted arrays, which fit and add_observations replace rather
+        than modify. The kernels and the mean function are changed in
+        place when the model is refit, so the snapshot has its own
+        copies of them. Replacing _snapshot is a single assignment, so
+        predictions see either the old or the new fit, never a mix.
+        """
+        snapshot = _fresh_copy(self)
+        if hasattr(self, 'kernel'):
+            snapshot.kernel = _copy_kernel(self.kernel)
+        if hasattr(self, 'kernels'):
+            snapshot.kernels = [_copy_kernel(k) for k in self.kernels]
+        if getattr(self, 'mean_func', None) is not None:
+            snapshot.mean_func = copy.deepcopy(self.mean_func)
+        self._snapshot = snapshot
+
+    def _phase(self, name):
+        """ Context manager timing name if the model has a profiler. """
+        if self.profiler is None:
+            return _NO_PHASE
+        return self.profiler.phase(name)
+
+    def _count(self, name, n=1):
+        """ Add n to the profiler's counter name. """
+        if self.profiler is not None:
+            self.profiler.count(name, n)
+
+    def _timed(self, iterator, name):
+        """ Generate from iterator, timing each item under name. """
+        while True:
+            with self._phase(name):
+                item = next(iterator, _EXHAUSTED)
+            if item is _EXHAUSTED:
+                return
+            yield item
+
+    def _thread_budget(self):
+        """ Context manager entering the model's thread budget. """
+        if self.n_threads is None:
+            return contextlib.nullcontext()
+        return gpthreads.ThreadBudget(self.n_threads)
+
+    def _minimize(self, guesses, bounds, jac=False):
+        """ Minimize the objective with respect to the hyperparameters.
+
+        The first start is from guesses. Any additional starts are
+        drawn by Latin hypercube sampling inside bounds (log-uniformly
+        for positive bounds, with unbounded dimensions capped at 10).
+        Starts are run by the active gpparallel executor, each on its
+        own copy of the model. Without one, they are run in a pool of
+        n_jobs processes that inherit the fitted kernel. The pool is
+        no larger than the thread budget, and each worker's BLAS and
+        numba threads are capped at its share. fit enters the model's
+        thread budget, if it has one. The model is left at the best
+        optimum.
+
+        Parameters:
+            guesses (iterable): initial hyperparameters
+            bounds (list): (min, max) pairs for each hyperparameter
+            jac (Boolean): whether the objective returns its gradient
+
+        Returns:
+            hypers (np.ndarray)
+        """
+        starts = [np.array(guesses, dtype=float)]
+        starts += list(self._sample_starts(bounds, self.n_starts - 1))
+        tasks = [(x0, bounds, jac) for x0 in starts]
+        budget = gpthreads.current_budget()
+        processes, per_worker = budget.split(min(self.n_jobs, len(starts)))
+        executor = gpparallel.current_executor()
+        with self._phase('optimize'):
+            if executor.n_workers > 1 and len(starts) > 1:
+                model = _fresh_copy(self)
+                self.starts = executor.map(_executor_start,
+                                           itertools.repeat(model), starts,
+                                           itertools.repeat(bounds),
+                                           itertools.repeat(jac))
+            elif processes == 1:
+                self.starts = [_run_start(self, *task) for task in tasks]
+            else:
+                with mp.Pool(processes=processes,
+                             initializer=_init_start_worker,
+                             initargs=(self, per_worker)) as pool:
+                    self.starts = pool.map(_pool_start, tasks)
+        best = min(self.starts, key=lambda r: r.fun)
+        if len(starts) > 1:
+            # Leave the dependent values at the chosen optimum
+            self.objective(best.x)
+        return best.x
+
+    def _sample_starts(self, bounds, n):
+        """ Latin hypercube sample of n points inside bounds. """
+        d = len(bounds)
+        u = np.argsort(np.random.random((n, d)), axis=0)
+        u = (u + np.random.random((n, d))) / n
+        starts = np.empty((n, d))
+        for i, (low, high) in enumerate(bounds):
+            low = -10.0 if low is None else low
+            high = 10.0 if high is None else high
+            if low > 0:
+                low, high = np.log(low), np.log(high)
+                starts[:, i] = np.exp(low + u[:, i] * (high - low))
+            else:
+                starts[:, i] = low + u[:, i] * (high - low)
+        return starts
+
     @classmethod
     def load(cls, model):
         ''' Load a saved model.
@@ -57,6 +337,12 @@ class BaseGPModel(abc.ABC):
             attributes = pickle.load(m_file, encoding='latin1')
         model = cls(attributes['kernel'])
         del attributes['kernel']
+        # Older regression models saved the noisy covariance
+        attributes.pop('_Ky', None)
+        # and set the posterior directly, which would publish a
+        # snapshot before the other attributes are set
+        if '_posterior' in attributes:
+            attributes['_fitted_posterior'] = attributes.pop('_posterior')
         if attributes['objective'] == 'LOO_log_p':
             model.objective = model._LOO_log_p
         else:
@@ -74,7 +360,8 @@ class BaseGPModel(abc.ABC):
         Parameters:
             f (string): path to where model should be saved
         '''
-        save_me = {k: self.__dict__[k] for k in list(self.__dict__.keys())}
+        save_me = {k: self.__dict__[k] for k in list(self.__dict__.keys())
+                   if k not in ['_cache', 'profiler', '_snapshot']}
         if self.objective == self._log_ML:
             save_me['objective'] = 'log_ML'
         else:
@@ -93,11 +380,34 @@ class BaseGPModel(abc.ABC):
 
 class GPRegressor(BaseGPModel):
 
-    """ A Gaussian process regression model for proteins. """
+    """ A Gaussian process regression model for proteins.
+
+    Attributes:
+        cache_size (int): number of factorizations remembered by the
+            objective. Default is 2.
+        refit_every (int): number of observations added with
+            add_observations after which the hyperparameters are
+            refit. Default is None (never).
+        dtype (np.dtype): precision of the kernel matrices and the
+            stored Cholesky factor. With np.float32, the Cholesky
+            decomposition, alpha, and the log determinant are still
+            computed in float64. Default is np.float64.
+    """
+
+    # Attributes written by dump_compact
+    _compact_attributes = ['hypers', 'mean', 'std', 'dtype', 'variances',
+                           'ML', 'guesses', 'cache_size', 'refit_every',
+                           'n_starts', 'n_jobs', 'n_threads']
 
     def __init__(self, kernel, **kwargs):
         BaseGPModel.__init__(self, kernel)
         self.guesses = None
+        self.cache_size = 2
+        self.refit_every = None
+        self.dtype = np.float64
+        self._cache = OrderedDict()
+        self._fitting = False
+        self._work = None
         if 'objective' not in list(kwargs.keys()):
             kwargs['objective'] = 'log_ML'
         if 'mean_func' not in list(kwargs.keys()):
@@ -106,12 +416,15 @@ class GPRegressor(BaseGPModel):
         self._set_objective(kwargs['objective'])
         del kwargs['objective']
         self._set_params(**kwargs)
+        self.dtype = np.dtype(self.dtype)
 
     def _set_objective(self, objective):
         """ Set objective function for model. """
         if objective is not None:
             if objective == 'log_ML':
                 self.objective = self._log_ML
+            elif objective == 'LOO_log_p':
+                self.objective = self._LOO_log_p
             else:
                 raise AttributeError(objective + ' is not a valid objective')
         else:
@@ -135,45 +448,448 @@ class GPRegressor(BaseGPModel):
             X = X.values
         if isinstance(Y, pd.Series):
             Y = Y.values
-        self.X = X
-        self.Y = Y
-        self._ell = len(Y)
-        self._n_hypers = self.kernel.fit(X)
+        with self._thread_budget():
+            self.X = X
+            self.Y = Y
+            self._ell = len(Y)
+            self._n_added = 0
+            with self._phase('kernel.fit'):
+                self._n_hypers = self._fit_kernel(X)
+            self.kernel.astype(self.dtype)
+            self._set_targets(variances)
+            if variances is None:
+                self._n_hypers += 1
+            if self.guesses is None:
+                guesses = [0.9 for _ in range(self._n_hypers)]
+            else:
+                guesses = self.guesses
+                if len(guesses) != self._n_hypers:
+                    raise AttributeError(('Length of guesses does not '
+                                          'match number of hyperparameters'))
+            if bounds is None:
+                bounds = [(1e-5, None) for _ in guesses]
+            self._bounds = bounds
+            self._fit_hypers(guesses)
+
+    def _fit_kernel(self, X):
+        """ Save the kernel values needed by the objective. """
+        return self.kernel.fit(X)
+
+    def _set_targets(self, variances=None):
+        """ Normalize Y and the variances and fit the mean function. """
+        self._cache.clear()
         self.mean, self.std, self.normed_Y = self._normalize(self.Y)
-        self.mean_func.fit(X, self.normed_Y)
-        self.normed_Y -= self.mean_func.mean(X).T[0]
+        self.mean_func.fit(self.X, self.normed_Y)
+        self.normed_Y -= self._prior_mean(self.X)[:, 0]
         if variances is not None:
-            if not len(variances) != len(Y):
+            if len(variances) != len(self.Y):
                 raise ValueError('len(variances must match len(Y))')
             self.variances = variances / self.std**2
         else:
             self.variances = None
-            self._n_hypers += 1
-        if self.guesses is None:
-            guesses = [0.9 for _ in range(self._n_hypers)]
+
+    def _prior_mean(self, X):
+        """ The mean function for X as an n x 1 (or n x t) array.
+
+        sklearn regressors return a 1-d mean, which is reshaped so
+        that it adds to an n x 1 column without broadcasting.
+        """
+        return np.reshape(self.mean_func.mean(X), (len(X), -1))
+
+    def _fit_hypers(self, guesses):
+        """ Optimize the hyperparameters and finalize the posterior. """
+        self.hypers = self._optimize_hypers(guesses)
+        with self._phase('posterior'):
+            self._posterior = self._factorize(self.hypers)
+
+    def _optimize_hypers(self, guesses):
+        """ Minimize the objective from guesses.
+
+        While the hyperparameters are optimized, every evaluation of
+        the objective factorizes Ky in the same n x n workspace,
+        which is released afterwards. If the kernel does not
+        implement grad, the objective is differentiated numerically.
+
+        Returns:
+            hypers (np.ndarray)
+        """
+        self._fitting = True
+        try:
+            return self._minimize(guesses, self._bounds,
+                                  jac=self.kernel.has_grad())
+        finally:
+            self._fitting = False
+            self._work = None
+
+    @property
+    def _posterior(self):
+        """ The factorization that predictions are made from.
+
+        Setting it publishes a snapshot of the model, so it should be
+        set last, once X, the hyperparameters and the normalization
+        match it.
+        """
+        return self._fitted_posterior
+
+    @_posterior.setter
+    def _posterior(self, post):
+        self._fitted_posterior = post
+        self._publish()
+
+    def add_observations(self, X_new, Y_new, variances=None,
+                         refit_hypers=False):
+        """ Add observations to a fitted model.
+
+        With the hyperparameters held fixed, the saved kernel values
+        and the Cholesky factor are extended by a block update, which
+        is O(n^2 k) for k new observations instead of O(n^3). The
+        normalization and mean function from fit are kept.
+
+        If refit_hypers is True, or refit_every observations have
+        been added since the hyperparameters were last fit, the
+        targets are renormalized and the hyperparameters are refit,
+        starting from their current values.
+
+        Parameters:
+            X_new (np.ndarray): k x d
+            Y_new (np.ndarray): k.
+            variances (np.ndarray): k. Required if and only if the
+                model was fit with variances.
+            refit_hypers (Boolean)
+        """
+        if isinstance(X_new, pd.DataFrame):
+            X_new = X_new.values
+        if isinstance(Y_new, pd.Series):
+            Y_new = Y_new.values
+        if (variances is None) != (self.variances is None):
+            raise ValueError('variances must be given if and only if '
+                             'the model was fit with variances')
+        X_old = self.X
+        if refit_hypers or (self.refit_every is not None and
+                            self._n_added + len(Y_new) >= self.refit_every):
+            self._extend_data(X_new, Y_new)
+            if variances is not None:
+                variances = np.concatenate((self.variances * self.std ** 2,
+                                            variances))
+            self._set_targets(variances)
+            self._n_added = 0
+            self._fit_hypers(self.hypers)
+            return
+        normed_new = (Y_new - self.mean) / self.std
+        normed_new -= self._prior_mean(X_new)[:, 0]
+        if variances is not None:
+            variances = np.concatenate((self.variances,
+                                        variances / self.std ** 2))
+        # The model is only changed once the new factor is computed,
+        # so that it still matches L and alpha if the update fails
+        K, L = self._extend_factor(X_old, X_new, variances)
+        self._extend_data(X_new, Y_new)
+        self._n_added += len(Y_new)
+        self.normed_Y = np.concatenate((self.normed_Y, normed_new))
+        self.variances = variances
+        self._cache.clear()
+        self._posterior = self._factorize(self.hypers, factors=(K, L))
+
+    def _extend_data(self, X_new, Y_new):
+        """ Append the new observations and extend the kernel. """
+        self.kernel.extend(self.X, X_new)
+        self.kernel.astype(self.dtype)
+        self.X = np.concatenate((self.X, X_new))
+        self.Y = np.concatenate((self.Y, Y_new))
+        self._ell = len(self.Y)
+
+    def _extend_factor(self, X_old, X_new, variances):
+        """ Extend the posterior's K and L with new inputs.
+
+        Parameters:
+            X_old (np.ndarray): the inputs the posterior was fit on
+            X_new (np.ndarray): k new inputs
+            variances (np.ndarray): normalized variances for all the
+                inputs, or None
+
+        Returns:
+            K (np.ndarray), L (np.ndarray)
+        """
+        post = self._posterior
+        n, k = len(X_old), len(X_new)
+        K12 = self._cov(X_old, X_new, self.hypers)
+        K22 = self._cov(X_new, X_new, self.hypers)
+        if variances is not None:
+            Ky22 = K22 + np.diag(variances[n:])
+        else:
+            Ky22 = K22 + np.identity(k) * self.hypers[0]
+        L11 = post.L.astype(np.float64, copy=False)
+        L21 = linalg.solve_triangular(L11, K12, lower=True).T
+        L22 = np.linalg.cholesky(Ky22 - L21 @ L21.T)
+        L = np.block([[L11, np.zeros((n, k))], [L21, L22]])
+        K = np.block([[post.K, K12], [K12.T, K22]]).astype(self.dtype)
+        return K, L
+
+    def dump_compact(self, directory):
+        """ Save only what the fitted model needs to predict.
+
+        The directory holds X, alpha and L as .npy files, and the
+        compacted kernel, the mean function, and the hyperparameters
+        and normalization in meta.pkl. Unlike dump, the kernel's
+        saved Gram matrices, K, and Y are not written.
+
+        Parameters:
+            directory (string): created if it does not exist
+        """
+        os.makedirs(directory, exist_ok=True)
+        post = self._posterior
+        if isinstance(post, list):
+            L = np.stack([p.L for p in post])
+            alpha = np.stack([p.alpha for p in post])
+        else:
+            L, alpha = post.L, post.alpha
+        mean_func = copy.copy(self.mean_func)
+        mean_func.means = None
+        meta = {'version': COMPACT_VERSION,
+                'class': type(self).__name__,
+                'kernel': self.kernel.compact(),
+                'mean_func': mean_func,
+                'objective': ('log_ML' if self.objective == self._log_ML
+                              else 'LOO_log_p'),
+                'attributes': {k: getattr(self, k)
+                               for k in self._compact_attributes
+                               if hasattr(self, k)}}
+        X = np.asarray(self.X)
+        if X.dtype.hasobject:
+            # Python objects cannot be memory-mapped
+            meta['X'] = X
+        else:
+            np.save(os.path.join(directory, 'X.npy'), X)
+        np.save(os.path.join(directory, 'L.npy'), L)
+        np.save(os.path.join(directory, 'alpha.npy'), alpha)
+        with open(os.path.join(directory, 'meta.pkl'), 'wb') as f:
+            pickle.dump(meta, f)
+
+    @classmethod
+    def load_compact(cls, directory, mmap_mode='r'):
+        """ Load a model saved with dump_compact.
+
+        X, alpha and L are memory-mapped, so processes that load the
+        same directory share one copy in the page cache. The model
+        can predict, but not be refit or extended.
+
+        Parameters:
+            directory (string)
+            mmap_mode (string): passed to np.load. None reads the
+                arrays into memory.
+        """
+        with open(os.path.join(directory, 'meta.pkl'), 'rb') as f:
+            meta = pickle.load(f)
+        if meta['version'] != COMPACT_VERSION:
+            raise ValueError('Unsupported compact format version %s'
+                             % meta['version'])
+        if meta['class'] != cls.__name__:
+            raise ValueError('%s was saved from a %s'
+                             % (directory, meta['class']))
+        model = cls(meta['kernel'], objective=meta['objective'],
+                    mean_func=meta['mean_func'])
+        model._set_params(**meta['attributes'])
+        if 'X' in meta:
+            model.X = meta['X']
         else:
-            guesses = self.guesses
-            if len(guesses) != self._n_hypers:
-                raise AttributeError(('Length of guesses does not match '
-                                      'number of hyperparameters'))
-        if bounds is None:
-            bounds = [(1e-5, None) for _ in guesses]
-        minimize_res = minimize(self.objective,
-                                guesses,
-                                method='L-BFGS-B',
-                                bounds=bounds)
-        self.hypers = minimize_res['x']
+            model.X = np.load(os.path.join(directory, 'X.npy'),
+                              mmap_mode=mmap_mode)
+        L = np.load(os.path.join(directory, 'L.npy'), mmap_mode=mmap_mode)
+        alpha = np.load(os.path.join(directory, 'alpha.npy'),
+                        mmap_mode=mmap_mode)
+        model._ell = len(model.X)
+        if L.ndim == 3:
+            model._posterior = [_Factorization(None, L_j, alpha_j, None,
+                                               None)
+                                for L_j, alpha_j in zip(L, alpha)]
+        else:
+            model._K, model._L, model._alpha = None, L, alpha
+            model._posterior = _Factorization(None, L, alpha,
+                                              model.ML, None)
+        return model
 
+    def _kernel_hypers(self, hypers):
+        """ The hyperparameters that are passed to the kernel. """
+        if self.variances is not None:
+            return hypers
+        return hypers[1::]
+
+    def _noise(self, hypers):
+        """ The normalized measurement variance for each input. """
+        if self.variances is not None:
+            return self.variances
+        return np.full(self._ell, hypers[0])
+
+    def _cov(self, X1=None, X2=None, hypers=None):
+        """ The kernel covariance in the model's dtype.
+
+        The kernel hyperparameters are passed in the same dtype, so
+        that kernels compute the covariance in it.
+        """
+        h = self._kernel_hypers(hypers)
+        if self.dtype != np.float64:
+            h = np.asarray(h, dtype=self.dtype)
+        with self._phase('kernel.cov'):
+            if X1 is None and X2 is None:
+                K = self.kernel.cov(hypers=h)
+            else:
+                K = self.kernel.cov(X1, X2, hypers=h)
+        return np.asarray(K).astype(self.dtype, copy=False)
 
     def _make_Ks(self, hypers):
         """ Make covariance matrix (K) and noisy covariance matrix (Ky)."""
+        K = self._cov(hypers=hypers)
+        return K, self._add_noise(K, hypers)
+
+    def _add_noise(self, K, hypers, out=None):
+        """ Add the measurement variances to the diagonal of K.
+
+        Parameters:
+            K (np.ndarray): n x n
+            hypers (iterable): the hyperparameters
+            out (np.ndarray): optional n x n array for Ky. May be K.
+
+        Returns:
+            Ky (np.ndarray)
+        """
+        if out is None:
+            out = K.copy()
+        elif out is not K:
+            out[:] = K
+        diag = np.diag_indices(len(K))
         if self.variances is not None:
-            K = self.kernel.cov(hypers=hypers)
-            Ky = K + np.diag(self.variances)
+            out[diag] += self.variances
         else:
-            K = self.kernel.cov(hypers=hypers[1::])
-            Ky = K + np.identity(len(K)) * hypers[0]
-        return K, Ky
+            out[diag] += hypers[0]
+        return out
+
+    @property
+    def _Ky(self):
+        """ The noisy covariance for the current factorization. """
+        return self._add_noise(self._K, self.hypers)
+
+    def _workspace(self):
+        """ The n x n buffer for Ky during fit, or None otherwise. """
+        if not self._fitting:
+            return None
+        n = self._ell
+        if self._work is None or self._work.shape != (n, n):
+            self._work = np.empty((n, n), order='F')
+        return self._work
+
+    def _factorize(self, hypers, gradient=False, factors=None):
+        """ Factorize the noisy covariance for the given hyperparameters.
+
+        Factorizations are remembered for the last cache_size distinct
+        hyperparameters, so repeated evaluations at the same point
+        (by the optimizer, at the end of fit, or in predict) do not
+        repeat the Cholesky decomposition. The dependent values
+        (_K, _L, _alpha, ML) are set to the returned factorization.
+
+        During fit, the factor lives in the shared workspace, so K and
+        L are not kept: cached factorizations only hold alpha, ML and
+        the gradient, and are reused only when the gradient is needed.
+
+        Parameters:
+            hypers (iterable): the hyperparameters
+            gradient (Boolean): whether the gradient is needed
+            factors (tuple): optional precomputed (K, L)
+
+        Returns:
+            fact (_Factorization)
+        """
+        key = tuple(np.asarray(hypers, dtype=float))
+        fact = self._cache.get(key)
+        if fact is not None and fact.L is None and \
+                not (gradient and fact.grad is not None):
+            fact = None
+        if fact is None:
+            if factors is None:
+                self._K, L = self._factor(hypers)
+            else:
+                self._K, L = factors
+                L = L.astype(np.float64, copy=False)
+            # Each column of Y is an independent target
+            Y = np.reshape(self.normed_Y, (len(L), -1))
+            with self._phase('solve_triangular'):
+                self._alpha = linalg.solve_triangular(L, Y, lower=True)
+                self._alpha = linalg.solve_triangular(L.T, self._alpha,
+                                                      lower=False)
+            t = Y.shape[1]
+            first = 0.5 * np.sum(Y * self._alpha)
+            second = t * np.sum(np.log(np.diag(L)))
+            third = t * len(L) / 2. * np.log(2 * np.pi)
+            self.ML = float(first + second + third)
+            if L is not self._work:
+                L = L.astype(self.dtype, copy=False)
+            self._L = L
+            fact = _Factorization(self._K, self._L, self._alpha, self.ML, None)
+        else:
+            self._K, self._L, self._alpha, self.ML, _ = fact
+        if gradient and fact.grad is None:
+            with self._phase('gradient'):
+                fact = fact._replace(grad=self._grad_log_ML(hypers))
+        if fact.L is None or fact.L is not self._work:
+            return self._remember(key, fact)
+        # The workspace is reused by the next evaluation
+        self._remember(key, fact._replace(L=None))
+        if self._L is None:
+            fact = fact._replace(L=None)
+        return fact
+
+    def _factor(self, hypers):
+        """ K and the float64 lower Cholesky factor of Ky.
+
+        During fit, K is copied into the workspace, the noise is added
+        in place, and the workspace is overwritten by the factor, so
+        K is not kept. Otherwise Ky is a single copy of K that is
+        likewise overwritten. If a reduced dtype needs jitter, the
+        factor is not in the workspace, so K is kept with it.
+
+        Returns:
+            K (np.ndarray): None if L is the workspace
+            L (np.ndarray)
+        """
+        K = self._cov(hypers=hypers)
+        Ky = self._workspace()
+        # K is symmetric, so copying K.T into Fortran order is contiguous
+        if Ky is None:
+            Ky = np.array(K.T, dtype=np.float64, order='F')
+        else:
+            Ky[:] = K.T
+            K = None
+        self._add_noise(Ky, hypers, out=Ky)
+        try:
+            with self._phase('cholesky'):
+                L = linalg.cholesky(Ky, lower=True, overwrite_a=True,
+                                    check_finite=False)
+        except np.linalg.LinAlgError:
+            if self.dtype == np.float64:
+                raise
+            # The factor is cached outside the workspace, and
+            # add_observations and _Ky read K from the cache
+            K = self._cov(hypers=hypers)
+            L = self._cholesky(self._add_noise(K, hypers).astype(np.float64))
+        return K, L
+
+    def _cholesky(self, Ky):
+        """ Cholesky decomposition of Ky in float64.
+
+        With a reduced dtype, rounding of the kernel can make Ky
+        indefinite, so jitter on the scale of the dtype's precision
+        is added if needed.
+        """
+        if self.dtype == np.float64:
+            return np.linalg.cholesky(Ky)
+        return gplinalg.jitter_cholesky(Ky, np.finfo(self.dtype).eps)
+
+    def _remember(self, key, fact):
+        """ Cache fact, evicting the least recently used entries. """
+        self._cache[key] = fact
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return fact
 
     def _normalize(self, data):
         """ Normalize the given data.
@@ -202,55 +918,249 @@ class GPRegressor(BaseGPModel):
         """
         return normed*self.std + self.mean
 
-    def predict(self, X):
+    def predict(self, X, return_cov=True, return_std=False):
         """ Make predictions for each sequence in new_seqs.
 
         Predictions are scaled as the original outputs (not normalized)
 
-        Uses Equations 2.23 and 2.24 of RW
+        Uses Equations 2.23 and 2.24 of RW. If only the marginal
+        variances are requested, the n x n predictive covariance is
+        never formed, so memory is linear in the number of inputs.
+
         Parameters:
             new_seqs (pd.DataFrame or np.ndarray): sequences to predict.
+            return_cov (Boolean): return the full covariance. Default True.
+            return_std (Boolean): return the standard deviations instead
+                of the covariance. Default False.
 
          Returns:
             means, cov as np.ndarrays. means.shape is (n,), cov.shape is (n,n)
+            If return_cov is False, the variances, with shape (n,), are
+            returned instead of cov; if return_std is True, the standard
+            deviations are.
         """
+        if self._snapshot is not None:
+            return self._snapshot.predict(X, return_cov=return_cov,
+                                          return_std=return_std)
         if isinstance(X, pd.DataFrame):
             X = X.values
-        h = self.hypers[1::]
-        k_star = self.kernel.cov(X, self.X, hypers=h)
-        k_star_star = self.kernel.cov(X, X, hypers=h)
-        E = k_star @ self._alpha
-        v = linalg.solve_triangular(self._L, k_star.T, lower=True)
-        var = k_star_star - v.T @ v
-        E += self.mean_func.mean(X)
+        if not return_cov or return_std:
+            with self._phase('predict'):
+                E, var = self._predict_marginal(X)
+            if return_std:
+                return E, np.sqrt(np.maximum(var, 0))
+            return E, var
+        with self._phase('predict'):
+            return self._predict_full(X)
+
+    def _predict_full(self, X):
+        """ Predictive means and covariance for X. """
+        post = self._posterior
+        k_star = self._cov(X, self.X, self.hypers)
+        E = k_star @ post.alpha
+        with self._phase('solve_triangular'):
+            v = linalg.solve_triangular(post.L, k_star.T, lower=True)
+        k_star_star = self._cov(X, X, self.hypers)
+        var = (k_star_star - v.T @ v).astype(np.float64, copy=False)
+        E += self._prior_mean(X)
         E = self.unnormalize(E)
         E = E[:, 0]
         var *= self.std ** 2
         return E, var
 
-    def _log_ML(self, hypers):
+    def predict_iter(self, X_source, chunk_size=1000):
+        """ Make predictions for a stream of inputs, one chunk at a time.
+
+        Memory is bounded by chunk_size: a single n x chunk_size
+        workspace for the triangular solve is allocated once and
+        reused for every chunk.
+
+        Parameters:
+            X_source: np.ndarray, np.memmap, pd.DataFrame, or any
+                iterable of inputs
+            chunk_size (int): number of inputs per chunk
+
+        Yields:
+            means, variances as np.ndarrays for each chunk
+        """
+        if self._snapshot is not None:
+            return self._snapshot.predict_iter(X_source, chunk_size)
+        return self._predict_chunks(_iter_chunks(X_source, chunk_size),
+                                    chunk_size)
+
+    def _predict_chunks(self, chunks, chunk_size):
+        """ Generate means and variances for each array in chunks. """
+        work = np.empty((len(self.X), chunk_size), dtype=self.dtype,
+                        order='F')
+        for X in chunks:
+            with self._phase('predict'):
+                moments = self._predict_marginal(X, work=work[:, :len(X)])
+            yield moments
+
+    def _predict_marginal(self, X, work=None):
+        """ Predictive means and marginal variances for X.
+
+        Parameters:
+            X (np.ndarray): inputs to predict
+            work (np.ndarray): optional Fortran-ordered n x len(X)
+                workspace for the triangular solve
+
+        Returns:
+            means, variances as np.ndarrays
+        """
+        h = self._kernel_hypers(self.hypers)
+        post = self._posterior
+        k_star = self._cov(X, self.X, self.hypers)
+        E = k_star @ post.alpha
+        with self._phase('solve_triangular'):
+            if work is None:
+                v = linalg.solve_triangular(post.L, k_star.T, lower=True)
+            else:
+                work[:] = k_star.T
+                v = linalg.solve_triangular(post.L, work, lower=True,
+                                            overwrite_b=True)
+        var = self.kernel.diag(X, hypers=h) - np.einsum('ij,ij->j', v, v)
+        E += self._prior_mean(X)
+        E = self.unnormalize(E)
+        return E[:, 0], var * self.std ** 2
+
+    def _log_ML(self, hypers, gradient=False):
         """ Returns the negative log marginal likelihood for the model.
 
-        Uses RW Equation 5.8.
+        Uses RW Equation 5.8. If gradient is True, the gradient with
+        respect to the hyperparameters (RW Equation 5.9) is also
+        returned, computed from the same Cholesky factorization.
 
         Parameters:
             log_hypers (iterable): the hyperparameters
+            gradient (Boolean): whether to also return the gradient
 
         Returns:
             log_ML (float)
+            grad (np.ndarray): only if gradient is True
         """
-        self._K, self._Ky = self._make_Ks(hypers)
-        self._L = np.linalg.cholesky(self._Ky)
-        self._alpha = linalg.solve_triangular(self._L, self.normed_Y, lower=True)
-        self._alpha = linalg.solve_triangular(self._L.T, self._alpha,
-                                              lower=False)
-        self._alpha = np.expand_dims(self._alpha, 1)
-
-        first = 0.5 * np.dot(self.normed_Y, self._alpha)
-        second = np.sum(np.log(np.diag(self._L)))
-        third = len(self._K) / 2. * np.log(2 * np.pi)
-        self.ML = (first + second + third).item()
-        return self.ML
+        self._count('objective')
+        with self._phase('objective'):
+            fact = self._factorize(hypers, gradient=gradient)
+        if gradient:
+            return fact.ML, fact.grad
+        return fact.ML
+
+    def _LOO_log_p(self, hypers, gradient=False):
+        """ Returns the negative leave-one-out log predictive probability.
+
+        Uses RW Equations 5.10 - 5.12, and Equation 5.13 for the
+        gradient, all from a single Cholesky factorization.
+
+        Parameters:
+            hypers (iterable): the hyperparameters
+            gradient (Boolean): whether to also return the gradient
+
+        Returns:
+            LOO_log_p (float)
+            grad (np.ndarray): only if gradient is True
+        """
+        self._count('objective')
+        with self._phase('objective'):
+            fact = self._factorize(hypers)
+        mu, var, K_inv = self._LOO_moments(fact)
+        log_p = -0.5 * np.log(var) - (self.normed_Y - mu) ** 2 / (2 * var)
+        log_p -= 0.5 * np.log(2 * np.pi)
+        self.LOO_log_p = -np.sum(log_p)
+        if not gradient:
+            return self.LOO_log_p
+        alpha = fact.alpha[:, 0]
+        K_inv_diag = np.diag(K_inv)
+        # One derivative at a time, so that kernels with many
+        # hyperparameters never hold the whole n_hypers x n x n stack
+        dK = self.kernel.grad_iter(hypers=self._kernel_hypers(hypers))
+        if self.variances is None:
+            dK = itertools.chain([np.eye(len(alpha))], dK)
+        grad = []
+        for dK_j in self._timed(dK, 'kernel.grad'):
+            Z = K_inv @ dK_j
+            first = alpha * (Z @ alpha)
+            second = 0.5 * (1 + alpha ** 2 / K_inv_diag) * \
+                np.sum(Z * K_inv, axis=1)
+            grad.append(-np.sum((first - second) / K_inv_diag))
+        return self.LOO_log_p, np.array(grad)
+
+    def _LOO_moments(self, fact):
+        """ Leave-one-out predictive means and variances (RW 5.12).
+
+        Parameters:
+            fact (_Factorization)
+
+        Returns:
+            mu (np.ndarray): normalized LOO means
+            var (np.ndarray): normalized LOO variances
+            K_inv (np.ndarray): inverse of the noisy covariance
+        """
+        K_inv = linalg.cho_solve((fact.L, True), np.eye(len(fact.L)))
+        K_inv_diag = np.diag(K_inv)
+        mu = self.normed_Y - fact.alpha[:, 0] / K_inv_diag
+        return mu, 1.0 / K_inv_diag, K_inv
+
+    def LOO_res(self, hypers=None):
+        """ Leave-one-out predictions for every training input.
+
+        Computed in closed form from one factorization instead of n
+        refits. Predictions are scaled as the original outputs.
+
+        Parameters:
+            hypers (iterable): Default is the fitted hyperparameters.
+
+        Returns:
+            means, variances as np.ndarrays with shape (n,)
+        """
+        if hypers is None:
+            fact = self._posterior
+        else:
+            fact = self._factorize(hypers)
+        mu, var, _ = self._LOO_moments(fact)
+        mu = mu + self._prior_mean(self.X)[:, 0]
+        return self.unnormalize(mu), var * self.std ** 2
+
+    def _grad_log_ML(self, hypers):
+        """ Returns the gradient of the negative log marginal likelihood.
+
+        Uses RW Equation 5.9 with the current factorization. If the
+        factor is in the fit workspace, it is inverted in place, and
+        _L is set to None. The kernel's derivatives are contracted
+        one hyperparameter at a time, so memory is O(n^2) however
+        many hyperparameters the kernel has.
+
+        Parameters:
+            hypers (iterable): the hyperparameters
+
+        Returns:
+            grad (np.ndarray)
+        """
+        A = self._alpha
+        t = A.shape[1]
+        lower = self._L is self._work
+        if lower:
+            # The lower triangle of Ky^-1; the strict upper is zero
+            K_inv = linalg.lapack.dpotri(self._L, lower=1, overwrite_c=1)[0]
+            self._L = None
+            K_inv_diag = np.diag(K_inv).copy()
+        else:
+            K_inv = linalg.cho_solve((self._L, True), np.eye(len(self._L)))
+        dK = self.kernel.grad_iter(hypers=self._kernel_hypers(hypers))
+        fit = []
+        trace = []
+        for dK_j in self._timed(dK, 'kernel.grad'):
+            fit.append(np.sum((dK_j @ A) * A))
+            if lower:
+                trace.append(2 * np.einsum('ij,ij->', K_inv, dK_j) -
+                             K_inv_diag @ np.diag(dK_j))
+            else:
+                trace.append(np.einsum('ij,ij->', K_inv, dK_j))
+        grad = 0.5 * (t * np.array(trace) - np.array(fit))
+        if self.variances is not None:
+            return grad
+        noise = 0.5 * (t * np.trace(K_inv) - np.sum(A ** 2))
+        return np.concatenate(([noise], grad))
 
 
 class GPClassifier(BaseGPModel):
@@ -277,53 +1187,116 @@ class GPClassifier(BaseGPModel):
             X = X.values
         if isinstance(Y, pd.Series):
             Y = Y.values
-        self.X = X
-        self.Y = Y
-        self._ell = len(Y)
-        self._n_hypers = self.kernel.fit(X)
-        if self.guesses is None:
-            guesses = [0.9 for _ in range(self._n_hypers)]
-        else:
-            guesses = self.guesses
-            if len(guesses) != self._n_hypers:
-                raise AttributeError(('Length of guesses does not match '
-                                      'number of hyperparameters'))
-        if bounds is None:
-            bounds = [(1e-5, None) for _ in guesses]
-        minimize_res = minimize(self.objective,
-                                guesses,
-                                method='L-BFGS-B',
-                                bounds=bounds)
-        self.hypers = minimize_res['x']
-
-    def predict(self, X):
+        with self._thread_budget():
+            self.X = X
+            self.Y = Y
+            self._ell = len(Y)
+            with self._phase('kernel.fit'):
+                self._n_hypers = self.kernel.fit(X)
+            if self.guesses is None:
+                guesses = [0.9 for _ in range(self._n_hypers)]
+            else:
+                guesses = self.guesses
+                if len(guesses) != self._n_hypers:
+                    raise AttributeError(('Length of guesses does not '
+                                          'match number of hyperparameters'))
+            if bounds is None:
+                bounds = [(1e-5, None) for _ in guesses]
+            self.hypers = self._minimize(guesses, bounds)
+            self._publish()
+
+    def predict(self, X, return_cov=True):
         """ Make predictions for each input in X.
 
         Uses Algorithm 3.2 of RW
         Parameters:
             X (np.ndarray): inputs to predict
+            return_cov (Boolean): return the full latent covariance.
+                Otherwise only the latent variances are computed.
+                Default True.
 
          Returns:
             pi_star, f_bar, var as np.ndarrays
         """
+        if self._snapshot is not None:
+            return self._snapshot.predict(X, return_cov=return_cov)
         if isinstance(X, pd.DataFrame):
             X = X.values
-        predictions = []
-        k_star = self.kernel.cov(X, self.X, hypers=self.hypers)
-        k_star_star = self.kernel.cov(X, X, hypers=self.hypers)
+        if not return_cov:
+            with self._phase('predict'):
+                f_bar, var = self._predict_latent(X)
+                return self._pi_star(f_bar, var), f_bar, var
+        with self._phase('predict'):
+            with self._phase('kernel.cov'):
+                k_star = self.kernel.cov(X, self.X, hypers=self.hypers)
+                k_star_star = self.kernel.cov(X, X, hypers=self.hypers)
+            f_bar = np.dot(k_star, self._grad)
+            Wk = np.expand_dims(self._W_root, 1) * k_star.T
+            with self._phase('solve_triangular'):
+                v = linalg.solve_triangular(self._L, Wk, lower=True)
+            var = k_star_star - np.dot(v.T, v)
+            return self._pi_star(f_bar, np.diag(var)), f_bar.flatten(), var
+
+    def predict_iter(self, X_source, chunk_size=1000):
+        """ Make predictions for a stream of inputs, one chunk at a time.
+
+        Memory is bounded by chunk_size: a single n x chunk_size
+        workspace for the triangular solve is allocated once and
+        reused for every chunk.
+
+        Parameters:
+            X_source: np.ndarray, np.memmap, pd.DataFrame, or any
+                iterable of inputs
+            chunk_size (int): number of inputs per chunk
+
+        Yields:
+            pi_star, f_bar, variances as np.ndarrays for each chunk
+        """
+        if self._snapshot is not None:
+            yield from self._snapshot.predict_iter(X_source, chunk_size)
+            return
+        work = np.empty((len(self.X), chunk_size), order='F')
+        for X in _iter_chunks(X_source, chunk_size):
+            with self._phase('predict'):
+                f_bar, var = self._predict_latent(X, work=work[:, :len(X)])
+                pi_star = self._pi_star(f_bar, var)
+            yield pi_star, f_bar, var
+
+    def _predict_latent(self, X, work=None):
+        """ Latent means and marginal variances for X.
+
+        Parameters:
+            X (np.ndarray): inputs to predict
+            work (np.ndarray): optional Fortran-ordered n x len(X)
+                workspace for the triangular solve
+
+        Returns:
+            f_bar, variances as np.ndarrays
+        """
+        with self._phase('kernel.cov'):
+            k_star = self.kernel.cov(X, self.X, hypers=self.hypers)
         f_bar = np.dot(k_star, self._grad)
-        Wk = np.expand_dims(self._W_root, 1) * k_star.T
-        v = linalg.solve_triangular(self._L, Wk, lower=True)
-        var = k_star_star - np.dot(v.T, v)
+        if work is None:
+            work = np.empty((len(self.X), len(X)), order='F')
+        np.multiply(np.expand_dims(self._W_root, 1), k_star.T, out=work)
+        with self._phase('solve_triangular'):
+            v = linalg.solve_triangular(self._L, work, lower=True,
+                                        overwrite_b=True)
+        var = self.kernel.diag(X, hypers=self.hypers) - \
+            np.einsum('ij,ij->j', v, v)
+        return f_bar.flatten(), var
+
+    def _pi_star(self, f_bar, variances):
+        """ Integrate the sigmoid over each latent marginal. """
         span = 20
-        pi_star = np.zeros(len(X))
-        for i, preds in enumerate(zip(f_bar, np.diag(var))):
+        pi_star = np.zeros(len(f_bar))
+        for i, preds in enumerate(zip(f_bar, variances)):
             f, va = preds
             pi_star[i] = integrate.quad(self._p_integral,
                                         -span * va + f,
                                         span * va + f,
                                         args=(f, va))[0]
-        return pi_star.flatten(), f_bar.flatten(), var
+        return pi_star
 
     def _p_integral(self, z, mean, variance):
         ''' Equation 3.25 from RW with a sigmoid likelihood.
@@ -357,12 +1330,20 @@ class GPClassifier(BaseGPModel):
         Returns:
             log_ML (float)
         """
+        self._count('objective')
+        with self._phase('objective'):
+            return self._laplace_log_ML(hypers)
+
+    def _laplace_log_ML(self, hypers):
+        """ The negative log ML from the Laplace approximation. """
         ell = len(self.Y)
         self._f_hat = np.zeros(ell)
-        self._K = self.kernel.cov(hypers=hypers)
+        with self._phase('kernel.cov'):
+            self._K = self.kernel.cov(hypers=hypers)
         evals = 1000
         threshold = 1e-15
         for i in range(evals):
+            self._count('newton_iterations')
             pi = expit(self._f_hat)
             # Line 4
             W = pi * (1 - pi)
@@ -370,7 +1351,8 @@ class GPClassifier(BaseGPModel):
             self._W_root = np.sqrt(W)
             W_sr_K = self._W_root[:, np.newaxis] * self._K
             B = np.eye(W.shape[0]) + W_sr_K * self._W_root
-            self._L = np.linalg.cholesky(B)
+            with self._phase('cholesky'):
+                self._L = np.linalg.cholesky(B)
             # Line 6
             self._grad = (self.Y + 1) / 2 - pi
             b = W * self._f_hat + self._grad
@@ -438,6 +1420,8 @@ class GPMultiClassifier(BaseGPModel):
     def __init__(self, kernels, **kwargs):
         self.kernels = kernels
         self.guesses = None
+        self.n_starts = 1
+        self.n_jobs = 1
         self._set_params(**kwargs)
         self.objective = self._log_ML
 
@@ -485,6 +1469,8 @@ class GPMultiClassifier(BaseGPModel):
             mu (np.ndarray): latent test mean. n x c
             sigma (np.ndarray): latent test covariance. n x c x c
         """
+        if self._snapshot is not None:
+            return self._snapshot.predict(X)
         if isinstance(X, pd.DataFrame):
             X = X.values
         P = self._softmax(self._f_hat)
@@ -533,22 +1519,20 @@ class GPMultiClassifier(BaseGPModel):
             X = X.values
         if isinstance(Y, pd.Series):
             Y = Y.values
-        self.X = X
-        self.Y = Y
-        self._n_hypers = [k.fit(X) for k in self.kernels]
-        if self.guesses is None:
-            guesses = [0.9 for _ in range(sum(self._n_hypers))]
-        else:
-            guesses = self.guesses
-            if len(guesses) != sum(self._n_hypers):
-                raise AttributeError(('Length of guesses does not match '
-                                      'number of hyperparameters'))
-        bounds = [(1e-5, 50) for _ in guesses]
-        minimize_res = minimize(self.objective,
-                                (guesses),
-                                bounds=bounds,
-                                method='L-BFGS-B')
-        self.hypers = minimize_res['x']
+        with self._thread_budget():
+            self.X = X
+            self.Y = Y
+            self._n_hypers = [k.fit(X) for k in self.kernels]
+            if self.guesses is None:
+                guesses = [0.9 for _ in range(sum(self._n_hypers))]
+            else:
+                guesses = self.guesses
+                if len(guesses) != sum(self._n_hypers):
+                    raise AttributeError(('Length of guesses does not '
+                                          'match number of hyperparameters'))
+            bounds = [(1e-5, 50) for _ in guesses]
+            self.hypers = self._minimize(guesses, bounds)
+            self._publish()
         return
 
     def _log_ML(self, hypers):
@@ -562,6 +1546,12 @@ class GPMultiClassifier(BaseGPModel):
         Returns:
             log_ML (float)
         """
+        self._count('objective')
+        with self._phase('objective'):
+            return self._laplace_log_ML(hypers)
+
+    def _laplace_log_ML(self, hypers):
+        """ The negative log ML from the Laplace approximation. """
         self._f_hat = self._find_F(hypers)
         n_samples, n_classes = self.Y.shape
         Y_vector = (self.Y.T).reshape((n_samples * n_classes, 1))
@@ -570,15 +1560,7 @@ class GPMultiClassifier(BaseGPModel):
         P_vector = P.T.reshape((n_samples * n_classes, 1))
         PI = self._stack(P)
         K_expanded = self._expand(self._K)
-        self._E = np.zeros((n_samples, n_samples, n_classes))
-        self._L = np.zeros((n_samples, n_samples, n_classes))
-        for i in range(n_classes):
-            Dc_root = np.sqrt(np.diag(P[:, i]))
-            DKD = Dc_root @ self._K[:, :, i] @ Dc_root
-            self._L[:, :, i] = np.linalg.cholesky(np.eye(n_samples) + DKD)
-            first = np.linalg.lstsq(self._L[:, :, i], Dc_root)[0]
-            self._E[:, :, i] = Dc_root @ \
-                np.linalg.lstsq(self._L[:, :, i].T, first)[0]
+        self._L, self._E = self._factor_classes(P)
         self._M = np.linalg.cholesky(np.sum(self._E, axis=2))
         D = np.diag(P_vector[:, 0])
         b = (D - PI @ PI.T) @ f_hat_vector + Y_vector - P_vector
@@ -619,18 +1601,11 @@ class GPMultiClassifier(BaseGPModel):
                                  axis=0)
         n_below = 0
         for k in range(evals):
+            self._count('newton_iterations')
             P = self._softmax(f_hat)
             P_vector = P.T.reshape((n_samples * n_classes, 1))
             PI = self._stack(P)
-            E = np.zeros((n_samples, n_samples, n_classes))
-            L = np.zeros((n_samples, n_samples, n_classes))
-            for i in range(n_classes):
-                Dc_root = np.sqrt(np.diag(P[:, i]))
-                DKD = Dc_root @ self._K[:, :, i] @ Dc_root
-                L[:, :, i] = np.linalg.cholesky(np.eye(n_samples) + DKD)
-                first = np.linalg.lstsq(L[:, :, i], Dc_root)[0]
-                E[:, :, i] = Dc_root @ \
-                    np.linalg.lstsq(L[:, :, i].T, first)[0]
+            _, E = self._factor_classes(P)
             M = np.linalg.cholesky(np.sum(E, axis=2))
             D = np.diag(P_vector[:, 0])
             b = (D - PI @ PI.T) @ f_vector + Y_vector - P_vector
@@ -652,6 +1627,23 @@ class GPMultiClassifier(BaseGPModel):
                 break
         return f_hat
 
+    def _factor_classes(self, P):
+        """ Factor each class at the probabilities P.
+
+        The classes are factored by the active gpparallel executor.
+
+        Returns:
+            L (np.ndarray): n_samples x n_samples x n_classes
+            E (np.ndarray): n_samples x n_samples x n_classes
+        """
+        executor = gpparallel.current_executor()
+        with self._phase('cholesky'):
+            factors = executor.map(_class_factor, P.T,
+                                   self._K.transpose(2, 0, 1))
+        L = np.stack([f[0] for f in factors], axis=2)
+        E = np.stack([f[1] for f in factors], axis=2)
+        return L, E
+
     def _expand(self, A):
         """ Expand n x m x c matrix to nm x nc block diagonal matrix. """
         n, m, c = A.shape
@@ -663,8 +1655,9 @@ class GPMultiClassifier(BaseGPModel):
     def _make_K(self, hypers):
         """ Make the covariance matrix for the training inputs. """
         hypers = self._split_hypers(hypers)
-        Ks = np.stack([k.cov(hypers=h) for k, h in zip(self.kernels, hypers)],
-                      axis=2)
+        with self._phase('kernel.cov'):
+            Ks = np.stack([k.cov(hypers=h)
+                           for k, h in zip(self.kernels, hypers)], axis=2)
         return Ks
 
     def _split_hypers(self, hypers):
@@ -701,6 +1694,9 @@ class LassoGPRegressor(GPRegressor):
 
     """ Extends GPRegressor with L1 regression for feature selection. """
 
+    _compact_attributes = GPRegressor._compact_attributes + ['_mask',
+                                                             'gamma']
+
     def __init__(self, kernel, **kwargs):
         self._gamma_0 = kwargs.get('gamma', 0)
         self._clf = linear_model.Lasso(alpha=np.exp(self._gamma_0),
@@ -708,17 +1704,33 @@ class LassoGPRegressor(GPRegressor):
                                        max_iter=100000)
         GPRegressor.__init__(self, kernel, **kwargs)
 
-    def predict(self, X):
+    def predict(self, X, **kwargs):
+        if self._snapshot is not None:
+            return self._snapshot.predict(X, **kwargs)
         X, _ = self._regularize(X, mask=self._mask)
-        return GPRegressor.predict(self, X)
+        return GPRegressor.predict(self, X, **kwargs)
+
+    def add_observations(self, X_new, Y_new, **kwargs):
+        X_new, _ = self._regularize(X_new, mask=self._mask)
+        if isinstance(X_new, pd.DataFrame):
+            X_new = X_new.values
+        GPRegressor.add_observations(self, X_new, Y_new, **kwargs)
+
+    def predict_iter(self, X_source, chunk_size=1000):
+        if self._snapshot is not None:
+            return self._snapshot.predict_iter(X_source, chunk_size)
+        chunks = (self._regularize(X, mask=self._mask)[0]
+                  for X in _iter_chunks(X_source, chunk_size))
+        return self._predict_chunks(chunks, chunk_size)
 
     def fit(self, X, y, variances=None):
-        minimize_res = minimize(self._log_ML_from_gamma,
-                                self._gamma_0,
-                                args=(X, y, variances),
-                                method='Powell',
-                                options={'xtol': 1e-8, 'ftol': 1e-8})
-        self.gamma = minimize_res['x']
+        with self._thread_budget():
+            minimize_res = minimize(self._log_ML_from_gamma,
+                                    self._gamma_0,
+                                    args=(X, y, variances),
+                                    method='Powell',
+                                    options={'xtol': 1e-8, 'ftol': 1e-8})
+            self.gamma = minimize_res['x']
 
     def _log_ML_from_gamma(self, gamma, X, y, variances=None):
         X, self._mask = self._regularize(X, gamma=gamma, y=y)
@@ -761,3 +1773,1006 @@ class LassoGPRegressor(GPRegressor):
         if isinstance(X, pd.DataFrame):
             X.columns = list(range(np.shape(X)[1]))
         return X, mask
+
+
+class MultiTargetGPRegressor(GPRegressor):
+
+    """ Gaussian process regression of several targets on the same inputs.
+
+    Y is n x t, and each target is normalized separately. The kernel
+    is fit once for all targets.
+
+    With shared hyperparameters, the negative log ML is the sum over
+    targets, and a single Cholesky decomposition of Ky solves for all
+    t columns of alpha. Predictions for every target then come from
+    one k_star. Otherwise each target has its own hyperparameters and
+    is fit in turn, reusing the fitted kernel.
+
+    Measurement variances, add_observations, and the LOO objective
+    are not supported.
+
+    Attributes:
+        shared (Boolean): whether the targets share hyperparameters.
+            Default is True.
+        hypers (np.ndarray): the hyperparameters, t x h if not shared
+    """
+
+    _compact_attributes = GPRegressor._compact_attributes + ['shared']
+
+    def __init__(self, kernel, shared=True, **kwargs):
+        self.shared = shared
+        GPRegressor.__init__(self, kernel, **kwargs)
+
+    def _set_objective(self, objective):
+        """ Set objective function for model. """
+        if objective is not None and objective != 'log_ML':
+            raise AttributeError(objective + ' is not a valid objective')
+        self.objective = self._log_ML
+
+    def fit(self, X, Y, bounds=None):
+        """ Fit the model to the given data.
+
+        Parameters:
+            X (np.ndarray): n x d
+            Y (np.ndarray): n x t
+        """
+        if isinstance(Y, pd.DataFrame):
+            Y = Y.values
+        Y = np.reshape(np.asarray(Y, dtype=float), (len(Y), -1))
+        GPRegressor.fit(self, X, Y, bounds=bounds)
+
+    def add_observations(self, X_new, Y_new, variances=None,
+                         refit_hypers=False):
+        """ Not supported: refit the model with fit. """
+        raise NotImplementedError(type(self).__name__ +
+                                  ' does not support add_observations')
+
+    def LOO_res(self, hypers=None):
+        """ Not supported for multiple targets. """
+        raise NotImplementedError(type(self).__name__ +
+                                  ' does not support LOO_res')
+
+    def _normalize(self, data):
+        """ Normalize each column of data. """
+        m = data.mean(axis=0)
+        s = data.std(axis=0)
+        return m, s, (data - m) / s
+
+    def _set_targets(self, variances=None):
+        """ Normalize Y and fit the mean function. """
+        self._cache.clear()
+        self.mean, self.std, self.normed_Y = self._normalize(self.Y)
+        self.mean_func.fit(self.X, self.normed_Y)
+        self.normed_Y = self.normed_Y - self._prior_mean(self.X)
+        self.variances = None
+
+    def _fit_hypers(self, guesses):
+        """ Optimize the hyperparameters and finalize the posterior.
+
+        Without shared hyperparameters, each target is fit in turn,
+        and _posterior is a list with one factorization for each.
+        Their K are dropped, since only L and alpha are needed to
+        predict.
+        """
+        if self.shared:
+            GPRegressor._fit_hypers(self, guesses)
+            return
+        Y = self.normed_Y
+        hypers = []
+        posteriors = []
+        try:
+            for j in range(Y.shape[1]):
+                self.normed_Y = Y[:, [j]]
+                self._cache.clear()
+                h = self._optimize_hypers(guesses)
+                hypers.append(h)
+                posteriors.append(self._factorize(h)._replace(K=None))
+        finally:
+            self.normed_Y = Y
+            self._cache.clear()
+        self.hypers = np.array(hypers)
+        self.ML = sum(post.ML for post in posteriors)
+        self._posterior = posteriors
+
+    def predict(self, X, return_cov=True, return_std=False):
+        """ Make predictions of every target for each input in X.
+
+        Predictions are scaled as the original outputs (not
+        normalized).
+
+        Parameters:
+            X (pd.DataFrame or np.ndarray): m inputs to predict.
+            return_cov (Boolean): return the full covariance. Default True.
+            return_std (Boolean): return the standard deviations instead
+                of the covariance. Default False.
+
+        Returns:
+            means (np.ndarray): m x t
+            cov (np.ndarray): m x m x t. If return_cov is False, the
+                m x t variances; if return_std is True, the standard
+                deviations.
+        """
+        if self._snapshot is not None:
+            return self._snapshot.predict(X, return_cov=return_cov,
+                                          return_std=return_std)
+        if isinstance(X, pd.DataFrame):
+            X = X.values
+        full = return_cov and not return_std
+        if self.shared:
+            E, var = self._predict_moments(X, self._posterior, self.hypers,
+                                           full)
+            var = np.expand_dims(var, -1)
+        else:
+            moments = [self._predict_moments(X, post, h, full)
+                       for post, h in zip(self._posterior, self.hypers)]
+            E = np.concatenate([E for E, _ in moments], axis=1)
+            var = np.stack([var for _, var in moments], axis=-1)
+        E = self.unnormalize(E + self._prior_mean(X))
+        var = var * self.std ** 2
+        if return_std:
+            return E, np.sqrt(np.maximum(var, 0))
+        return E, var
+
+    def _predict_moments(self, X, post, hypers, full):
+        """ Normalized means and the covariance (or variances) for X.
+
+        Returns:
+            means (np.ndarray): m x t for the targets in post.alpha
+            cov (np.ndarray): m x m, or the m variances
+        """
+        k_star = self._cov(X, self.X, hypers)
+        E = k_star @ post.alpha
+        v = linalg.solve_triangular(post.L, k_star.T, lower=True)
+        if full:
+            var = self._cov(X, X, hypers) - v.T @ v
+        else:
+            var = self.kernel.diag(X, hypers=self._kernel_hypers(hypers)) - \
+                np.einsum('ij,ij->j', v, v)
+        return E, np.asarray(var, dtype=float)
+
+    def _predict_chunks(self, chunks, chunk_size):
+        """ Generate means and variances for each array in chunks. """
+        for X in chunks:
+            yield self.predict(X, return_cov=False)
+
+
+class BaseApproximateRegressor(GPRegressor):
+
+    """ Base class for regression models without an in-memory Cholesky.
+
+    Subclasses implement _factorize and _predict_moments, and only
+    support the log_ML objective.
+    """
+
+    def _set_objective(self, objective):
+        """ Set objective function for model. """
+        if objective is not None and objective != 'log_ML':
+            raise AttributeError(objective + ' is not a valid objective')
+        self.objective = self._log_ML
+
+    def add_observations(self, X_new, Y_new, variances=None,
+                         refit_hypers=False):
+        """ Not supported: refit the model with fit. """
+        raise NotImplementedError(type(self).__name__ +
+                                  ' does not support add_observations')
+
+    def dump_compact(self, directory):
+        """ Not supported: the posterior is not an exact Cholesky factor. """
+        raise NotImplementedError(type(self).__name__ +
+                                  ' does not support dump_compact')
+
+    def LOO_res(self, hypers=None):
+        """ Not supported for the approximate models. """
+        raise NotImplementedError('LOO_res requires the exact posterior')
+
+    def predict(self, X, return_cov=True, return_std=False):
+        """ Make predictions for each input in X.
+
+        Predictions are scaled as the original outputs (not
+        normalized).
+
+        Parameters:
+            X (pd.DataFrame or np.ndarray): inputs to predict.
+            return_cov (Boolean): return the full covariance. Default True.
+            return_std (Boolean): return the standard deviations instead
+                of the covariance. Default False.
+
+        Returns:
+            means, cov as np.ndarrays, as for GPRegressor.predict
+        """
+        if self._snapshot is not None:
+            return self._snapshot.predict(X, return_cov=return_cov,
+                                          return_std=return_std)
+        if isinstance(X, pd.DataFrame):
+            X = X.values
+        E, var = self._predict_moments(X, return_cov and not return_std)
+        if return_std:
+            return E, np.sqrt(np.maximum(var, 0))
+        return E, var
+
+    def _predict_chunks(self, chunks, chunk_size):
+        """ Generate means and variances for each array in chunks. """
+        for X in chunks:
+            yield self._predict_marginal(X)
+
+    def _predict_marginal(self, X, work=None):
+        """ Predictive means and marginal variances for X. """
+        return self._predict_moments(X, False)
+
+    @abc.abstractmethod
+    def _predict_moments(self, X, full):
+        """ Predictive means and the covariance (or variances) for X. """
+        return
+
+
+class BaseLowRankRegressor(BaseApproximateRegressor):
+
+    """ Base class for regression with a low-rank approximate covariance.
+
+    Subclasses approximate the noisy covariance of the n training
+    targets as V.T @ V + diag(lam) for an r x n matrix V, which is
+    factorized through an r x r matrix with the Woodbury identity.
+    The objective then costs O(nr^2) time and O(nr) memory, and the
+    n x n covariance is never formed. The objective is differentiated
+    numerically, and the predictive mean costs O(r) per input.
+    """
+
+    def _fit_hypers(self, guesses):
+        """ Optimize the hyperparameters and finalize the posterior. """
+        self.hypers = self._minimize(guesses, self._bounds)
+        self._posterior = self._factorize(self.hypers)
+
+    @abc.abstractmethod
+    def _low_rank(self, hypers):
+        """ The low-rank form of the noisy covariance.
+
+        Returns:
+            V (np.ndarray): r x n
+            lam (np.ndarray): n
+            L_u (np.ndarray): r x r, or None. Saved for _project.
+            penalty (float): added to the negative log ML
+        """
+        return
+
+    @abc.abstractmethod
+    def _project(self, X, full):
+        """ Project new inputs onto the low-rank basis.
+
+        Returns:
+            v (np.ndarray): r x k
+            prior (np.ndarray): the prior covariance (or its diagonal
+                if full is False) not explained by v.T @ v
+        """
+        return
+
+    def _factorize(self, hypers, gradient=False, factors=None):
+        """ Factorize the approximate noisy covariance.
+
+        Factorizations are cached as in GPRegressor, and ML is set
+        to the negative log ML of the approximation.
+
+        Parameters:
+            hypers (iterable): the hyperparameters
+            gradient (Boolean): ignored
+            factors: ignored
+
+        Returns:
+            fact (_LowRankFactorization)
+        """
+        key = tuple(np.asarray(hypers, dtype=float))
+        fact = self._cache.get(key)
+        if fact is None:
+            V, lam, L_u, penalty = self._low_rank(hypers)
+            with self._phase('cholesky'):
+                L_A, b, quad, logdet = gplinalg.woodbury_factor(
+                    V, lam, self.normed_Y)
+            ML = 0.5 * quad + 0.5 * logdet + \
+                self._ell / 2. * np.log(2 * np.pi) + penalty
+            with self._phase('solve_triangular'):
+                w = linalg.solve_triangular(L_A.T, b, lower=False)
+            fact = _LowRankFactorization(L_u, L_A, np.expand_dims(w, 1),
+                                         float(ML), None)
+        self.ML = fact.ML
+        return self._remember(key, fact)
+
+    def _predict_moments(self, X, full):
+        """ Predictive means and the covariance (or variances) for X. """
+        post = self._posterior
+        v, var = self._project(X, full)
+        E = v.T @ post.w
+        E += self._prior_mean(X)
+        E = self.unnormalize(E)
+        with self._phase('solve_triangular'):
+            v_A = linalg.solve_triangular(post.L_A, v, lower=True)
+        if full:
+            var = var + v_A.T @ v_A
+        else:
+            var = var + np.sum(v_A ** 2, axis=0)
+        return E[:, 0], var * self.std ** 2
+
+
+class SparseGPRegressor(BaseLowRankRegressor):
+
+    """ A Gaussian process regression model with inducing inputs.
+
+    The n training inputs are summarized by m << n inducing inputs
+    chosen from among them. Fitting optimizes the VFE (Titsias, 2009)
+    or FITC (Snelson and Ghahramani, 2006) approximate log marginal
+    likelihood in O(nm^2) time and O(nm) memory, and the predictive
+    mean costs O(m) per input. Only cross-covariances between the
+    inducing inputs and other inputs are computed, so any kernel
+    that supports cov(X1, X2) and diag can be used.
+
+    Attributes:
+        inducing (int or np.ndarray): the number of inducing inputs,
+            or the indices of the training inputs to use
+        selection (string): 'kmeans' or 'greedy'. How the inducing
+            inputs are chosen when inducing is an int. k-means
+            requires numerical inputs; greedy selection uses a
+            pivoted Cholesky decomposition of the kernel at the
+            initial hyperparameters.
+        approximation (string): 'VFE' or 'FITC'
+        jitter (float): added to the diagonal of the inducing
+            covariance, relative to its mean diagonal
+        Z_index (np.ndarray): indices of the inducing inputs in X
+        Z (np.ndarray): the inducing inputs
+    """
+
+    def __init__(self, kernel, inducing=100, selection='kmeans',
+                 approximation='VFE', **kwargs):
+        if selection not in ['kmeans', 'greedy']:
+            raise ValueError(selection + ' is not a valid selection')
+        if approximation not in ['VFE', 'FITC']:
+            raise ValueError(approximation +
+                             ' is not a valid approximation')
+        self.inducing = inducing
+        self.selection = selection
+        self.approximation = approximation
+        self.jitter = 1e-8
+        GPRegressor.__init__(self, kernel, **kwargs)
+
+    def _fit_kernel(self, X):
+        """ Choose the inducing inputs and save their kernel values. """
+        self.Z_index = self._select_inducing(X)
+        self.Z = X[self.Z_index]
+        return self.kernel.fit(self.Z)
+
+    def _select_inducing(self, X):
+        """ Indices of the training inputs used as inducing inputs. """
+        if not np.isscalar(self.inducing):
+            return np.asarray(self.inducing, dtype=int)
+        m = min(self.inducing, len(X))
+        if self.selection == 'greedy':
+            def column(j):
+                with self._phase('kernel.cov'):
+                    return self.kernel.cov(X, X[[j]])[:, 0]
+            with self._phase('kernel.cov'):
+                diag = self.kernel.diag(X)
+            _, pivots = gplinalg.pivoted_cholesky(diag, column, m)
+            return pivots
+        km = cluster.KMeans(n_clusters=m, n_init=1, random_state=0)
+        km.fit(X)
+        # Snap each center to the nearest training input not yet used
+        D = distance.cdist(km.cluster_centers_, X)
+        inds = []
+        for row in D:
+            row[inds] = np.inf
+            inds.append(np.argmin(row))
+        return np.array(inds, dtype=int)
+
+    def _low_rank(self, hypers):
+        """ V = L_u^-1 K_uf, where K_uu = L_u L_u^T.
+
+        FITC adds the residual variances diag(K_ff - Q_ff) to the
+        noise, and VFE adds their sum as a trace penalty.
+        """
+        h = self._kernel_hypers(hypers)
+        with self._phase('kernel.cov'):
+            K_uu = self.kernel.cov(hypers=h)
+            K_uf = self.kernel.cov(self.Z, self.X, hypers=h)
+            k_ff = self.kernel.diag(self.X, hypers=h)
+        K_uu += np.identity(len(K_uu)) * \
+            self.jitter * np.mean(np.diag(K_uu))
+        with self._phase('cholesky'):
+            L_u = np.linalg.cholesky(K_uu)
+        with self._phase('solve_triangular'):
+            V = linalg.solve_triangular(L_u, K_uf, lower=True)
+        residual = k_ff - np.sum(V ** 2, axis=0)
+        noise = self._noise(hypers)
+        if self.approximation == 'FITC':
+            return V, noise + residual, L_u, 0.0
+        return V, noise, L_u, 0.5 * np.sum(residual / noise)
+
+    def _project(self, X, full):
+        h = self._kernel_hypers(self.hypers)
+        with self._phase('kernel.cov'):
+            K_uX = self.kernel.cov(self.Z, X, hypers=h)
+            if full:
+                prior = self.kernel.cov(X, X, hypers=h)
+            else:
+                prior = self.kernel.diag(X, hypers=h)
+        with self._phase('solve_triangular'):
+            v = linalg.solve_triangular(self._posterior.L_u, K_uX, lower=True)
+        if full:
+            return v, prior - v.T @ v
+        return v, prior - np.sum(v ** 2, axis=0)
+
+
+class FeatureGPRegressor(BaseLowRankRegressor):
+
+    """ A Gaussian process regression model in weight space.
+
+    For a kernel with an explicit map to r features, the model is
+    Bayesian linear regression on the features, which costs O(nr^2)
+    to fit, O(r) per input for the predictive mean, and never forms
+    the n x n Gram matrix. The kernel must implement
+    features(X, hypers), for example gpkernel.LowRankKernel wrapped
+    around any other kernel.
+    """
+
+    def _low_rank(self, hypers):
+        """ V is the transposed feature matrix. """
+        with self._phase('kernel.cov'):
+            Phi = self.kernel.features(self.X,
+                                       hypers=self._kernel_hypers(hypers))
+        return Phi.T, self._noise(hypers), None, 0.0
+
+    def _project(self, X, full):
+        with self._phase('kernel.cov'):
+            v = self.kernel.features(
+                X, hypers=self._kernel_hypers(self.hypers)).T
+        if full:
+            return v, np.zeros((len(X), len(X)))
+        return v, np.zeros(len(X))
+
+
+class RandomFeatureGPRegressor(FeatureGPRegressor):
+
+    """ A Gaussian process regression model with random Fourier features.
+
+    The kernel is approximated by an explicit map to n_features
+    trigonometric features (Rahimi and Recht, 2007), so that fitting
+    costs O(n D^2) for D features and the predictive mean costs O(D)
+    per input. The random frequencies are drawn once from seed, so a
+    model refit or reloaded with the same seed uses the same features.
+    The kernel must implement fit_features and features (SEKernel,
+    ARDSEKernel, MaternKernel, and ARDMaternKernel).
+
+    Attributes:
+        n_features (int): number of features D. Should be even.
+        seed (int): seed for the random frequencies
+    """
+
+    def __init__(self, kernel, n_features=1000, seed=0, **kwargs):
+        self.n_features = n_features
+        self.seed = seed
+        GPRegressor.__init__(self, kernel, **kwargs)
+
+    def _fit_kernel(self, X):
+        """ Draw the random frequencies for the kernel. """
+        return self.kernel.fit_features(X, self.n_features, seed=self.seed)
+
+
+class IterativeGPRegressor(BaseApproximateRegressor):
+
+    """ A Gaussian process regression model solved by matrix products.
+
+    The noisy covariance Ky is never factorized or stored. Instead,
+    its products with blocks of vectors are computed tile_size rows
+    at a time directly from the kernel, and used by batched
+    preconditioned conjugate gradients to solve Ky^-1 y. log|Ky| and
+    its gradient are estimated by stochastic Lanczos quadrature from
+    the same solves (Gardner et al., 2018). The preconditioner is
+    Ky's rank precond_rank pivoted Cholesky factor plus the noise.
+    Memory is O(n * tile_size), and the kernel must implement
+    cov(X1, X2) and diag, and grad(X1, X2) for the gradient.
+
+    The probe vectors are drawn from seed on every evaluation, so the
+    objective is a deterministic function of the hyperparameters.
+
+    Attributes:
+        n_probes (int): number of probe vectors. Default is 10.
+        precond_rank (int): rank of the preconditioner. Default is 50.
+        tile_size (int): rows of Ky evaluated at once. Default is 1000.
+        tol (float): relative residual for the CG solves
+        max_iter (int): maximum CG iterations
+        seed (int): seed for the probe vectors
+    """
+
+    def __init__(self, kernel, n_probes=10, precond_rank=50, tile_size=1000,
+                 tol=1e-6, max_iter=1000, seed=0, **kwargs):
+        self.n_probes = n_probes
+        self.precond_rank = precond_rank
+        self.tile_size = tile_size
+        self.tol = tol
+        self.max_iter = max_iter
+        self.seed = seed
+        GPRegressor.__init__(self, kernel, **kwargs)
+
+    def _fit_kernel(self, X):
+        """ Count the kernel hyperparameters.
+
+        The kernel is fit on a single input, so nothing of size n
+        is saved. All covariances are computed from the inputs.
+        """
+        return self.kernel.fit(X[:1])
+
+    def _tiles(self):
+        """ Row slices of the training inputs. """
+        for i in range(0, self._ell, self.tile_size):
+            yield slice(i, i + self.tile_size)
+
+    def _matvec(self, V, hypers):
+        """ Ky @ V, evaluating the kernel one tile of rows at a time. """
+        h = self._kernel_hypers(hypers)
+        out = np.expand_dims(self._noise(hypers), 1) * V
+        for t in self._tiles():
+            with self._phase('kernel.cov'):
+                K_t = self.kernel.cov(self.X[t], self.X, hypers=h)
+            out[t] += K_t @ V
+        return out
+
+    def _precondition(self, hypers):
+        """ Pivoted Cholesky preconditioner P = V.T @ V + diag(lam). """
+        h = self._kernel_hypers(hypers)
+
+        def column(j):
+            with self._phase('kernel.cov'):
+                return self.kernel.cov(self.X, self.X[j:j + 1],
+                                       hypers=h)[:, 0]
+        with self._phase('kernel.cov'):
+            diag = self.kernel.diag(self.X, hypers=h)
+        L, _ = gplinalg.pivoted_cholesky(diag, column, self.precond_rank)
+        return L.T, self._noise(hypers)
+
+    def _solve(self, fact, B, hypers):
+        """ Ky^-1 B by preconditioned conjugate gradients. """
+        def precond(R):
+            return gplinalg.woodbury_solve(fact.V, fact.lam, fact.L_A, R)
+        with self._phase('pcg'):
+            return gplinalg.pcg(lambda V: self._matvec(V, hypers), B,
+                                precond=precond, tol=self.tol,
+                                max_iter=self.max_iter)
+
+    def _factorize(self, hypers, gradient=False, factors=None):
+        """ Solve for alpha and estimate the negative log ML.
+
+        Factorizations are cached as in GPRegressor.
+
+        Parameters:
+            hypers (iterable): the hyperparameters
+            gradient (Boolean): whether the gradient is needed
+            factors: ignored
+
+        Returns:
+            fact (_IterativeFactorization)
+        """
+        key = tuple(np.asarray(hypers, dtype=float))
+        fact = self._cache.get(key)
+        if fact is None or (gradient and fact.grad is None):
+            V, lam = self._precondition(hypers)
+            with self._phase('cholesky'):
+                L_A, _, _, logdet_P = gplinalg.woodbury_factor(
+                    V, lam, np.zeros(self._ell))
+            fact = _IterativeFactorization(V, lam, L_A, None, None, None)
+            # Probes z ~ N(0, P)
+            rng = np.random.RandomState(self.seed)
+            Z = V.T @ rng.standard_normal((len(V), self.n_probes))
+            Z += np.sqrt(np.expand_dims(lam, 1)) * \
+                rng.standard_normal((self._ell, self.n_probes))
+            P_inv_Z = gplinalg.woodbury_solve(V, lam, L_A, Z)
+            B = np.concatenate((np.expand_dims(self.normed_Y, 1), Z), axis=1)
+            X, alphas, betas, n_iter = self._solve(fact, B, hypers)
+            alpha = X[:, [0]]
+            q = gplinalg.lanczos_quadrature(alphas[:, 1:], betas[:, 1:],
+                                            n_iter[1:])
+            logdet = logdet_P + np.mean(np.sum(Z * P_inv_Z, axis=0) * q)
+            first = 0.5 * np.dot(self.normed_Y, alpha[:, 0])
+            third = self._ell / 2. * np.log(2 * np.pi)
+            ML = first + 0.5 * logdet + third
+            grad = None
+            if gradient:
+                grad = self._grad_log_ML(hypers, alpha, X[:, 1:], P_inv_Z)
+            fact = fact._replace(alpha=alpha, ML=float(ML), grad=grad)
+        self.ML = fact.ML
+        return self._remember(key, fact)
+
+    def _grad_log_ML(self, hypers, alpha, K_inv_Z, P_inv_Z):
+        """ Stochastic estimate of the gradient of the negative log ML.
+
+        Uses RW Equation 5.9, with tr(Ky^-1 dK) estimated by the mean
+        of (Ky^-1 z).T dK (P^-1 z) over the probes.
+
+        Returns:
+            grad (np.ndarray)
+        """
+        h = self._kernel_hypers(hypers)
+        a = alpha[:, 0]
+        grad = None
+        for t in self._tiles():
+            dK = self.kernel.grad_iter(self.X[t], self.X, hypers=h)
+            fit = []
+            trace = []
+            for dK_j in self._timed(dK, 'kernel.grad'):
+                fit.append(a[t] @ dK_j @ a)
+                trace.append(np.einsum('bn,nj,bj->', dK_j, P_inv_Z,
+                                       K_inv_Z[t]))
+            tile_grad = 0.5 * np.array(trace) / self.n_probes - \
+                0.5 * np.array(fit)
+            grad = tile_grad if grad is None else grad + tile_grad
+        if self.variances is not None:
+            return grad
+        noise = 0.5 * np.mean(np.sum(K_inv_Z * P_inv_Z, axis=0)) - \
+            0.5 * a @ a
+        return np.concatenate(([noise], grad))
+
+    def _predict_moments(self, X, full):
+        """ Predictive means and the covariance (or variances) for X.
+
+        The mean costs O(n) per input, and the variances one batched
+        CG solve.
+        """
+        h = self._kernel_hypers(self.hypers)
+        post = self._posterior
+        with self._phase('kernel.cov'):
+            k_star = self.kernel.cov(X, self.X, hypers=h)
+            if full:
+                prior = self.kernel.cov(X, X, hypers=h)
+            else:
+                prior = self.kernel.diag(X, hypers=h)
+        E = k_star @ post.alpha
+        E += self._prior_mean(X)
+        E = self.unnormalize(E)
+        W = self._solve(post, k_star.T, self.hypers)[0]
+        if full:
+            var = prior - k_star @ W
+        else:
+            var = prior - np.sum(k_star.T * W, axis=0)
+        return E[:, 0], var * self.std ** 2
+
+
+class KroneckerGPRegressor(IterativeGPRegressor):
+
+    """ Exact regression for full-factorial chimera libraries.
+
+    Inputs are chimera codes, and the kernel must implement codes,
+    factors, and factor_grads (gpkernel.BlockSEKernel). When the
+    training codes are the full-factorial library of N = p^b chimeras
+    with a global measurement variance, the Gram matrix is the
+    Kronecker product of the p x p block factors. The log ML, its
+    gradient, and predictions for the whole library then follow from
+    the eigendecompositions of the factors in O(N p b), instead of
+    the O(N^3) Cholesky decomposition.
+
+    Near-factorial libraries (a subset of the codes, or measurement
+    variances) are fit with the matrix-free solver of
+    IterativeGPRegressor, with products by the Gram matrix computed
+    through the Kronecker structure in O(N p b).
+
+    Attributes:
+        complete (Boolean): whether the last fit was to a full
+            factorial and used exact Kronecker inference
+    """
+
+    def fit(self, X, Y, variances=None, bounds=None):
+        """ Fit the model to the given chimera codes.
+
+        Parameters:
+            X (iterable): n zero-indexed chimera codes
+            Y (np.ndarray): n.
+            variances (np.ndarray): n. Optional.
+        """
+        X = self.kernel.codes(X)
+        shape = (self.kernel.n_parents, ) * self.kernel.n_blocks
+        self._grid_index = np.ravel_multi_index(X.T, shape)
+        self._n_grid = int(np.prod(shape))
+        self.complete = (variances is None and len(X) == self._n_grid and
+                         len(np.unique(self._grid_index)) == self._n_grid)
+        GPRegressor.fit(self, X, Y, variances=variances, bounds=bounds)
+
+    def _fit_kernel(self, X):
+        return self.kernel.fit(X)
+
+    def _embed(self, V):
+        """ Scatter rows for the training codes into the full library. """
+        G = np.zeros((self._n_grid, ) + V.shape[1:])
+        G[self._grid_index] = V
+        return G
+
+    def _matvec(self, V, hypers):
+        """ Ky @ V through the Kronecker product over the library. """
+        with self._phase('kernel.cov'):
+            Ks = self.kernel.factors(self._kernel_hypers(hypers))
+        KV = gplinalg.kron_mvprod(Ks, self._embed(V))[self._grid_index]
+        return KV + np.expand_dims(self._noise(hypers), 1) * V
+
+    def _factorize(self, hypers, gradient=False, factors=None):
+        """ Eigendecompose the block factors of a full factorial.
+
+        Factorizations are cached as in GPRegressor. Near-factorial
+        libraries are solved by IterativeGPRegressor._factorize.
+
+        Parameters:
+            hypers (iterable): the hyperparameters
+            gradient (Boolean): whether the gradient is needed
+            factors: ignored
+
+        Returns:
+            fact (_KroneckerFactorization)
+        """
+        if not self.complete:
+            return IterativeGPRegressor._factorize(self, hypers,
+                                                   gradient=gradient)
+        key = tuple(np.asarray(hypers, dtype=float))
+        fact = self._cache.get(key)
+        if fact is None or (gradient and fact.grad is None):
+            with self._phase('kernel.cov'):
+                Ks = self.kernel.factors(self._kernel_hypers(hypers))
+            with self._phase('eigh'):
+                lams, Qs = zip(*[np.linalg.eigh(K) for K in Ks])
+            s = gplinalg.kron_diag(lams) + hypers[0]
+            y_t = gplinalg.kron_mvprod([Q.T for Q in Qs],
+                                       self._embed(self.normed_Y))
+            alpha = gplinalg.kron_mvprod(Qs, y_t / s)
+            first = 0.5 * np.dot(y_t, y_t / s)
+            second = 0.5 * np.sum(np.log(s))
+            third = self._ell / 2. * np.log(2 * np.pi)
+            grad = None
+            if gradient:
+                grad = self._kron_grad(hypers, Ks, lams, Qs, s, alpha)
+            fact = _KroneckerFactorization(
+                Qs, s, np.expand_dims(alpha[self._grid_index], 1),
+                float(first + second + third), grad)
+        self.ML = fact.ML
+        return self._remember(key, fact)
+
+    def _kron_grad(self, hypers, Ks, lams, Qs, s, alpha):
+        """ Gradient of the negative log ML (RW Equation 5.9).
+
+        Each term of dK is a Kronecker product, so both its trace
+        against Ky^-1 and alpha.T dK alpha are computed blockwise.
+
+        Returns:
+            grad (np.ndarray)
+        """
+        grad = [0.5 * np.sum(1.0 / s) - 0.5 * alpha @ alpha]
+        dKs_iter = iter(self.kernel.factor_grads(self._kernel_hypers(hypers)))
+        for dKs in self._timed(dKs_iter, 'kernel.grad'):
+            g = 0.0
+            for b, dK_b in enumerate(dKs):
+                if dK_b is None:
+                    continue
+                ds = list(lams)
+                ds[b] = np.einsum('ij,ik,kj->j', Qs[b], dK_b, Qs[b])
+                trace = np.sum(gplinalg.kron_diag(ds) / s)
+                terms = list(Ks)
+                terms[b] = dK_b
+                g += 0.5 * trace - \
+                    0.5 * alpha @ gplinalg.kron_mvprod(terms, alpha)
+            grad.append(g)
+        return np.array(grad)
+
+    def _kron_solve(self, fact, B):
+        """ Ky^-1 B for rows of B at the training codes. """
+        s = np.reshape(fact.s, (-1, ) + (1, ) * (B.ndim - 1))
+        G = gplinalg.kron_mvprod([Q.T for Q in fact.Q], self._embed(B))
+        return gplinalg.kron_mvprod(fact.Q, G / s)[self._grid_index]
+
+    def _predict_moments(self, X, full):
+        """ Predictive means and the covariance (or variances) for X. """
+        if not self.complete:
+            return IterativeGPRegressor._predict_moments(self, X, full)
+        X = self.kernel.codes(X)
+        h = self._kernel_hypers(self.hypers)
+        post = self._posterior
+        with self._phase('kernel.cov'):
+            k_star = self.kernel.cov(X, self.X, hypers=h)
+            if full:
+                prior = self.kernel.cov(X, X, hypers=h)
+            else:
+                prior = self.kernel.diag(X, hypers=h)
+        E = k_star @ post.alpha
+        E += self._prior_mean(X)
+        E = self.unnormalize(E)
+        W = self._kron_solve(post, k_star.T)
+        if full:
+            var = prior - k_star @ W
+        else:
+            var = prior - np.sum(k_star.T * W, axis=0)
+        return E[:, 0], var * self.std ** 2
+
+    def predict_library(self):
+        """ Predict every chimera in the full-factorial library.
+
+        For a full-factorial fit, the means and variances for all N
+        chimeras cost O(N p b) through the eigendecompositions.
+
+        Returns:
+            codes (np.ndarray): N x n_blocks, first block slowest
+            means, variances as np.ndarrays with shape (N,)
+        """
+        if self._snapshot is not None:
+            return self._snapshot.predict_library()
+        shape = (self.kernel.n_parents, ) * self.kernel.n_blocks
+        codes = np.array(np.unravel_index(np.arange(self._n_grid),
+                                          shape)).T
+        if not self.complete:
+            E, var = self._predict_moments(codes, False)
+            return codes, E, var
+        post = self._posterior
+        with self._phase('kernel.cov'):
+            Ks = self.kernel.factors(self._kernel_hypers(self.hypers))
+        E = gplinalg.kron_mvprod(Ks, self._embed(post.alpha[:, 0]))
+        E += self._prior_mean(codes)[:, 0]
+        noise = self.hypers[0]
+        var = gplinalg.kron_mvprod([Q ** 2 for Q in post.Q],
+                                   (post.s - noise) * noise / post.s)
+        return codes, self.unnormalize(E), var * self.std ** 2
+
+
+class OutOfCoreGPRegressor(BaseApproximateRegressor):
+
+    """ Exact regression with the Gram matrix and its factor on disk.
+
+    Ky is computed tile_size x tile_size tiles at a time into an
+    np.memmap, and factorized in place by a right-looking blocked
+    Cholesky decomposition that only holds a few tiles in memory.
+    Solves with the factor stream it from disk one strip of rows at a
+    time. The log ML, its gradient, and the predictions are exact.
+    The gradient accumulates tr(Ky^-1 dK) over blocks of columns of
+    the lower triangle of Ky^-1. Forming them costs about 2n^3/3
+    flops against n^3/3 for the factorization, so a gradient costs
+    about three times the factorization alone.
+
+    Memory is O(n * tile_size), and the kernel must implement
+    cov(X1, X2), diag, and grad(X1, X2), as for IterativeGPRegressor.
+    The factor on disk is always float64.
+
+    Attributes:
+        tile_size (int): rows and columns per tile. Default is 2048.
+        directory (str): where the memory-mapped files are created.
+            Default is the system temporary directory. Each file is
+            deleted once its factorization is discarded.
+    """
+
+    def __init__(self, kernel, tile_size=2048, directory=None, **kwargs):
+        self.tile_size = tile_size
+        self.directory = directory
+        kwargs.setdefault('cache_size', 1)
+        GPRegressor.__init__(self, kernel, **kwargs)
+
+    def _fit_kernel(self, X):
+        """ Count the kernel hyperparameters.
+
+        The kernel is fit on a single input, so nothing of size n
+        is saved. All covariances are computed from the inputs.
+        """
+        return self.kernel.fit(X[:1])
+
+    def _tiles(self):
+        """ Row slices of the training inputs. """
+        for i in range(0, self._ell, self.tile_size):
+            yield slice(i, i + self.tile_size)
+
+    def _gram(self, hypers):
+        """ The lower triangle of Ky in a new memory-mapped file.
+
+        The tiles in each row are computed by the active gpparallel
+        executor, so only one row of tiles is held in memory.
+        """
+        n = self._ell
+        Ky = np.memmap(tempfile.TemporaryFile(dir=self.directory),
+                       dtype=np.float64, mode='w+', shape=(n, n))
+        noise = self._noise(hypers)
+        h = self._kernel_hypers(hypers)
+        if self.dtype != np.float64:
+            h = np.asarray(h, dtype=self.dtype)
+        executor = gpparallel.current_executor()
+        for ii in self._tiles():
+            row = [jj for jj in self._tiles() if jj.start <= ii.start]
+            with self._phase('kernel.cov'):
+                tiles = executor.map(_cov_tile,
+                                     itertools.repeat(self.kernel),
+                                     itertools.repeat(self.X[ii]),
+                                     [self.X[jj] for jj in row],
+                                     itertools.repeat(h),
+                                     itertools.repeat(self.dtype))
+            for jj, tile in zip(row, tiles):
+                if jj == ii:
+                    tile = tile + np.diag(noise[ii])
+                Ky[ii, jj] = tile
+        return Ky
+
+    def _solve(self, L, B):
+        """ Ky^-1 B from the factor on disk. """
+        with self._phase('solve_triangular'):
+            X = gplinalg.tiled_solve_triangular(L, B, self.tile_size)
+            return gplinalg.tiled_solve_triangular(L, X, self.tile_size,
+                                                   trans=True)
+
+    def _factorize(self, hypers, gradient=False, factors=None):
+        """ Factorize Ky on disk and compute the negative log ML.
+
+        Factorizations are cached as in GPRegressor. The default
+        cache_size is 1, since each holds an n x n file.
+
+        Parameters:
+            hypers (iterable): the hyperparameters
+            gradient (Boolean): whether the gradient is needed
+            factors: ignored
+
+        Returns:
+            fact (_Factorization), with K None and L an np.memmap
+        """
+        key = tuple(np.asarray(hypers, dtype=float))
+        fact = self._cache.get(key)
+        if fact is None:
+            Ky = self._gram(hypers)
+            with self._phase('cholesky'):
+                L = gplinalg.tiled_cholesky(Ky, self.tile_size)
+            alpha = self._solve(L, self.normed_Y)
+            first = 0.5 * np.dot(self.normed_Y, alpha)
+            second = np.sum(np.log(np.diag(L)))
+            third = self._ell / 2. * np.log(2 * np.pi)
+            fact = _Factorization(None, L, np.expand_dims(alpha, 1),
+                                  float(first + second + third), None)
+        if gradient and fact.grad is None:
+            fact = fact._replace(grad=self._grad_log_ML(hypers, fact))
+        self.ML = fact.ML
+        return self._remember(key, fact)
+
+    def _grad_log_ML(self, hypers, fact):
+        """ Gradient of the negative log ML (RW Equation 5.9).
+
+        W = Ky^-1 - alpha alpha.T is formed one block of tile_size
+        columns at a time, from the diagonal down, and contracted with
+        the matching block of dK. Since W and dK are symmetric, the
+        blocks below the diagonal are counted twice.
+
+        Returns:
+            grad (np.ndarray)
+        """
+        h = self._kernel_hypers(hypers)
+        a = fact.alpha[:, 0]
+        grad = 0.0
+        noise = 0.0
+        for jj in self._tiles():
+            # Rows of Ky^-1 from the diagonal down only need the
+            # trailing block of L
+            i = jj.start
+            b = len(a[jj])
+            E = np.zeros((self._ell - i, b))
+            E[:b] = np.identity(b)
+            W = self._solve(fact.L[i:, i:], E) - np.outer(a[i:], a[jj])
+            dK = self.kernel.grad_iter(self.X[i:], self.X[jj], hypers=h)
+            grad = grad + 0.5 * np.array(
+                [2 * np.einsum('ij,ij->', W, dK_j) -
+                 np.einsum('ij,ij->', W[:b], dK_j[:b])
+                 for dK_j in self._timed(dK, 'kernel.grad')])
+            noise += 0.5 * np.trace(W[:b])
+        if self.variances is not None:
+            return grad
+        return np.concatenate(([noise], grad))
+
+    def _predict_moments(self, X, full):
+        """ Predictive means and the covariance (or variances) for X.
+
+        Uses RW Equations 2.23 and 2.24, streaming the factor from
+        disk for the triangular solve.
+        """
+        h = self._kernel_hypers(self.hypers)
+        post = self._posterior
+        k_star = self._cov(X, self.X, self.hypers)
+        E = k_star @ post.alpha
+        with self._phase('solve_triangular'):
+            v = gplinalg.tiled_solve_triangular(post.L, k_star.T,
+                                                self.tile_size)
+        if full:
+            var = self._cov(X, X, self.hypers) - v.T @ v
+        else:
+            with self._phase('kernel.cov'):
+                diag = self.kernel.diag(X, hypers=h)
+            var = diag - np.einsum('ij,ij->j', v, v)
+        E += self._prior_mean(X)
+        E = self.unnormalize(E)
+        return E[:, 0], np.asarray(var, dtype=float) * self.std ** 2
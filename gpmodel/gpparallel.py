@@ -0,0 +1,552 @@
+''' Executors for the independent tasks in fitting and predicting.
+
+Gram matrix tiles, the kernels of a MultipleKernel, the per-class
+factorizations of GPMultiClassifier, multiple starts and the folds
+of gptools.cv are all dispatched to the active executor:
+
+    with gpparallel.ProcessExecutor(4):
+        model.fit(X, Y)
+
+Without one, they run serially. The backends are SerialExecutor,
+ThreadExecutor, ProcessExecutor, and SocketExecutor, which sends
+tasks to workers started on other hosts with
+
+    python -m gpmodel.gpparallel --host 0.0.0.0 --port 5000
+
+Tasks are module-level functions that the workers can import, and
+they must not modify their array arguments. Arrays of at least
+min_shared_bytes in a task's arguments are not pickled with it.
+ProcessExecutor writes each one once per map to a memory-mapped file
+in shared memory, which the workers open read-only. SocketExecutor
+sends each one once per map to each worker.
+
+Thread and process pools are sized from the active
+gpthreads.ThreadBudget, and each worker's BLAS and numba threads are
+capped at its share. Tasks run serially inside a worker, so code
+they dispatch does not wait on the pool it is running in.
+
+Socket workers unpickle whatever they are sent, so they must only
+listen on trusted networks.
+'''
+
+import abc
+import argparse
+import concurrent.futures
+import io
+import os
+import pickle
+import queue
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+
+import numpy as np
+
+from gpmodel import gpthreads
+
+# The innermost executor that has been entered
+_active = None
+
+# Whether this thread is running a task, and the arrays sent to a
+# socket worker
+_local = threading.local()
+
+# Length prefix of the messages between SocketExecutor and workers
+_HEADER = struct.Struct('!Q')
+
+
+def current_executor():
+    """ The active executor, or SERIAL inside a task or outside any. """
+    if _active is None or getattr(_local, 'in_worker', False):
+        return SERIAL
+    return _active
+
+
+def _run_task(fn, args):
+    """ Call fn in a worker thread, dispatching nested work serially. """
+    _local.in_worker = True
+    try:
+        return fn(*args)
+    finally:
+        _local.in_worker = False
+
+
+class BaseExecutor(abc.ABC):
+
+    """ Base class for executors.
+
+    An executor is the active one inside a with block, and is closed
+    at its end. Pools and connections are opened by the first map,
+    so an executor can be entered again after it is closed.
+
+    Attributes:
+        n_workers (int)
+    """
+
+    n_workers = 1
+
+    def __init__(self):
+        self._previous = []
+
+    @abc.abstractmethod
+    def map(self, fn, *iterables):
+        """ Call fn on each set of arguments.
+
+        Returns:
+            results (list): in the order of the arguments
+        """
+        return
+
+    def close(self):
+        """ Stop the workers. """
+        return
+
+    def __enter__(self):
+        global _active
+        self._previous.append(_active)
+        _active = self
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = self._previous.pop()
+        self.close()
+
+
+class SerialExecutor(BaseExecutor):
+
+    """ Runs each task in the calling thread. """
+
+    def map(self, fn, *iterables):
+        return [fn(*args) for args in zip(*iterables)]
+
+
+class ThreadExecutor(BaseExecutor):
+
+    """ Runs tasks in a pool of threads.
+
+    Suits tasks that spend their time in NumPy, BLAS or numba, which
+    release the GIL. BLAS limits apply to the whole process, so each
+    map caps BLAS at the workers' share of the budget while it runs.
+
+    Attributes:
+        n_workers (int): default is the thread budget
+    """
+
+    def __init__(self, n_workers=None):
+        BaseExecutor.__init__(self)
+        budget = gpthreads.current_budget()
+        if n_workers is None:
+            n_workers = budget.n_threads
+        self.n_workers, self._per_worker = budget.split(n_workers)
+        self._pool = None
+
+    def map(self, fn, *iterables):
+        tasks = list(zip(*iterables))
+        if len(tasks) < 2 or self.n_workers == 1:
+            return [fn(*args) for args in tasks]
+        if self._pool is None:
+            self._pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.n_workers)
+        with gpthreads.limit(self._per_worker):
+            futures = [self._pool.submit(_run_task, fn, args)
+                       for args in tasks]
+            return _results(futures)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def _results(futures):
+    """ The results of futures, in order.
+
+    If a task raises, the tasks that have not started are cancelled
+    and the running ones finish before the error is raised, so that
+    no task outlives the map.
+    """
+    try:
+        return [f.result() for f in futures]
+    except BaseException:
+        for f in futures:
+            f.cancel()
+        concurrent.futures.wait(futures)
+        raise
+
+
+def _open_shared(path):
+    """ Open an array written by _SharedArrays. """
+    return np.load(path, mmap_mode='r')
+
+
+def _init_process(n_threads):
+    """ Cap a worker process's threads and mark it as a worker. """
+    global _active
+    _active = None
+    _local.in_worker = True
+    gpthreads.limit(n_threads)
+
+
+def _run_payload(payload):
+    """ Unpickle and call a task in a worker process. """
+    fn, args = pickle.loads(payload)
+    return fn(*args)
+
+
+class _SharingPickler(pickle.Pickler):
+
+    """ Pickles large arrays as references returned by share. """
+
+    def __init__(self, file, share, min_bytes):
+        pickle.Pickler.__init__(self, file,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+        self._share = share
+        self._min_bytes = max(min_bytes, 1)
+
+    def reducer_override(self, obj):
+        if (isinstance(obj, np.ndarray) and not obj.dtype.hasobject
+                and obj.nbytes >= self._min_bytes):
+            return self._share(obj)
+        return NotImplemented
+
+
+def _dumps(obj, share, min_bytes):
+    """ Pickle obj, passing its large arrays to share. """
+    f = io.BytesIO()
+    _SharingPickler(f, share, min_bytes).dump(obj)
+    return f.getvalue()
+
+
+def _shm_directory():
+    """ A directory in memory for the shared files, if there is one. """
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return None
+
+
+class _SharedArrays(object):
+
+    """ Memory-mapped copies of the large arrays in a map's tasks.
+
+    Each array object is written once, however many tasks it is in.
+    The files are deleted at the end of the with block; workers that
+    still have them open keep their mappings.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._paths = {}
+        # Keep the arrays alive so that their ids are not reused
+        self._arrays = []
+
+    def share(self, A):
+        path = self._paths.get(id(A))
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix='.npy', dir=self.directory)
+            os.close(fd)
+            fortran = A.flags.f_contiguous and not A.flags.c_contiguous
+            M = np.lib.format.open_memmap(path, mode='w+', dtype=A.dtype,
+                                          shape=A.shape,
+                                          fortran_order=fortran)
+            M[...] = A
+            M.flush()
+            del M
+            self._paths[id(A)] = path
+            self._arrays.append(A)
+        return _open_shared, (path, )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for path in self._paths.values():
+            os.remove(path)
+        self._paths = {}
+        self._arrays = []
+
+
+class ProcessExecutor(BaseExecutor):
+
+    """ Runs tasks in a pool of processes.
+
+    Attributes:
+        n_workers (int): default is the thread budget
+        min_shared_bytes (int): arrays at least this large are
+            passed through shared memory. Default is 1 MiB.
+        directory (str): where the shared files are created. Default
+            is /dev/shm, or the system temporary directory.
+    """
+
+    def __init__(self, n_workers=None, min_shared_bytes=2 ** 20,
+                 directory=None):
+        BaseExecutor.__init__(self)
+        budget = gpthreads.current_budget()
+        if n_workers is None:
+            n_workers = budget.n_threads
+        self.n_workers, self._per_worker = budget.split(n_workers)
+        self.min_shared_bytes = min_shared_bytes
+        self.directory = directory
+        self._pool = None
+
+    def map(self, fn, *iterables):
+        tasks = list(zip(*iterables))
+        if len(tasks) < 2:
+            return [fn(*args) for args in tasks]
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.n_workers, initializer=_init_process,
+                initargs=(self._per_worker, ))
+        directory = self.directory
+        if directory is None:
+            directory = _shm_directory()
+        with _SharedArrays(directory) as shared:
+            payloads = [_dumps((fn, args), shared.share,
+                               self.min_shared_bytes) for args in tasks]
+            futures = [self._pool.submit(_run_payload, payload)
+                       for payload in payloads]
+            # The shared files are deleted on leaving the with block
+            return _results(futures)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def _send(sock, obj):
+    """ Send a length-prefixed pickle. """
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_HEADER.pack(len(data)))
+    sock.sendall(data)
+
+
+def _recv_exactly(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    while n:
+        received = sock.recv_into(view, n)
+        if received == 0:
+            raise EOFError('Connection closed.')
+        view = view[received:]
+        n -= received
+    return buf
+
+
+def _recv(sock):
+    """ Receive a length-prefixed pickle. """
+    n, = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return pickle.loads(_recv_exactly(sock, n))
+
+
+def _remote_array(key):
+    """ An array sent to this socket worker earlier in the map. """
+    return _local.arrays[key]
+
+
+class _RemoteArrays(object):
+
+    """ Numbers the large arrays in a map's tasks for SocketExecutor. """
+
+    def __init__(self):
+        self.arrays = {}
+        self._keys = {}
+        self.used = set()
+
+    def share(self, A):
+        key = self._keys.get(id(A))
+        if key is None:
+            key = len(self.arrays)
+            self._keys[id(A)] = key
+            self.arrays[key] = A
+        self.used.add(key)
+        return _remote_array, (key, )
+
+    def dumps(self, obj, min_bytes):
+        """ Pickle obj, and the keys of the arrays it references. """
+        self.used = set()
+        payload = _dumps(obj, self.share, min_bytes)
+        return payload, self.used
+
+
+def _parse_address(address):
+    if isinstance(address, str):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return tuple(address)
+
+
+class SocketExecutor(BaseExecutor):
+
+    """ Runs tasks on workers listening on other hosts.
+
+    Each worker takes the next task as soon as it returns the last
+    one. A worker can be listed more than once to run several tasks
+    at a time.
+
+    Attributes:
+        addresses (list): (host, port) pairs or 'host:port' strings
+        min_shared_bytes (int): arrays at least this large are sent
+            to each worker once per map. Default is 1 MiB.
+        timeout (float): seconds to wait when connecting. Default is
+            None (no timeout).
+    """
+
+    def __init__(self, addresses, min_shared_bytes=2 ** 20, timeout=None):
+        BaseExecutor.__init__(self)
+        if len(addresses) == 0:
+            raise ValueError('SocketExecutor needs at least one worker.')
+        self.addresses = [_parse_address(a) for a in addresses]
+        self.n_workers = len(self.addresses)
+        self.min_shared_bytes = min_shared_bytes
+        self.timeout = timeout
+        self._sockets = None
+
+    def _connect(self):
+        self._sockets = []
+        try:
+            for address in self.addresses:
+                sock = socket.create_connection(address,
+                                                timeout=self.timeout)
+                sock.settimeout(None)
+                self._sockets.append(sock)
+        except OSError:
+            self.close()
+            raise
+
+    def map(self, fn, *iterables):
+        tasks = list(zip(*iterables))
+        if len(tasks) < 2:
+            return [fn(*args) for args in tasks]
+        if self._sockets is None:
+            self._connect()
+        remote = _RemoteArrays()
+        payloads = [remote.dumps((fn, args), self.min_shared_bytes)
+                    for args in tasks]
+        todo = queue.SimpleQueue()
+        for i in range(len(tasks)):
+            todo.put(i)
+        results = [None] * len(tasks)
+        errors = []
+        broken = []
+
+        def drive(sock):
+            sent = set()
+            try:
+                while not errors:
+                    try:
+                        i = todo.get_nowait()
+                    except queue.Empty:
+                        break
+                    payload, keys = payloads[i]
+                    for key in keys - sent:
+                        _send(sock, ('array', key, remote.arrays[key]))
+                        sent.add(key)
+                    _send(sock, ('call', payload))
+                    ok, value = _recv(sock)
+                    if ok:
+                        results[i] = value
+                    else:
+                        errors.append(value)
+                if sent:
+                    _send(sock, ('clear', ))
+            except (OSError, EOFError) as e:
+                broken.append(e)
+                errors.append(e)
+
+        threads = [threading.Thread(target=drive, args=(sock, ))
+                   for sock in self._sockets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if broken:
+            # The other connections may be part way through a message
+            self.close()
+        if errors:
+            raise errors[0]
+        return results
+
+    def close(self):
+        if self._sockets is not None:
+            for sock in self._sockets:
+                sock.close()
+            self._sockets = None
+
+
+class _WorkerHandler(socketserver.BaseRequestHandler):
+
+    """ Runs the tasks sent on one connection, one at a time. """
+
+    def handle(self):
+        _local.in_worker = True
+        _local.arrays = {}
+        while True:
+            try:
+                message = _recv(self.request)
+            except (OSError, EOFError):
+                return
+            if message[0] == 'array':
+                _, key, A = message
+                A.flags.writeable = False
+                _local.arrays[key] = A
+            elif message[0] == 'clear':
+                _local.arrays = {}
+            else:
+                try:
+                    fn, args = pickle.loads(message[1])
+                    reply = (True, fn(*args))
+                except Exception as e:
+                    reply = (False, e)
+                try:
+                    _send(self.request, reply)
+                except (pickle.PicklingError, TypeError,
+                        AttributeError) as e:
+                    _send(self.request, (False, RuntimeError(repr(e))))
+
+
+class _WorkerServer(socketserver.ThreadingTCPServer):
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def start_worker(host='127.0.0.1', port=0):
+    """ Listen for tasks from SocketExecutors.
+
+    Each connection is served by its own thread. Call serve_forever
+    on the returned server to start serving.
+
+    Parameters:
+        host (str)
+        port (int): 0 picks a free port
+
+    Returns:
+        server (socketserver.ThreadingTCPServer): its server_address
+            is the (host, port) to give SocketExecutor
+    """
+    return _WorkerServer((host, port), _WorkerHandler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run tasks sent by gpparallel.SocketExecutor.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=None,
+                        help='cap on BLAS and numba threads')
+    args = parser.parse_args(argv)
+    if args.threads is not None:
+        gpthreads.limit(args.threads)
+    server = start_worker(args.host, args.port)
+    with server:
+        server.serve_forever()
+
+
+SERIAL = SerialExecutor()
+
+
+if __name__ == '__main__':
+    main()
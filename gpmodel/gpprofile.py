@@ -0,0 +1,226 @@
+''' Opt-in timing and memory instrumentation for GP models.
+
+Attach a Profiler to a model to record each phase of fit and predict
+(kernel evaluations, Cholesky decompositions, triangular solves, the
+optimizer, and the Laplace Newton loop):
+
+    profiler = gpprofile.Profiler()
+    model = gpmodel.GPRegressor(kernel, profiler=profiler)
+    model.fit(X, Y)
+    print(profiler.summary())
+    profiler.to_chrome_trace('fit.json')
+
+Kernel phases are timed where the models call the kernel, so every
+kernel is covered. Multi-start workers in other processes are not
+profiled.
+'''
+
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+class Profiler(object):
+
+    """ Records timed phases and counters.
+
+    Phases nest, and the times of a phase include those of the phases
+    inside it. Each finished phase is recorded as an event dict with
+    keys name, start (wall seconds since the profiler was created),
+    wall, cpu (process CPU seconds, which includes BLAS threads),
+    thread, and depth, plus peak_memory (bytes allocated above the
+    start of the phase) if memory is tracked.
+
+    Attributes:
+        events (list): the finished phases, in the order they ended
+        counts (dict): counter name to count
+        track_memory (Boolean): whether to track peak memory with
+            tracemalloc. Tracing slows allocation. Default is False.
+            If tracemalloc is not already tracing, the profiler starts
+            it when a phase begins and stops it once no phases are
+            open in any thread.
+    """
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.events = []
+        self.counts = {}
+        self._hooks = []
+        self._origin = time.perf_counter()
+        self._setup()
+
+    def _setup(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._open = 0
+        self._tracing = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ['_lock', '_local', '_hooks', '_open', '_tracing']:
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._hooks = []
+        self._setup()
+
+    def add_hook(self, hook):
+        """ Call hook(event) whenever a phase finishes. """
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def reset(self):
+        """ Forget all events and counts. """
+        with self._lock:
+            self.events = []
+            self.counts = {}
+        self._origin = time.perf_counter()
+
+    def count(self, name, n=1):
+        """ Add n to the counter name. """
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Context manager that times the enclosed code as name. """
+        stack = self._stack()
+        frame = {'peak': 0, 'base': 0}
+        if self.track_memory:
+            with self._lock:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self._tracing = True
+                self._open += 1
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            frame['base'] = frame['peak'] = current
+        stack.append(frame)
+        start = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+            stack.pop()
+            event = {'name': name, 'start': start - self._origin,
+                     'wall': wall, 'cpu': cpu,
+                     'thread': threading.get_ident(), 'depth': len(stack)}
+            if self.track_memory:
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                event['peak_memory'] = peak - frame['base']
+                if stack:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+                self._stop_tracing()
+            with self._lock:
+                self.events.append(event)
+            for hook in list(self._hooks):
+                hook(event)
+
+    def _stop_tracing(self):
+        """ Close a phase, stopping tracemalloc after the last one.
+
+        Tracing is only stopped if the profiler started it.
+        """
+        with self._lock:
+            self._open -= 1
+            if self._open == 0 and self._tracing:
+                tracemalloc.stop()
+                self._tracing = False
+
+    def _stack(self):
+        """ The open phases of the current thread. """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def summary(self):
+        """ Totals for each phase.
+
+        Returns:
+            dict: phase name to a dict with calls, wall, and cpu, and
+                the largest peak_memory if memory is tracked
+        """
+        totals = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            total = totals.setdefault(event['name'],
+                                      {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+            total['calls'] += 1
+            total['wall'] += event['wall']
+            total['cpu'] += event['cpu']
+            if 'peak_memory' in event:
+                total['peak_memory'] = max(total.get('peak_memory', 0),
+                                           event['peak_memory'])
+        return totals
+
+    def to_dict(self):
+        """ The summary, counts, and events as a dict. """
+        with self._lock:
+            events = list(self.events)
+            counts = dict(self.counts)
+        return {'phases': self.summary(), 'counts': counts,
+                'events': events}
+
+    def to_json(self, f=None):
+        """ Export to_dict as JSON.
+
+        Parameters:
+            f (string): optional path to write to
+
+        Returns:
+            the JSON string
+        """
+        dumped = json.dumps(self.to_dict(), indent=2)
+        if f is not None:
+            with open(f, 'w') as out:
+                out.write(dumped)
+        return dumped
+
+    def to_chrome_trace(self, f=None):
+        """ Export the events in the Chrome trace event format.
+
+        The file can be opened in chrome://tracing or Perfetto.
+
+        Parameters:
+            f (string): optional path to write to
+
+        Returns:
+            trace (dict)
+        """
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+            counts = dict(self.counts)
+        trace_events = []
+        for event in events:
+            args = {'cpu_ms': event['cpu'] * 1e3}
+            if 'peak_memory' in event:
+                args['peak_memory'] = event['peak_memory']
+            trace_events.append({'name': event['name'], 'ph': 'X',
+                                 'ts': event['start'] * 1e6,
+                                 'dur': event['wall'] * 1e6,
+                                 'pid': pid, 'tid': event['thread'],
+                                 'args': args})
+        if counts:
+            end = max([e['start'] + e['wall'] for e in events] + [0.0])
+            trace_events.append({'name': 'counts', 'ph': 'C',
+                                 'ts': end * 1e6, 'pid': pid,
+                                 'args': counts})
+        trace = {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+        if f is not None:
+            with open(f, 'w') as out:
+                json.dump(trace, out)
+        return trace
@@ -0,0 +1,542 @@
+''' Serve fitted models with micro-batched predictions.
+
+Many small concurrent predict requests each pay for a kernel
+evaluation against the training inputs and a triangular solve. A
+MicroBatcher coalesces the requests that arrive within a short
+latency window into one predict call and hands each caller its rows:
+
+    batcher = gpserve.MicroBatcher(model)
+    mean, variance = await batcher.apredict([x])
+
+serve runs a local server for several models over TCP or a Unix
+socket. Each request is one line of JSON,
+
+    {"id": 1, "model": "name", "X": [x1, x2, ...]}
+
+and each response is one line of JSON with the same id and, for each
+input, the predictions (mean and variance for regression, p, f_bar
+and variance for classification) or an error. Requests on the same
+connection may be answered out of order. To serve models from the
+command line:
+
+    python -m gpmodel.gpserve --model name model_dir --socket gp.sock
+
+Directories are loaded with load_compact and files with load.
+
+A ManagedModel keeps serving a regression model while new
+measurements arrive, refitting it in the background on all of the
+data and swapping in the new fit once it is complete.
+'''
+
+import argparse
+import asyncio
+import concurrent.futures
+import copy
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from gpmodel import gpmodel
+
+
+class MicroBatcher(object):
+
+    """ Coalesces concurrent predictions for one model.
+
+    Requests are queued until window seconds have passed since the
+    first one or max_batch inputs are waiting, and are then predicted
+    together. Batches are predicted one at a time in a worker thread,
+    so the event loop is not blocked and the model is never used by
+    two threads at once.
+
+    Attributes:
+        model (BaseGPModel): a fitted GPRegressor or GPClassifier
+        window (float): seconds to wait for more requests. Default
+            is 0.005.
+        max_batch (int): number of inputs that are predicted as soon
+            as they are waiting. Default is 256.
+        fields (list): names of the arrays returned by predict
+    """
+
+    def __init__(self, model, window=0.005, max_batch=256):
+        self.model = model
+        self.window = window
+        self.max_batch = max_batch
+        if isinstance(model, gpmodel.GPClassifier):
+            self.fields = ['p', 'f_bar', 'variance']
+        else:
+            self.fields = ['mean', 'variance']
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+        self._n_pending = 0
+        self._timer = None
+        self._running = set()
+
+    async def apredict(self, X):
+        """ Predict X together with any concurrent requests.
+
+        Parameters:
+            X: m inputs, as for the model's predict. Models fit on a
+                list of sequences take a list.
+
+        Returns:
+            the arrays from predict(X, return_cov=False) for X
+
+        Raises:
+            ValueError: if X's inputs are not shaped like the model's
+                training inputs. Other requests are not affected.
+        """
+        loop = asyncio.get_running_loop()
+        X_train = getattr(self.model, 'X', None)
+        if X_train is not None and not hasattr(X_train, 'shape'):
+            # String kernels take the sequences as they are
+            X = list(X)
+        else:
+            X = np.asarray(X)
+            if X_train is not None and X.shape[1:] != X_train.shape[1:]:
+                raise ValueError('Inputs have shape %s, but the model was '
+                                 'fit on inputs of shape %s.'
+                                 % (X.shape[1:], X_train.shape[1:]))
+        future = loop.create_future()
+        self._pending.append((X, future))
+        self._n_pending += len(X)
+        if self._n_pending >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def close(self):
+        """ Shut down the worker thread once running batches finish. """
+        self._executor.shutdown(wait=True)
+
+    def _flush(self):
+        """ Start predicting every waiting request. """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = self._pending
+        self._pending = []
+        self._n_pending = 0
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        """ Predict a batch and resolve each request's future.
+
+        If the batch fails, every request in it gets the exception.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            if isinstance(batch[0][0], list):
+                X = [x for X, _ in batch for x in X]
+            else:
+                X = np.concatenate([X for X, _ in batch])
+            results = await loop.run_in_executor(self._executor,
+                                                 self._predict, X)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        start = 0
+        for X, future in batch:
+            stop = start + len(X)
+            if not future.done():
+                future.set_result(tuple(r[start:stop] for r in results))
+            start = stop
+
+    def _predict(self, X):
+        """ The marginal predictions for X as a tuple of arrays. """
+        return tuple(np.asarray(r) for r in
+                     self.model.predict(X, return_cov=False))
+
+
+def _fit_model(model, X, Y, variances):
+    """ Fit model in a worker and return it. """
+    if variances is None:
+        model.fit(X, Y)
+    else:
+        model.fit(X, Y, variances=variances)
+    return model
+
+
+class ManagedModel(object):
+
+    """ A regression model that is refit in the background.
+
+    Observations are collected as they arrive. A refit on all of
+    them starts once refit_every observations or refit_interval
+    seconds have passed since the last one started, and runs in the
+    executor on a fresh copy of the model, starting from the current
+    hyperparameters. Until it finishes, predict uses the last
+    completed fit; the new fit replaces it in a single assignment.
+    Refits are started by add_observations, predict, and refit, so
+    refit_interval is only checked when one of them is called.
+
+    Attributes:
+        model (GPRegressor): the fitted model that predict uses
+        refit_every (int): observations that trigger a refit.
+            Default is None (never).
+        refit_interval (float): seconds after which new observations
+            trigger a refit. Default is None (never).
+        warm_start (Boolean): whether refits start from the current
+            hyperparameters. Default is True.
+        error (Exception): the error from the last failed refit, or
+            None
+    """
+
+    def __init__(self, model, X, Y, variances=None, refit_every=None,
+                 refit_interval=None, warm_start=True, executor=None):
+        """ Manage a regression model.
+
+        Parameters:
+            model (GPRegressor): fit on X and Y here if it is not
+                already
+            X (np.ndarray): n x d
+            Y (np.ndarray): n.
+            variances (np.ndarray): n. Optional.
+            refit_every (int)
+            refit_interval (float)
+            warm_start (Boolean)
+            executor (concurrent.futures.Executor): runs the refits.
+                Default is a single worker thread. With a process
+                pool, the model is pickled to and from the worker.
+        """
+        if not hasattr(model, 'hypers'):
+            model = _fit_model(model, X, Y, variances)
+        self.model = model
+        self.refit_every = refit_every
+        self.refit_interval = refit_interval
+        self.warm_start = warm_start
+        self.error = None
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._executor = executor
+        # Reentrant, since a refit that is already done finishes in _start
+        self._lock = threading.RLock()
+        self._X = [np.asarray(X)]
+        self._Y = [np.asarray(Y)]
+        self._variances = None if variances is None else [variances]
+        # Arrival time of each batch of observations after the first
+        self._arrivals = []
+        self._n_observations = len(Y)
+        self._n_fitted = len(Y)
+        self._n_started = len(Y)
+        now = time.monotonic()
+        self._fitted_at = now
+        self._started_at = now
+        self._future = None
+        self._idle = threading.Event()
+        self._idle.set()
+        self._n_refits = 0
+        self._n_failed = 0
+        self._last_duration = None
+
+    def predict(self, X, **kwargs):
+        """ Predict with the last completed fit. """
+        self._check_triggers()
+        return self.model.predict(X, **kwargs)
+
+    def predict_iter(self, X_source, chunk_size=1000):
+        """ Stream predictions from the last completed fit. """
+        self._check_triggers()
+        return self.model.predict_iter(X_source, chunk_size=chunk_size)
+
+    def add_observations(self, X_new, Y_new, variances=None):
+        """ Record new observations, starting a refit if one is due.
+
+        Parameters:
+            X_new (np.ndarray): k x d
+            Y_new (np.ndarray): k.
+            variances (np.ndarray): k. Required if and only if the
+                model was fit with variances.
+        """
+        if (variances is None) != (self._variances is None):
+            raise ValueError('variances must be given if and only if '
+                             'the model was fit with variances')
+        with self._lock:
+            self._X.append(np.asarray(X_new))
+            self._Y.append(np.asarray(Y_new))
+            if variances is not None:
+                self._variances.append(variances)
+            self._arrivals.append((self._n_observations, time.monotonic()))
+            self._n_observations += len(Y_new)
+        self._check_triggers()
+
+    def refit(self, wait=False):
+        """ Start a refit on every observation so far.
+
+        Parameters:
+            wait (Boolean): whether to block until it finishes
+
+        Returns:
+            future (concurrent.futures.Future): the running refit
+        """
+        with self._lock:
+            future = self._start()
+        if wait:
+            self.wait()
+        return future
+
+    def wait(self, timeout=None):
+        """ Block until no refit is running.
+
+        Returns:
+            idle (Boolean): False if the timeout expired first
+        """
+        return self._idle.wait(timeout)
+
+    def close(self):
+        """ Wait for the running refit and shut down the executor. """
+        self._executor.shutdown(wait=True)
+
+    def metrics(self):
+        """ How stale the served model is.
+
+        Returns:
+            metrics (dict): with keys
+                n_observations: observations received
+                n_fitted: observations in the served model
+                n_pending: observations not yet in the served model
+                staleness: seconds since the oldest pending
+                    observation arrived, or 0
+                posterior_age: seconds since the served fit finished
+                refitting: whether a refit is running
+                n_refits: completed refits
+                n_failed: failed refits
+                last_refit_seconds: duration of the last completed
+                    refit, or None
+        """
+        now = time.monotonic()
+        with self._lock:
+            pending = [t for start, t in self._arrivals
+                       if start >= self._n_fitted]
+            return {'n_observations': self._n_observations,
+                    'n_fitted': self._n_fitted,
+                    'n_pending': self._n_observations - self._n_fitted,
+                    'staleness': now - pending[0] if pending else 0.0,
+                    'posterior_age': now - self._fitted_at,
+                    'refitting': self._future is not None,
+                    'n_refits': self._n_refits,
+                    'n_failed': self._n_failed,
+                    'last_refit_seconds': self._last_duration}
+
+    def _check_triggers(self):
+        """ Start a refit if one is due and none is running. """
+        with self._lock:
+            if self._future is not None:
+                return
+            n_new = self._n_observations - self._n_started
+            if n_new == 0:
+                return
+            due = self.refit_every is not None and n_new >= self.refit_every
+            if self.refit_interval is not None:
+                elapsed = time.monotonic() - self._started_at
+                due = due or elapsed >= self.refit_interval
+            if due:
+                self._start()
+
+    def _start(self):
+        """ Submit a refit. Call with the lock held. """
+        if self._future is not None:
+            return self._future
+        X = np.concatenate(self._X)
+        Y = np.concatenate(self._Y)
+        self._X, self._Y = [X], [Y]
+        variances = None
+        if self._variances is not None:
+            variances = np.concatenate(self._variances)
+            self._variances = [variances]
+        self._n_started = len(Y)
+        self._started_at = time.monotonic()
+        self._idle.clear()
+        future = self._executor.submit(_fit_model, self._fresh_model(),
+                                       X, Y, variances)
+        self._future = future
+        future.add_done_callback(self._finish)
+        return future
+
+    def _fresh_model(self):
+        """ An unfitted copy of the served model.
+
+        The kernel and mean function are copied, since fit changes
+        them, but the served model's fitted arrays are not.
+        """
+        model = copy.copy(self.model)
+        model.kernel = copy.deepcopy(self.model.kernel.compact())
+        model.mean_func = copy.deepcopy(self.model.mean_func)
+        if hasattr(model, '_cache'):
+            model._cache = OrderedDict()
+        hypers = np.asarray(self.model.hypers)
+        if self.warm_start and hypers.ndim == 1:
+            model.guesses = list(hypers)
+        return model
+
+    def _finish(self, future):
+        """ Swap in a completed refit. """
+        with self._lock:
+            self._future = None
+            self._swap(future)
+            # Observations that arrived during the refit may be due
+            self._check_triggers()
+            if self._future is None:
+                self._idle.set()
+
+    def _swap(self, future):
+        """ Serve the model from a finished refit. """
+        duration = time.monotonic() - self._started_at
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self.error = error
+            self._n_failed += 1
+            return
+        self.model = future.result()
+        self.error = None
+        self._n_fitted = self._n_started
+        self._fitted_at = time.monotonic()
+        self._arrivals = [(start, t) for start, t in self._arrivals
+                          if start >= self._n_fitted]
+        self._n_refits += 1
+        self._last_duration = duration
+
+
+def load_model(path, cls=gpmodel.GPRegressor):
+    """ Load a model saved with dump_compact or dump.
+
+    Compact directories are loaded as the class they were saved from,
+    and pickles as cls.
+    """
+    if not os.path.isdir(path):
+        return cls.load(path)
+    with open(os.path.join(path, 'meta.pkl'), 'rb') as f:
+        class_name = pickle.load(f)['class']
+    return getattr(gpmodel, class_name).load_compact(path)
+
+
+async def _respond(batchers, line, writer):
+    """ Answer one request line. """
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        response = {'error': 'invalid JSON: %s' % e}
+    else:
+        response = {'id': request.get('id')}
+        batcher = batchers.get(request.get('model'))
+        if batcher is None:
+            response['error'] = 'unknown model %r' % request.get('model')
+        elif 'X' not in request:
+            response['error'] = 'missing X'
+        else:
+            try:
+                results = await batcher.apredict(request['X'])
+            except Exception as e:
+                response['error'] = repr(e)
+            else:
+                response.update({name: r.tolist() for name, r
+                                 in zip(batcher.fields, results)})
+    writer.write(json.dumps(response).encode() + b'\n')
+    await writer.drain()
+
+
+async def _handle(batchers, reader, writer):
+    """ Answer the requests on one connection concurrently. """
+    tasks = set()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                task = asyncio.ensure_future(
+                    _respond(batchers, line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        writer.close()
+
+
+async def start_server(models, path=None, host='127.0.0.1', port=8765,
+                       window=0.005, max_batch=256):
+    """ Start serving models.
+
+    Parameters:
+        models (dict): name to fitted model
+        path (string): Unix socket to listen on. If None, listens on
+            host and port instead.
+        host (string)
+        port (int)
+        window (float): latency window of each MicroBatcher
+        max_batch (int): maximum batch of each MicroBatcher
+
+    Returns:
+        server (asyncio.AbstractServer)
+        batchers (dict): name to MicroBatcher
+    """
+    batchers = {name: MicroBatcher(model, window=window,
+                                   max_batch=max_batch)
+                for name, model in models.items()}
+
+    async def handle(reader, writer):
+        await _handle(batchers, reader, writer)
+
+    if path is not None:
+        server = await asyncio.start_unix_server(handle, path=path)
+    else:
+        server = await asyncio.start_server(handle, host=host, port=port)
+    return server, batchers
+
+
+async def serve(models, **kwargs):
+    """ Serve models until cancelled. Keyword arguments are passed to
+    start_server. """
+    server, batchers = await start_server(models, **kwargs)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for batcher in batchers.values():
+            batcher.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve fitted GP models.')
+    parser.add_argument('--model', nargs=2, action='append', default=[],
+                        metavar=('NAME', 'PATH'),
+                        help='regression model or compact directory')
+    parser.add_argument('--classifier', nargs=2, action='append',
+                        default=[], metavar=('NAME', 'PATH'),
+                        help='pickled GPClassifier')
+    parser.add_argument('--socket', help='Unix socket to listen on')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--window', type=float, default=0.005,
+                        help='seconds to wait for requests to batch')
+    parser.add_argument('--max-batch', type=int, default=256)
+    args = parser.parse_args(argv)
+    models = {name: load_model(path) for name, path in args.model}
+    models.update({name: load_model(path, cls=gpmodel.GPClassifier)
+                   for name, path in args.classifier})
+    if not models:
+        parser.error('no models given')
+    try:
+        asyncio.run(serve(models, path=args.socket, host=args.host,
+                          port=args.port, window=args.window,
+                          max_batch=args.max_batch))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
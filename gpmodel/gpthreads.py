@@ -0,0 +1,142 @@
+''' Thread budgets shared by BLAS, numba, and gpmodel's worker pools.
+
+NumPy's BLAS and numba each start a thread per core by default, so a
+pool of worker processes that each use them runs several threads per
+core. A ThreadBudget caps the total:
+
+    with gpthreads.ThreadBudget(8):
+        model.fit(X, Y)
+
+Inside the with block, BLAS and numba use at most 8 threads, and the
+pools gpmodel starts (for multiple starts with n_jobs) split the 8
+between their workers, capping each worker's BLAS and numba threads
+to its share. A model's n_threads attribute does the same for that
+model alone.
+
+Each thread has its own active budget, so a budget entered in one
+thread does not size the pools started by another. BLAS limits are
+set with threadpoolctl, which is optional; without it, only numba
+and the pool sizes are limited. BLAS limits apply to the whole
+process, so the limits of budgets entered by different threads at
+the same time override each other.
+'''
+
+import os
+import threading
+
+try:
+    import threadpoolctl
+except ImportError:
+    threadpoolctl = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Each thread's entered ThreadBudgets, innermost last, with the
+# limits to restore when they exit
+_local = threading.local()
+
+
+def available_cores():
+    """ The number of cores this process may run on. """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _entered():
+    """ The current thread's stack of (budget, limits). """
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def current_budget():
+    """ The current thread's active ThreadBudget, or one for every
+    available core. """
+    stack = _entered()
+    if not stack:
+        return ThreadBudget()
+    return stack[-1][0]
+
+
+class ThreadLimits(object):
+
+    """ Caps BLAS and numba threads until restored.
+
+    The limits are applied when the object is created, and restored
+    by restore or at the end of a with block.
+    """
+
+    def __init__(self, n_threads):
+        self._blas = None
+        self._numba = None
+        if threadpoolctl is not None:
+            self._blas = threadpoolctl.threadpool_limits(limits=n_threads)
+        if numba is not None:
+            self._numba = numba.get_num_threads()
+            numba.set_num_threads(min(n_threads,
+                                      numba.config.NUMBA_NUM_THREADS))
+
+    def restore(self):
+        """ Restore the previous limits. """
+        if self._blas is not None:
+            self._blas.restore_original_limits()
+            self._blas = None
+        if self._numba is not None:
+            numba.set_num_threads(self._numba)
+            self._numba = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.restore()
+
+
+def limit(n_threads):
+    """ Cap BLAS and numba at n_threads threads.
+
+    Returns:
+        limits (ThreadLimits)
+    """
+    return ThreadLimits(n_threads)
+
+
+class ThreadBudget(object):
+
+    """ A number of threads to share between workers.
+
+    Attributes:
+        n_threads (int): total threads. Default is the number of
+            available cores.
+    """
+
+    def __init__(self, n_threads=None):
+        if n_threads is None:
+            n_threads = available_cores()
+        if n_threads < 1:
+            raise ValueError('n_threads must be at least 1.')
+        self.n_threads = int(n_threads)
+
+    def split(self, n_workers):
+        """ Divide the budget between at most n_workers workers.
+
+        Returns:
+            n_workers (int): workers to start
+            threads_per_worker (int)
+        """
+        n_workers = max(1, min(n_workers, self.n_threads))
+        return n_workers, self.n_threads // n_workers
+
+    def __enter__(self):
+        _entered().append((self, limit(self.n_threads)))
+        return self
+
+    def __exit__(self, *exc):
+        _, limits = _entered().pop()
+        limits.restore()
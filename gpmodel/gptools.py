@@ -1,4 +1,6 @@
 from sys import exit
+import copy
+import itertools
 import math
 
 import numpy as np
@@ -10,6 +12,7 @@ import seaborn as sns
 
 from gpmodel import gpmodel
 from gpmodel import gpkernel
+from gpmodel import gpparallel
 
 
 rc = {'lines.linewidth': 3,
@@ -24,9 +27,28 @@ sns.set_style('whitegrid', rc=rc)
 ######################################################################
 
 
+def _cv_fold(model, Xs, Ys, train_inds, test_inds):
+    ''' Fit a copy of model on the training rows and predict the rest. '''
+    model = copy.deepcopy(model)
+    model.fit(Xs.loc[train_inds], Ys.loc[train_inds])
+    preds = model.predict(Xs.loc[test_inds])
+    return [p[0] for p in preds]
+
+
+def _fit_last(model, Xs, Ys, folds):
+    ''' Fit model on the last fold's training rows, as a serial cv
+    would have left it. '''
+    train_inds, _ = folds[-1]
+    model.fit(Xs.loc[train_inds], Ys.loc[train_inds])
+
+
 def cv(Xs, Ys, model, n_train, replicates=50, keep_inds=[]):
     ''' Returns cross-validation predictions.
 
+    Each fold is fit on its own copy of model, and the folds are run
+    by the active gpparallel executor. model is then fit to the last
+    fold's training set.
+
     Parameters:
         Xs (pd.DataFrame)
         Ys (pd.DataFrame)
@@ -52,13 +74,17 @@ def cv(Xs, Ys, model, n_train, replicates=50, keep_inds=[]):
         regr = False
     else:
         regr = True
+    executor = gpparallel.current_executor()
     if n_train == len(Xs) - 1 - len(keep_inds):
-        for test_inds in changed_index:
-            train_inds = list(set(Xs.index) - set(test_inds))
-            model.fit(Xs.loc[train_inds], Ys.loc[train_inds])
-            preds = model.predict(Xs.loc[[test_inds]])
-            predicted += [p[0] for p in preds]
-            actual += list(Ys.loc[[test_inds]])
+        folds = [(list(set(Xs.index) - set(test_inds)), [test_inds])
+                 for test_inds in changed_index]
+        preds = executor.map(_cv_fold, itertools.repeat(model),
+                             itertools.repeat(Xs), itertools.repeat(Ys),
+                             *zip(*folds))
+        _fit_last(model, Xs, Ys, folds)
+        for (_, test_inds), p in zip(folds, preds):
+            predicted += p
+            actual += list(Ys.loc[test_inds])
         if not regr:
             fpr, tpr, _ = metrics.roc_curve(actual, predicted)
             metric = metrics.auc(fpr, tpr)
@@ -66,6 +92,7 @@ def cv(Xs, Ys, model, n_train, replicates=50, keep_inds=[]):
             metric = np.corrcoef(predicted, actual)[0, 1]
         return predicted, actual, metric
     Rs = []
+    folds = []
     for r in range(replicates):
         # pick indices for train and test sets
         train_inds = np.random.choice(changed_index, n_train, replace=False)
@@ -73,11 +100,15 @@ def cv(Xs, Ys, model, n_train, replicates=50, keep_inds=[]):
         test_inds = list(set(Xs.index) - set(train_inds))
         if all(Ys.loc[test_inds] == 1) or all(Ys.loc[test_inds] == -1):
             continue
-        # fit the model
-        model.fit(Xs.loc[train_inds], Ys.loc[train_inds])
-        # make predictions
-        preds = model.predict(Xs.loc[test_inds])
-        predictions = [p[0] for p in preds]
+        folds.append((train_inds, test_inds))
+    if len(folds) == 0:
+        raise ValueError('Every test set has outputs of only one class.')
+    # fit the model and make predictions for each fold
+    preds = executor.map(_cv_fold, itertools.repeat(model),
+                         itertools.repeat(Xs), itertools.repeat(Ys),
+                         *zip(*folds))
+    _fit_last(model, Xs, Ys, folds)
+    for (_, test_inds), predictions in zip(folds, preds):
         truth = list(Ys.loc[test_inds])
         predicted += predictions
         actual += truth
@@ -1,12 +1,17 @@
+import copy
 import itertools
-from collections import Counter
-import multiprocessing as mp
+from collections import Counter, namedtuple
 
 import numpy as np
 import numba
 from scipy import sparse
 
 from gpmodel.gpkernel import BaseKernel
+from gpmodel import gpparallel
+
+# Observed kmers, kmer counts, and the sums built up by MismatchKernel.dft
+_MismatchState = namedtuple('_MismatchState',
+                            ['observed', 'X1', 'X2', 'K', 'K11', 'K22'])
 
 @numba.jit(nopython=True)
 # @numba.autojit
@@ -25,19 +30,98 @@ def sdk(subs, adj):
     masked = masked.sum(axis=-1)
     return np.sum(masked.T * subs)
 
+def _quadratic_form(subs, A):
+    """ s^T A s for each row s of subs.
+
+    A sparse A costs O(nnz) per row instead of O(L^2).
+    """
+    if sparse.issparse(A):
+        SA = (A.T @ subs.T).T
+    else:
+        SA = subs @ A
+    return np.einsum('ik,ik->i', SA, subs)
+
+def _decomposition_block(S, A, X1, X2):
+    """ decomposition_cov for one block of X1 and X2. """
+    subs = S[X1[:, None, :], X2[None, :, :]]
+    L = subs.shape[-1]
+    K = _quadratic_form(subs.reshape(-1, L), A)
+    return K.reshape(len(X1), len(X2))
+
+def decomposition_cov(S, A, X1, X2, block_size=256, max_bytes=2 ** 27):
+    """ Unnormalized s^T A s for every pair of sequences.
+
+    s is the vector of substitution values S[x1, x2] at each position,
+    so this is wdk with A as the contact adjacency matrix and sdk with
+    A as the smoothed adjacency matrix. The pairs are done in blocks
+    of at most block_size rows of X1, with the n1 x n2 x L
+    intermediates of each block kept under max_bytes, and the blocks
+    are computed by the active gpparallel executor.
+
+    Parameters:
+        S (np.ndarray): substitution matrix
+        A (np.ndarray or scipy.sparse matrix): L x L adjacency
+        X1 (np.ndarray): n1 x L tokens
+        X2 (np.ndarray): n2 x L tokens
+        block_size (int): most rows of X1 per block
+        max_bytes (int): memory for each block's intermediates
+
+    Returns:
+        K (np.ndarray): n1 x n2
+    """
+    K = np.empty((len(X1), len(X2)))
+    if K.size == 0:
+        return K
+    # subs and s^T A are each rows x cols x L
+    per_pair = 2 * X1.shape[1] * np.dtype(S.dtype).itemsize
+    cols = int(min(len(X2), max(1, max_bytes // per_pair)))
+    rows = int(min(block_size, max(1, max_bytes // (per_pair * cols))))
+    blocks = [(slice(i, i + rows), slice(j, j + cols))
+              for i in range(0, len(X1), rows)
+              for j in range(0, len(X2), cols)]
+    executor = gpparallel.current_executor()
+    tiles = executor.map(_decomposition_block, itertools.repeat(S),
+                         itertools.repeat(A), [X1[ii] for ii, _ in blocks],
+                         [X2[jj] for _, jj in blocks])
+    for (ii, jj), tile in zip(blocks, tiles):
+        K[ii, jj] = tile
+    return K
+
+def decomposition_diag(S, A, X):
+    """ Unnormalized s^T A s for each sequence against itself. """
+    return _quadratic_form(S[X, X], A)
+
+def _kernel_cov(kernel, X1, X2):
+    """ The covariance of one of a MultipleKernel's kernels. """
+    return kernel.cov(X1, X2)
+
 class MultipleKernel(BaseKernel):
 
-    """ Weighted sum of kernels with no individual hyperparameters. """
+    """ Weighted sum of kernels with no individual hyperparameters.
+
+    The kernels' covariances are computed by the active gpparallel
+    executor.
+    """
 
     def __init__(self, kernels):
         self.kernels = kernels
         self._n_hypers = 2 * len(kernels)
         return
 
+    def _base_covs(self, X1, X2):
+        """ Each kernel's covariance between X1 and X2. """
+        executor = gpparallel.current_executor()
+        return executor.map(_kernel_cov, self.kernels,
+                            itertools.repeat(X1), itertools.repeat(X2))
+
     def fit(self, X):
-        # pool = mp.Pool(processes=8)
-        # self._saved = [pool.apply(ke.cov, args=(X, X)) for ke in self.kernels]
-        self._saved = [ke.cov(X, X) for ke in self.kernels]
+        self._saved = self._base_covs(X, X)
+        return self._n_hypers
+
+    def extend(self, X, X_new):
+        self._saved = [self._extend_saved(saved, ke.cov(X, X_new),
+                                          ke.cov(X_new, X_new))
+                       for saved, ke in zip(self._saved, self.kernels)]
         return self._n_hypers
 
     def cov(self, X1=None, X2=None, hypers=None):
@@ -49,14 +133,49 @@ class MultipleKernel(BaseKernel):
         if X1 is None and X2 is None:
             base = self._saved
         else:
-            # pool = mp.Pool(processes=8)
-            # base = [pool.apply(ke.cov, args=(X1, X2)) for ke in self.kernels]
-            base = [ke.cov(X1, X2)for ke in self.kernels]
+            base = self._base_covs(X1, X2)
         # base = [K ** g for K, g in zip(base, gamma)]
         base = np.array(base)
         base = base ** gamma
         return np.sum(base * w, axis=0)
 
+    def compact(self):
+        kernel = copy.copy(self)
+        kernel.kernels = [ke.compact() for ke in self.kernels]
+        return kernel
+
+    def diag(self, X, hypers=None):
+        """ Calculate the variance of each input. """
+        if hypers is None:
+            hypers = np.ones(self._n_hypers)
+        hypers = np.asarray(hypers)
+        w = hypers[:self._n_hypers // 2].reshape(len(self.kernels), 1)
+        gamma = hypers[self._n_hypers // 2:].reshape(len(self.kernels), 1)
+        base = np.array([ke.diag(X) for ke in self.kernels])
+        return np.sum(w * base ** gamma, axis=0)
+
+    def grad(self, X1=None, X2=None, hypers=None):
+        """ Calculate the gradient with respect to the weights and powers.
+
+        Returns:
+            dK (np.ndarray): n_hypers x n1 x n2
+        """
+        if hypers is None:
+            hypers = np.ones(self._n_hypers)
+        hypers = np.asarray(hypers)
+        w = hypers[:self._n_hypers // 2].reshape(len(self.kernels), 1, 1)
+        gamma = hypers[self._n_hypers // 2:].reshape(len(self.kernels), 1, 1)
+        if X1 is None and X2 is None:
+            base = self._saved
+        else:
+            base = self._base_covs(X1, X2)
+        base = np.array(base)
+        powered = base ** gamma
+        positive = base > 0
+        log_base = np.log(np.where(positive, base, 1.0))
+        d_gamma = np.where(positive, w * powered * log_base, 0.0)
+        return np.concatenate((powered, d_gamma), axis=0)
+
 class WeightedDecompositionKernel(BaseKernel):
 
     """
@@ -77,6 +196,7 @@ class WeightedDecompositionKernel(BaseKernel):
         """
         self.S = S
         self.graph = self.make_graph(contacts, L)
+        self.adj = self.make_adjacency(self.graph)
         self._n_hypers = 0
         return
 
@@ -91,11 +211,31 @@ class WeightedDecompositionKernel(BaseKernel):
         graph = [g + [-1] * (max_L - len(g)) for g in graph]
         return np.array(graph).astype(int) # numba does not allow float indexers of arrays
 
+    def make_adjacency(self, graph):
+        """ Return the sparse L x L matrix counting contacts between positions.
+
+        Each position has only a few contacts, so s^T adj s costs
+        O(L * contacts) as in wdk, rather than O(L^2).
+        """
+        rows, cols = np.nonzero(graph >= 0)
+        values = np.ones(len(rows))
+        adj = sparse.coo_matrix((values, (rows, graph[rows, cols])),
+                                shape=(len(graph), len(graph)))
+        # Converting sums repeated contacts
+        return adj.tocsr()
+
     def fit(self, X):
         """ Precompute the kernel for a set of sequences."""
         self._saved = self.cov(X1=X, X2=X)
         return self._n_hypers
 
+    def extend(self, X, X_new):
+        """ Extend the precomputed kernel with new sequences."""
+        self._saved = self._extend_saved(self._saved,
+                                         self.cov(X1=X, X2=X_new),
+                                         self.cov(X1=X_new, X2=X_new))
+        return self._n_hypers
+
     def cov(self, X1=None, X2=None, hypers=None):
         """Calculate the weighted decomposition kernel.
 
@@ -111,33 +251,20 @@ class WeightedDecompositionKernel(BaseKernel):
         """
         if X1 is None and X2 is None:
             return self._saved
-        # Get pairwise substitution values
-        n1, L = X1.shape
-        n2, _ = X2.shape
-        K = np.zeros((n1, n2))
-        if n1 == n2:
-            square = np.allclose(X1, X2)
-        else:
-            square = False
-        for i, x1 in enumerate(X1):
-            for j, x2 in enumerate(X2):
-                if square:
-                    if i > j:
-                        K[i, j] = K[j, i]
-                subs = np.zeros(L + 1)
-                subs[:-1] = self.S[x1, x2]
-                K[i, j] = wdk(subs, self.graph)
-        k1 = np.zeros((n1, 1))
-        for i, x1 in enumerate(X1):
-            subs = self.S[x1, x1]
-            subs = np.append(subs, 0)
-            k1[i, 0] = wdk(subs, self.graph)
-        k2 = np.zeros((1, n2))
-        for i, x2 in enumerate(X2):
-            subs = self.S[x2, x2]
-            subs = np.append(subs, 0)
-            k2[0, i] = wdk(subs, self.graph)
-        return K / np.sqrt(k1) / np.sqrt(k2)
+        K = decomposition_cov(self.S, self.adj, X1, X2)
+        k1 = decomposition_diag(self.S, self.adj, X1)
+        k2 = decomposition_diag(self.S, self.adj, X2)
+        return K / np.sqrt(k1)[:, None] / np.sqrt(k2)[None, :]
+
+    def diag(self, X, hypers=None):
+        """ The kernel is normalized, so every input has unit variance. """
+        return np.ones(len(X))
+
+    def grad(self, X1=None, X2=None, hypers=None):
+        """ The kernel has no hyperparameters, so the gradient is empty. """
+        if X1 is None and X2 is None:
+            return np.zeros((0, ) + self._saved.shape)
+        return np.zeros((0, len(X1), len(X2)))
 
 class SmoothDecompositionKernel(BaseKernel):
 
@@ -173,6 +300,13 @@ class SmoothDecompositionKernel(BaseKernel):
         self._saved = self.cov(X1=X, X2=X)
         return self._n_hypers
 
+    def extend(self, X, X_new):
+        """ Extend the precomputed kernel with new sequences."""
+        self._saved = self._extend_saved(self._saved,
+                                         self.cov(X1=X, X2=X_new),
+                                         self.cov(X1=X_new, X2=X_new))
+        return self._n_hypers
+
     def cov(self, X1=None, X2=None, hypers=None):
         """Calculate the weighted decomposition kernel.
 
@@ -188,30 +322,20 @@ class SmoothDecompositionKernel(BaseKernel):
         """
         if X1 is None and X2 is None:
             return self._saved
-        # Get pairwise substitution values
-        n1, L = X1.shape
-        n2, _ = X2.shape
-        is_square = False
-        if n1 == n2:
-            if np.allclose(X1, X2):
-                is_square = True
-        K = np.empty((n1, n2))
-        for i, x1 in enumerate(X1):
-            for j, x2 in enumerate(X2):
-                if is_square and i > j:
-                        K[i, j] = K[j, i]
-                else:
-                    subs = self.S[x1, x2]
-                    K[i, j] = sdk(subs, self.adj)
-        K11 = np.empty((n1, 1))
-        for i, x1 in enumerate(X1):
-            subs = self.S[x1, x1]
-            K11[i, 0] = sdk(subs, self.adj)
-        K22 = np.empty((1, n2))
-        for i, x2 in enumerate(X2):
-            subs = self.S[x2, x2]
-            K22[0, i] = sdk(subs, self.adj)
-        return K / np.sqrt(K11) / np.sqrt(K22)
+        K = decomposition_cov(self.S, self.adj, X1, X2)
+        K11 = decomposition_diag(self.S, self.adj, X1)
+        K22 = decomposition_diag(self.S, self.adj, X2)
+        return K / np.sqrt(K11)[:, None] / np.sqrt(K22)[None, :]
+
+    def diag(self, X, hypers=None):
+        """ The kernel is normalized, so every input has unit variance. """
+        return np.ones(len(X))
+
+    def grad(self, X1=None, X2=None, hypers=None):
+        """ The kernel has no hyperparameters, so the gradient is empty. """
+        if X1 is None and X2 is None:
+            return np.zeros((0, ) + self._saved.shape)
+        return np.zeros((0, len(X1), len(X2)))
 
 
 class MismatchKernel(BaseKernel):
@@ -263,16 +387,17 @@ class MismatchKernel(BaseKernel):
             nodes += new_nodes
         return nodes
 
-    def prune(self, candidates, mutations, prefix):
+    def prune(self, candidates, mutations, prefix, observed):
         """
         Candidates are indices to kmer candidates,
         mutations are corresponding mutation counts
         prefix is kmer as vector
+        observed is the array of observed kmers
         """
         L = len(prefix)
         if L == 0:
             return candidates, mutations
-        mutant = self.observed[candidates][:, L - 1] != prefix[-1]
+        mutant = observed[candidates][:, L - 1] != prefix[-1]
         mutations[candidates] += mutant
         keep_me = mutations <= self.m
         candidates = candidates[keep_me[candidates]]
@@ -283,6 +408,14 @@ class MismatchKernel(BaseKernel):
         self._saved = self.cov(seqs1=seqs, seqs2=seqs)
         return self._n_hypers
 
+    def extend(self, seqs, seqs_new):
+        """ Extend the precomputed kernel with new sequences."""
+        self._saved = self._extend_saved(self._saved,
+                                         self.cov(seqs1=seqs, seqs2=seqs_new),
+                                         self.cov(seqs1=seqs_new,
+                                                  seqs2=seqs_new))
+        return self._n_hypers
+
     def cov(self, seqs1=None, seqs2=None, hypers=(1.0,)):
         """Calculate the mismatch string kernel.
 
@@ -306,49 +439,64 @@ class MismatchKernel(BaseKernel):
         kmers1 = [[seq[i:i + self.k] for i in range(len(seq) - self.k + 1)] for seq in seqs1]
         kmers2 = [[seq[i:i + self.k] for i in range(len(seq) - self.k + 1)] for seq in seqs2]
         # Get all observed kmers
-        self.observed = sorted(set(itertools.chain.from_iterable(kmers1 + kmers2)))
+        observed = sorted(set(itertools.chain.from_iterable(kmers1 + kmers2)))
         # Get count of each observed kmer for each sequence
-        self.X1 = np.zeros((len(seqs1), len(self.observed)))
-        self.X2 = np.zeros((len(seqs2), len(self.observed)))
+        X1 = np.zeros((len(seqs1), len(observed)))
+        X2 = np.zeros((len(seqs2), len(observed)))
         kmer_counts1 = [Counter(kmer) for kmer in kmers1]
         kmer_counts2 = [Counter(kmer) for kmer in kmers2]
-        for j, obs in enumerate(self.observed):
+        for j, obs in enumerate(observed):
             for i, counts in enumerate(kmer_counts1):
-                self.X1[i, j] = counts[obs]
+                X1[i, j] = counts[obs]
             for i, counts in enumerate(kmer_counts2):
-                self.X2[i, j] = counts[obs]
+                X2[i, j] = counts[obs]
         # Convert observed kmers to an array
-        self.observed = np.array([[self.A_to_num[a] for a in obs] for obs in self.observed])
-        # Create the covariance matrix
-        self.K = np.zeros((len(seqs1), len(seqs2)))
-        # Create the variance matrices
-        self.K11 = np.zeros((len(seqs1), 1))
-        self.K22 = np.zeros((len(seqs2), 1))
+        observed = np.array([[self.A_to_num[a] for a in obs] for obs in observed])
+        # The traversal accumulates into these arrays rather than
+        # attributes, so that threads can share the kernel
+        state = _MismatchState(observed, X1, X2,
+                               np.zeros((len(seqs1), len(seqs2))),
+                               np.zeros((len(seqs1), 1)),
+                               np.zeros((len(seqs2), 1)))
         # Initialize the mutation counts
-        mutations = np.zeros(len(self.observed))
+        mutations = np.zeros(len(observed))
         # Initialize the candidate indices
         candidates = np.arange(len(mutations))
         # Populate K
-        self.dft(candidates.copy(), mutations.copy(), 0)
+        self.dft(candidates.copy(), mutations.copy(), 0, state)
         # Normalize K
-        self.K /= np.sqrt(self.K11)
-        self.K /= np.sqrt(self.K22.T)
-        self.K *= hypers[0]
-        return self.K
+        K = state.K
+        K /= np.sqrt(state.K11)
+        K /= np.sqrt(state.K22.T)
+        K *= hypers[0]
+        return K
+
+    def diag(self, seqs, hypers=(1.0,)):
+        """ The kernel is normalized, so each variance is the sigma value. """
+        return np.full(len(seqs), float(hypers[0]))
+
+    def grad(self, seqs1=None, seqs2=None, hypers=(1.0,)):
+        """ Calculate the gradient with respect to the sigma value.
+
+        Returns:
+            dK (np.ndarray): 1 x n1 x n2
+        """
+        return np.expand_dims(self.cov(seqs1, seqs2, hypers=(1.0, )), 0)
 
-    def dft(self, candidates, mutations, ind):
+    def dft(self, candidates, mutations, ind, state):
         """ Depth first traversal of kmer tree to calculate K."""
         kmer = self.nodes[ind][0]
-        candidates, mutations = self.prune(candidates, mutations, kmer)
+        candidates, mutations = self.prune(candidates, mutations, kmer,
+                                           state.observed)
         if len(candidates) == 0:
             return
         if len(self.nodes[ind][1]) == 0:
-            Y = np.zeros((len(self.observed), 1))
+            Y = np.zeros((len(state.observed), 1))
             Y[candidates, 0] = 1
-            n_alphas1 = self.X1 @ Y
-            n_alphas2 = self.X2 @ Y
-            self.K += n_alphas1 @ n_alphas2.T
-            self.K11 += n_alphas1 ** 2
-            self.K22 += n_alphas2 ** 2
+            n_alphas1 = state.X1 @ Y
+            n_alphas2 = state.X2 @ Y
+            state.K[:] += n_alphas1 @ n_alphas2.T
+            state.K11[:] += n_alphas1 ** 2
+            state.K22[:] += n_alphas2 ** 2
         for e in self.nodes[ind][1]:
-            self.dft(candidates.copy(), mutations.copy(), e)
+            self.dft(candidates.copy(), mutations.copy(), e, state)
@@ -87,6 +87,14 @@ def test_predict():
     model = gpmodel.GPClassifier(kernel)
     model.fit(X, Y)
     p, m, v = model.predict(X_test)
+    p2, m2, v2 = model.predict(X_test, return_cov=False)
+    assert np.allclose(p, p2)
+    assert np.allclose(m, m2)
+    assert np.allclose(np.diag(v), v2)
+    chunks = list(model.predict_iter(X_test, chunk_size=2))
+    assert np.allclose(np.concatenate([c[0] for c in chunks]), p2)
+    assert np.allclose(np.concatenate([c[1] for c in chunks]), m2)
+    assert np.allclose(np.concatenate([c[2] for c in chunks]), v2)
     h = model.hypers
     k_star = model.kernel.cov(X_test, X, hypers=h)
     k_star_star = model.kernel.cov(X_test, X_test, hypers=h)
@@ -107,6 +115,12 @@ def test_predict():
                                     span * va + f,
                                     args=(f, va))[0]
     assert np.allclose(p, pi_star)
+    # Predictions come from the snapshot published by fit
+    model._log_ML(h * 2)
+    p3, m3, v3 = model.predict(X_test, return_cov=False)
+    assert np.allclose(p3, p2)
+    assert np.allclose(m3, m2)
+    assert np.allclose(v3, v2)
 
 
 def test_pickles():
@@ -0,0 +1,113 @@
+import pytest
+
+import numpy as np
+
+from gpmodel import gpkernel
+from gpmodel import gpmodel
+from gpmodel import gplinalg
+
+np.random.seed(0)
+n = 80
+d = 2
+X = np.random.random(size=(n, d))
+Y = np.sin(4 * X[:, 0]) + X[:, 1] + np.random.normal(scale=0.1, size=n)
+X_test = np.random.random(size=(5, d))
+hypers = np.array([0.05, 1.2, 0.4])
+A = np.random.random(size=(n, n))
+A = A @ A.T + np.eye(n)
+
+
+def exact_model():
+    model = gpmodel.GPRegressor(gpkernel.SEKernel())
+    model.X = X
+    model.Y = Y
+    model._ell = n
+    model.kernel.fit(X)
+    model._set_targets()
+    return model
+
+
+def iterative_model(**kwargs):
+    model = gpmodel.IterativeGPRegressor(gpkernel.SEKernel(), **kwargs)
+    model.X = X
+    model.Y = Y
+    model._ell = n
+    model._fit_kernel(X)
+    model._set_targets()
+    return model
+
+
+def test_pcg():
+    B = np.random.normal(size=(n, 3))
+    B[:, 2] = 0
+    sol, alphas, betas, n_iter = gplinalg.pcg(lambda V: A @ V, B, tol=1e-10)
+    assert np.allclose(A @ sol, B)
+    assert n_iter[2] == 0
+    V = np.random.normal(size=(3, n))
+    lam = np.random.random(size=n) + 0.5
+    L_A = gplinalg.woodbury_factor(V, lam, np.zeros(n))[0]
+    P = V.T @ V + np.diag(lam)
+    assert np.allclose(gplinalg.woodbury_solve(V, lam, L_A, B),
+                       np.linalg.solve(P, B))
+    precond = lambda R: gplinalg.woodbury_solve(V, lam, L_A, R)
+    sol_p = gplinalg.pcg(lambda V: A @ V, B, precond=precond, tol=1e-10)[0]
+    assert np.allclose(sol_p, sol)
+
+
+def test_lanczos_quadrature():
+    Z = np.random.normal(size=(n, 1000))
+    _, alphas, betas, n_iter = gplinalg.pcg(lambda V: A @ V, Z, tol=1e-10)
+    q = gplinalg.lanczos_quadrature(alphas, betas, n_iter)
+    logdet = np.mean(np.sum(Z ** 2, axis=0) * q)
+    assert np.isclose(logdet, np.linalg.slogdet(A)[1], rtol=0.02)
+
+
+def test_ML():
+    exact = exact_model()
+    ML, grad = exact._log_ML(hypers, gradient=True)
+    # A full-rank preconditioner makes the log determinant exact
+    model = iterative_model(precond_rank=n, tile_size=30)
+    assert np.isclose(model._log_ML(hypers), ML)
+    assert np.isclose(model.ML, ML)
+    model = iterative_model(precond_rank=10, n_probes=200, tile_size=30)
+    ML_i, grad_i = model._log_ML(hypers, gradient=True)
+    assert np.isclose(ML_i, ML, rtol=0.05)
+    assert np.allclose(grad_i, grad, rtol=0.25, atol=1.0)
+    assert model._log_ML(hypers) == ML_i
+    assert np.allclose(model._matvec(np.eye(n), hypers),
+                       exact._make_Ks(hypers)[1])
+
+
+def test_predict():
+    exact = exact_model()
+    exact.hypers = hypers
+    exact._posterior = exact._factorize(hypers)
+    model = iterative_model(precond_rank=10, tol=1e-10)
+    model.hypers = hypers
+    model._posterior = model._factorize(hypers)
+    E, var = exact.predict(X_test)
+    E_i, var_i = model.predict(X_test)
+    assert np.allclose(E_i, E)
+    assert np.allclose(var_i, var)
+    E_i, var_i = model.predict(X_test, return_cov=False)
+    assert np.allclose(var_i, np.diag(var))
+
+
+def test_fit():
+    model = gpmodel.IterativeGPRegressor(gpkernel.SEKernel(),
+                                         precond_rank=20, tile_size=30)
+    model.fit(X, Y)
+    assert len(model.hypers) == 3
+    assert np.isclose(model.ML, model._log_ML(model.hypers))
+    E, std = model.predict(X_test, return_std=True)
+    assert np.all(std > 0)
+    with pytest.raises(NotImplementedError):
+        model.LOO_res()
+
+
+if __name__ == "__main__":
+    test_pcg()
+    test_lanczos_quadrature()
+    test_ML()
+    test_predict()
+    test_fit()
@@ -180,6 +180,111 @@ def test_sum_kernel():
     assert n == 4
     assert np.allclose(kernel.cov(hypers=params), actual)
 
+def check_grad(kern, hypers, eps=1e-6):
+    hypers = np.array(hypers, dtype=float)
+    dK = kern.grad(X, X, hypers=hypers)
+    assert dK.shape == (len(hypers), len(X), len(X))
+    for i in range(len(hypers)):
+        h_plus = hypers.copy()
+        h_plus[i] += eps
+        h_minus = hypers.copy()
+        h_minus[i] -= eps
+        fd = (kern.cov(X, X, hypers=h_plus) -
+              kern.cov(X, X, hypers=h_minus)) / (2 * eps)
+        assert np.allclose(dK[i], fd, atol=1e-6)
+    kern.fit(X)
+    assert np.allclose(kern.grad(hypers=hypers), dK)
+    dK_iter = list(kern.grad_iter(hypers=hypers))
+    assert len(dK_iter) == len(hypers)
+    assert np.allclose(np.stack(dK_iter), dK)
+
+
+def test_grads():
+    check_grad(gpkernel.SEKernel(), (0.3, 0.8))
+    check_grad(gpkernel.ARDSEKernel(), np.insert(L + 0.5, 0, 0.7))
+    check_grad(gpkernel.ARDSEKernel(), (0.7, 0.9))
+    check_grad(gpkernel.MaternKernel('3/2'), (0.6, ))
+    check_grad(gpkernel.MaternKernel('5/2'), (0.6, ))
+    check_grad(gpkernel.ARDMaternKernel('3/2'), L + 0.5)
+    check_grad(gpkernel.ARDMaternKernel('5/2'), L + 0.5)
+    check_grad(gpkernel.PolynomialKernel(3), (0.9, 0.1))
+    check_grad(gpkernel.LinearKernel(), (0.4, ))
+    kernels = [gpkernel.MaternKernel('5/2'), gpkernel.SEKernel(),
+               gpkernel.LinearKernel()]
+    check_grad(gpkernel.SumKernel(kernels), (0.6, 0.3, 0.8, 0.4))
+
+
+def test_diags():
+    kernels = [(gpkernel.SEKernel(), (0.3, 0.8)),
+               (gpkernel.ARDSEKernel(), np.insert(L, 0, 0.7)),
+               (gpkernel.MaternKernel('3/2'), (0.6, )),
+               (gpkernel.ARDMaternKernel('5/2'), L),
+               (gpkernel.PolynomialKernel(3), (0.9, 0.1)),
+               (gpkernel.LinearKernel(), (0.4, )),
+               (gpkernel.SumKernel([gpkernel.MaternKernel('5/2'),
+                                    gpkernel.SEKernel()]), (0.6, 0.3, 0.8))]
+    for kern, hypers in kernels:
+        assert np.allclose(kern.diag(X, hypers), np.diag(kern.cov(X, X, hypers)))
+        assert np.allclose(kern.diag(X), np.diag(kern.cov(X, X)))
+
+
+def test_extend():
+    kernels = [gpkernel.SEKernel(), gpkernel.ARDSEKernel(),
+               gpkernel.MaternKernel('3/2'), gpkernel.ARDMaternKernel('5/2'),
+               gpkernel.PolynomialKernel(2), gpkernel.LinearKernel(),
+               gpkernel.SumKernel([gpkernel.MaternKernel('5/2'),
+                                   gpkernel.SEKernel()])]
+    for kern in kernels:
+        n_hypers = kern.fit(X)
+        K = kern.cov()
+        kern.fit(X[:2])
+        assert kern.extend(X[:2], X[2:]) == n_hypers
+        assert np.allclose(kern.cov(), K)
+
+
+def test_features():
+    kernels = [(gpkernel.SEKernel(), (0.8, 1.5)),
+               (gpkernel.ARDSEKernel(), np.concatenate(([0.8], L + 1))),
+               (gpkernel.MaternKernel('3/2'), (1.5, )),
+               (gpkernel.MaternKernel('5/2'), (1.5, )),
+               (gpkernel.ARDMaternKernel('5/2'), L + 1)]
+    for kernel, h in kernels:
+        nh = kernel.fit_features(X, 20000, seed=3)
+        assert nh == len(h)
+        Phi = kernel.features(X, hypers=h)
+        assert Phi.shape == (len(X), 20000)
+        assert np.allclose(Phi @ Phi.T, kernel.cov(X, X, hypers=h),
+                           atol=0.05)
+        kernel.fit_features(X, 20000, seed=3)
+        assert np.array_equal(kernel.features(X, hypers=h), Phi)
+    with pytest.raises(NotImplementedError):
+        gpkernel.BaseRadialKernel().fit_features(X, 10)
+
+
+def test_low_rank_kernel():
+    Xs = np.random.random(size=(30, 2))
+    se = gpkernel.SEKernel()
+    K = se.cov(Xs, Xs)
+    kernel = gpkernel.LowRankKernel(gpkernel.SEKernel(), max_rank=30, tol=0)
+    assert kernel.fit(Xs) == 2
+    assert np.allclose(kernel.cov(), K, atol=1e-6)
+    kernel = gpkernel.LowRankKernel(gpkernel.SEKernel(), tol=1e-3)
+    kernel.fit(Xs)
+    r = len(kernel._pivots)
+    assert r < 30
+    K_r = kernel.cov()
+    assert np.trace(K - K_r) <= 1e-3 * np.trace(K) + 1e-8
+    assert np.allclose(K_r[kernel._pivots][:, kernel._pivots],
+                       K[kernel._pivots][:, kernel._pivots])
+    h = (1.3, 0.8)
+    Phi = kernel.features(Xs, hypers=h)
+    assert Phi.shape == (30, r)
+    assert np.allclose(kernel.cov(Xs[:4], Xs[4:9], hypers=h),
+                       Phi[:4] @ Phi[4:9].T)
+    assert np.allclose(kernel.diag(Xs[:4], hypers=h),
+                       np.diag(Phi[:4] @ Phi[:4].T))
+
+
 if __name__=="__main__":
     test_radial_kernel()
     test_ARD_radial_kernel()
@@ -190,3 +295,8 @@ if __name__=="__main__":
     test_se_kernel()
     test_ARD_se_kernel()
     test_sum_kernel()
+    test_grads()
+    test_diags()
+    test_extend()
+    test_features()
+    test_low_rank_kernel()
@@ -0,0 +1,126 @@
+import pytest
+import itertools
+
+import numpy as np
+
+from gpmodel import gpkernel
+from gpmodel import gpmodel
+from gpmodel import gplinalg
+from gpmodel import chimera_tools
+
+np.random.seed(1)
+n_blocks = 3
+n_parents = 3
+assignments = {pos: pos // 3 for pos in range(9)}
+sample_space = [tuple(np.random.choice(list('ACDE'), size=n_parents))
+                for _ in range(9)]
+sample_space.append(('G', 'G', 'G'))
+codes = [''.join(c) for c in itertools.product('012', repeat=n_blocks)]
+seqs = [''.join(chimera_tools.make_sequence(c, assignments, sample_space))
+        for c in codes]
+kernel = gpkernel.BlockSEKernel(assignments, sample_space)
+hypers = np.array([0.1, 1.3, 1.5])
+F = np.random.multivariate_normal(np.zeros(len(codes)),
+                                  kernel.cov(codes, codes, hypers[1:]))
+Y = F + np.random.normal(scale=0.3, size=len(codes))
+
+
+def exact_model(X, y, variances=None):
+    model = gpmodel.GPRegressor(gpkernel.BlockSEKernel(assignments,
+                                                       sample_space))
+    model.X = model.kernel.codes(X)
+    model.Y = y
+    model._ell = len(y)
+    model.kernel.fit(model.X)
+    model._set_targets(variances)
+    return model
+
+
+def test_kron_mvprod():
+    As = [np.random.random((n, n)) for n in (2, 3, 4)]
+    K = np.kron(np.kron(As[0], As[1]), As[2])
+    B = np.random.random((24, 3))
+    assert np.allclose(gplinalg.kron_mvprod(As, B), K @ B)
+    assert np.allclose(gplinalg.kron_mvprod(As, B[:, 0]), K @ B[:, 0])
+    ds = [np.random.random(n) for n in (2, 3)]
+    assert np.allclose(gplinalg.kron_diag(ds), np.kron(ds[0], ds[1]))
+
+
+def test_block_kernel():
+    X, _ = chimera_tools.make_sequence_X(seqs, sample_space)
+    se = gpkernel.SEKernel()
+    h = hypers[1:]
+    assert np.allclose(kernel.cov(codes, codes, h), se.cov(X, X, h))
+    C = kernel.codes(codes)
+    assert C.shape == (27, 3)
+    assert kernel.codes(C) is C
+    Ks = kernel.factors(h)
+    assert np.allclose(np.kron(np.kron(Ks[0], Ks[1]), Ks[2]),
+                       kernel.cov(codes, codes, h))
+    dK = kernel.grad(codes, codes, h)
+    for dK_k, dKs in zip(dK, kernel.factor_grads(h)):
+        total = 0
+        for b, dK_b in enumerate(dKs):
+            if dK_b is None:
+                continue
+            terms = list(Ks)
+            terms[b] = dK_b
+            total = total + np.kron(np.kron(terms[0], terms[1]), terms[2])
+        assert np.allclose(total, dK_k)
+
+
+def test_complete():
+    order = np.random.permutation(len(codes))
+    X = [codes[i] for i in order]
+    y = Y[order]
+    exact = exact_model(X, y)
+    ML, grad = exact._log_ML(hypers, gradient=True)
+    model = gpmodel.KroneckerGPRegressor(
+        gpkernel.BlockSEKernel(assignments, sample_space))
+    model.fit(X, y)
+    assert model.complete
+    ML_k, grad_k = model._log_ML(hypers, gradient=True)
+    assert np.isclose(ML_k, ML)
+    assert np.allclose(grad_k, grad)
+    exact.hypers = hypers
+    exact._posterior = exact._factorize(hypers)
+    model.hypers = hypers
+    model._posterior = model._factorize(hypers)
+    E, var = exact.predict(codes[:4])
+    E_k, var_k = model.predict(codes[:4])
+    assert np.allclose(E_k, E)
+    assert np.allclose(var_k, var)
+    lib, E_lib, var_lib = model.predict_library()
+    assert [''.join(str(c) for c in row) for row in lib] == codes
+    E, var = exact.predict(codes, return_cov=False)
+    assert np.allclose(E_lib, E)
+    assert np.allclose(var_lib, var)
+
+
+def test_near_factorial():
+    keep = np.sort(np.random.choice(len(codes), size=20, replace=False))
+    X = [codes[i] for i in keep]
+    y = Y[keep]
+    exact = exact_model(X, y)
+    model = gpmodel.KroneckerGPRegressor(
+        gpkernel.BlockSEKernel(assignments, sample_space), precond_rank=20)
+    model.fit(X, y)
+    assert not model.complete
+    assert np.isclose(model._log_ML(hypers), exact._log_ML(hypers))
+    assert np.allclose(model._matvec(np.eye(20), hypers),
+                       exact._make_Ks(hypers)[1])
+    exact.hypers = hypers
+    exact._posterior = exact._factorize(hypers)
+    model.hypers = hypers
+    model._posterior = model._factorize(hypers)
+    E, var = exact.predict(codes, return_cov=False)
+    _, E_lib, var_lib = model.predict_library()
+    assert np.allclose(E_lib, E)
+    assert np.allclose(var_lib, var)
+
+
+if __name__ == "__main__":
+    test_kron_mvprod()
+    test_block_kernel()
+    test_complete()
+    test_near_factorial()
@@ -0,0 +1,116 @@
+import pytest
+import os
+import tempfile
+
+import numpy as np
+
+from gpmodel import gpkernel
+from gpmodel import gpmodel
+
+np.random.seed(0)
+n = 60
+d = 2
+X = np.random.random(size=(n, d))
+Y = np.stack([np.sin(4 * X[:, 0]) + X[:, 1],
+              3 * np.cos(3 * X[:, 1]) + 5,
+              10 * X[:, 0]], axis=1)
+Y += np.random.normal(scale=0.1, size=Y.shape)
+X_test = np.random.random(size=(4, d))
+hypers = np.array([0.05, 1.2, 0.4])
+
+
+def single_model(y):
+    model = gpmodel.GPRegressor(gpkernel.SEKernel())
+    model.X = X
+    model.Y = y
+    model._ell = n
+    model.kernel.fit(X)
+    model._set_targets()
+    return model
+
+
+def test_init():
+    model = gpmodel.MultiTargetGPRegressor(gpkernel.SEKernel())
+    assert model.shared
+    assert model.objective == model._log_ML
+    with pytest.raises(AttributeError):
+        gpmodel.MultiTargetGPRegressor(gpkernel.SEKernel(),
+                                       objective='LOO_log_p')
+
+
+def test_ML():
+    model = gpmodel.MultiTargetGPRegressor(gpkernel.SEKernel())
+    model.X = X
+    model.Y = Y
+    model._ell = n
+    model.kernel.fit(X)
+    model._set_targets()
+    assert model.normed_Y.shape == (n, 3)
+    ML, grad = model._log_ML(hypers, gradient=True)
+    MLs, grads = zip(*[single_model(Y[:, j])._log_ML(hypers, gradient=True)
+                       for j in range(3)])
+    assert np.isclose(ML, sum(MLs))
+    assert np.allclose(grad, np.sum(grads, axis=0))
+    assert model._alpha.shape == (n, 3)
+
+
+def test_shared():
+    model = gpmodel.MultiTargetGPRegressor(gpkernel.SEKernel())
+    model.fit(X, Y)
+    assert len(model.hypers) == 3
+    E, cov = model.predict(X_test)
+    assert E.shape == (4, 3)
+    assert cov.shape == (4, 4, 3)
+    for j in range(3):
+        single = single_model(Y[:, j])
+        single.hypers = model.hypers
+        single._posterior = single._factorize(model.hypers)
+        E_j, cov_j = single.predict(X_test)
+        assert np.allclose(E[:, j], E_j)
+        assert np.allclose(cov[:, :, j], cov_j)
+    E2, std = model.predict(X_test, return_std=True)
+    assert np.allclose(E2, E)
+    assert np.allclose(std ** 2, np.diagonal(cov).T)
+    chunks = list(model.predict_iter(X_test, chunk_size=3))
+    assert np.allclose(np.concatenate([c[0] for c in chunks]), E)
+
+
+def test_per_target():
+    model = gpmodel.MultiTargetGPRegressor(gpkernel.SEKernel(), shared=False)
+    model.fit(X, Y)
+    assert model.hypers.shape == (3, 3)
+    assert len(model._posterior) == 3
+    E, var = model.predict(X_test, return_cov=False)
+    assert E.shape == (4, 3)
+    assert var.shape == (4, 3)
+    for j in range(3):
+        single = gpmodel.GPRegressor(gpkernel.SEKernel())
+        single.fit(X, Y[:, j])
+        assert np.allclose(model.hypers[j], single.hypers, rtol=1e-3)
+        E_j, var_j = single.predict(X_test, return_cov=False)
+        assert np.allclose(E[:, j], E_j, atol=1e-4)
+        assert np.allclose(var[:, j], var_j, atol=1e-6)
+    model.dump('test.pkl')
+    new_model = gpmodel.MultiTargetGPRegressor.load('test.pkl')
+    os.remove('test.pkl')
+    E2, var2 = new_model.predict(X_test, return_cov=False)
+    assert np.allclose(E2, E)
+    assert np.allclose(var2, var)
+    with tempfile.TemporaryDirectory() as directory:
+        model.dump_compact(directory)
+        new_model = gpmodel.MultiTargetGPRegressor.load_compact(
+            directory, mmap_mode=None)
+    assert not new_model.shared
+    assert len(new_model._posterior) == 3
+    E3, var3 = new_model.predict(X_test, return_cov=False)
+    assert np.allclose(E3, E)
+    assert np.allclose(var3, var)
+    with pytest.raises(NotImplementedError):
+        model.add_observations(X_test, E)
+
+
+if __name__ == "__main__":
+    test_init()
+    test_ML()
+    test_shared()
+    test_per_target()
@@ -0,0 +1,92 @@
+import pytest
+import os
+
+import numpy as np
+from scipy import linalg
+
+from gpmodel import gpkernel
+from gpmodel import gpmodel
+from gpmodel import gplinalg
+
+np.random.seed(0)
+n = 90
+d = 2
+X = np.random.random(size=(n, d))
+Y = np.sin(4 * X[:, 0]) + X[:, 1] + np.random.normal(scale=0.1, size=n)
+X_test = np.random.random(size=(5, d))
+hypers = np.array([0.05, 1.2, 0.4])
+A = np.random.random(size=(n, n))
+A = A @ A.T + np.eye(n)
+
+
+def exact_model():
+    model = gpmodel.GPRegressor(gpkernel.SEKernel())
+    model.X = X
+    model.Y = Y
+    model._ell = n
+    model.kernel.fit(X)
+    model._set_targets()
+    return model
+
+
+def out_of_core_model(**kwargs):
+    model = gpmodel.OutOfCoreGPRegressor(gpkernel.SEKernel(), **kwargs)
+    model.X = X
+    model.Y = Y
+    model._ell = n
+    model._fit_kernel(X)
+    model._set_targets()
+    return model
+
+
+def test_tiled_cholesky():
+    L = np.linalg.cholesky(A)
+    M = A.copy()
+    assert gplinalg.tiled_cholesky(M, 20) is M
+    assert np.allclose(np.tril(M), L)
+    B = np.random.random(size=(n, 3))
+    assert np.allclose(gplinalg.tiled_solve_triangular(M, B, 20),
+                       linalg.solve_triangular(L, B, lower=True))
+    assert np.allclose(gplinalg.tiled_solve_triangular(M, B[:, 0], 20,
+                                                       trans=True),
+                       linalg.solve_triangular(L.T, B[:, 0], lower=False))
+
+
+def test_ML():
+    exact = exact_model()
+    ML, grad = exact._log_ML(hypers, gradient=True)
+    model = out_of_core_model(tile_size=20, directory='.')
+    ML_o, grad_o = model._log_ML(hypers, gradient=True)
+    assert isinstance(model._cache[tuple(hypers)].L, np.memmap)
+    assert np.isclose(ML_o, ML)
+    assert np.allclose(grad_o, grad)
+    variances = np.random.random(size=n) * 0.1
+    exact._set_targets(variances)
+    model._set_targets(variances)
+    ML, grad = exact._log_ML(hypers[1:], gradient=True)
+    ML_o, grad_o = model._log_ML(hypers[1:], gradient=True)
+    assert np.isclose(ML_o, ML)
+    assert np.allclose(grad_o, grad)
+
+
+def test_fit():
+    exact = gpmodel.GPRegressor(gpkernel.SEKernel())
+    exact.fit(X, Y)
+    model = gpmodel.OutOfCoreGPRegressor(gpkernel.SEKernel(), tile_size=32)
+    model.fit(X, Y)
+    assert model.cache_size == 1
+    assert np.allclose(model.hypers, exact.hypers, rtol=1e-4)
+    E, var = exact.predict(X_test)
+    E_o, var_o = model.predict(X_test)
+    assert np.allclose(E_o, E)
+    assert np.allclose(var_o, var)
+    E_o, var_o = model.predict(X_test, return_cov=False)
+    assert np.allclose(var_o, np.diag(var))
+    with pytest.raises(NotImplementedError):
+        model.add_observations(X_test, E)
+
+
+if __name__ == "__main__":
+    test_tiled_cholesky()
+    test_ML()
+    test_fit()
@@ -0,0 +1,163 @@
+import pytest
+import threading
+import time
+
+import numpy as np
+
+from gpmodel import gpkernel
+from gpmodel import gpmodel
+from gpmodel import gpparallel
+from gpmodel import gpthreads
+
+np.random.seed(0)
+n = 60
+d = 2
+X = np.random.random(size=(n, d))
+Y = np.sin(4 * X[:, 0]) + X[:, 1]
+hypers = np.array([0.05, 1.2, 0.4])
+
+
+def describe(A, i):
+    return type(A).__name__, A.flags.writeable, float(A[i].sum())
+
+
+def fail(i):
+    if i == 2:
+        raise ValueError('task 2')
+    return i
+
+
+def slow_fail(i, done):
+    if i == 0:
+        raise ValueError('task 0')
+    time.sleep(0.01)
+    done.append(i)
+
+
+def nested(i):
+    return type(gpparallel.current_executor()).__name__
+
+
+def start_worker():
+    server = gpparallel.start_worker()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+@pytest.fixture
+def worker():
+    server = start_worker()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+def executors(address):
+    # Pools are sized from the budget, which may be one core
+    with gpthreads.ThreadBudget(4):
+        return [gpparallel.SerialExecutor(),
+                gpparallel.ThreadExecutor(2),
+                gpparallel.ProcessExecutor(2, min_shared_bytes=0),
+                gpparallel.SocketExecutor([address, address],
+                                          min_shared_bytes=0)]
+
+
+def test_map(worker):
+    A = np.random.random(size=(5, 4))
+    for executor in executors(worker):
+        with executor:
+            assert gpparallel.current_executor() is executor
+            results = executor.map(describe, [A] * 5, range(5))
+            assert [r[2] for r in results] == pytest.approx(A.sum(axis=1))
+            with pytest.raises(ValueError):
+                executor.map(fail, range(4))
+            # The connections and pools survive a failed task
+            assert executor.map(fail, [0, 1]) == [0, 1]
+        assert gpparallel.current_executor() is gpparallel.SERIAL
+
+
+def test_shared_arrays(worker):
+    A = np.random.random(size=(5, 4))
+    with gpparallel.ProcessExecutor(2, min_shared_bytes=0) as executor:
+        results = executor.map(describe, [A, A], [0, 1])
+    assert all(r[0] == 'memmap' and not r[1] for r in results)
+    with gpparallel.ProcessExecutor(2) as executor:
+        results = executor.map(describe, [A, A], [0, 1])
+    assert all(r[0] == 'ndarray' for r in results)
+    with gpparallel.SocketExecutor([worker], min_shared_bytes=0) as executor:
+        results = executor.map(describe, [A, A], [0, 1])
+    assert all(r[0] == 'ndarray' and not r[1] for r in results)
+
+
+def test_cancel():
+    done = []
+    with gpthreads.ThreadBudget(2):
+        executor = gpparallel.ThreadExecutor(2)
+    with executor:
+        with pytest.raises(ValueError):
+            executor.map(slow_fail, range(20), [done] * 20)
+        finished = len(done)
+        time.sleep(0.1)
+    # The queued tasks were cancelled before the error was raised
+    assert len(done) == finished < 19
+
+
+def test_nested(worker):
+    for executor in executors(worker)[1:]:
+        with executor:
+            assert executor.map(nested, range(2)) == ['SerialExecutor'] * 2
+
+
+def test_out_of_core():
+    model = gpmodel.OutOfCoreGPRegressor(gpkernel.SEKernel(), tile_size=16)
+    model.X = X
+    model.Y = Y
+    model._ell = n
+    model._fit_kernel(X)
+    model._set_targets()
+    K = np.tril(np.asarray(model._gram(hypers)))
+    for executor in [gpparallel.ThreadExecutor(2),
+                     gpparallel.ProcessExecutor(2, min_shared_bytes=0)]:
+        with executor:
+            assert np.allclose(np.tril(np.asarray(model._gram(hypers))), K)
+
+
+def test_multistart():
+    np.random.seed(1)
+    serial = gpmodel.GPRegressor(gpkernel.SEKernel(), n_starts=3)
+    serial.fit(X, Y)
+    np.random.seed(1)
+    model = gpmodel.GPRegressor(gpkernel.SEKernel(), n_starts=3)
+    with gpparallel.ThreadExecutor(3):
+        model.fit(X, Y)
+    assert len(model.starts) == 3
+    assert np.allclose([s.fun for s in model.starts],
+                       [s.fun for s in serial.starts])
+    assert np.isclose(model.ML, serial.ML)
+    assert np.allclose(model.predict(X[:5])[0], serial.predict(X[:5])[0])
+
+
+def test_multi_classifier_factors():
+    Y_c = np.zeros((n, 3))
+    Y_c[range(n), np.random.randint(3, size=n)] = 1
+    model = gpmodel.GPMultiClassifier([gpkernel.SEKernel() for _ in range(3)])
+    model.X = X
+    model.Y = Y_c
+    model._n_hypers = [k.fit(X) for k in model.kernels]
+    h = np.ones(sum(model._n_hypers))
+    ML = model._log_ML(h)
+    with gpparallel.ThreadExecutor(3):
+        assert np.isclose(model._log_ML(h), ML)
+
+
+if __name__ == "__main__":
+    server = start_worker()
+    test_map(server.server_address)
+    test_shared_arrays(server.server_address)
+    test_nested(server.server_address)
+    test_cancel()
+    server.shutdown()
+    test_out_of_core()
+    test_multistart()
+    test_multi_classifier_factors()
@@ -0,0 +1,129 @@
+import pytest
+import os
+import json
+import pickle
+import tracemalloc
+
+import numpy as np
+
+from gpmodel import gpkernel
+from gpmodel import gpmodel
+from gpmodel import gpprofile
+
+np.random.seed(0)
+n = 40
+d = 2
+X = np.random.random(size=(n, d))
+Y = np.sin(4 * X[:, 0]) + X[:, 1] + np.random.normal(scale=0.1, size=n)
+X_test = np.random.random(size=(5, d))
+
+
+def test_phases():
+    profiler = gpprofile.Profiler(track_memory=True)
+    seen = []
+    profiler.add_hook(seen.append)
+    tracing = tracemalloc.is_tracing()
+    with profiler.phase('outer'):
+        with profiler.phase('inner'):
+            A = np.ones((300, 300))
+        del A
+        assert tracemalloc.is_tracing()
+    # The profiler stops tracing only if it started it
+    assert tracemalloc.is_tracing() == tracing
+    profiler.count('things', 3)
+    profiler.count('things')
+    inner, outer = profiler.events
+    assert seen == profiler.events
+    assert (inner['name'], inner['depth']) == ('inner', 1)
+    assert (outer['name'], outer['depth']) == ('outer', 0)
+    assert outer['wall'] >= inner['wall']
+    assert inner['peak_memory'] >= 300 * 300 * 8
+    assert outer['peak_memory'] >= inner['peak_memory']
+    assert profiler.counts == {'things': 4}
+    summary = profiler.summary()
+    assert summary['inner']['calls'] == 1
+    assert json.loads(profiler.to_json())['counts'] == {'things': 4}
+    trace = profiler.to_chrome_trace()
+    assert [e['ph'] for e in trace['traceEvents']] == ['X', 'X', 'C']
+    copied = pickle.loads(pickle.dumps(profiler))
+    assert len(copied.events) == 2
+    with copied.phase('again'):
+        pass
+    assert len(copied.events) == 3
+    profiler.reset()
+    assert profiler.events == [] and profiler.counts == {}
+
+
+def test_regressor():
+    profiler = gpprofile.Profiler()
+    model = gpmodel.GPRegressor(gpkernel.SEKernel(), profiler=profiler)
+    model.fit(X, Y)
+    model.predict(X_test)
+    list(model.predict_iter(X_test, chunk_size=2))
+    summary = profiler.summary()
+    for name in ['kernel.fit', 'optimize', 'minimize', 'objective',
+                 'kernel.cov', 'cholesky', 'solve_triangular', 'gradient',
+                 'kernel.grad', 'posterior', 'predict']:
+        assert name in summary
+    assert summary['predict']['calls'] == 4
+    assert profiler.counts['objective'] == summary['objective']['calls']
+    profiler.to_chrome_trace('trace.json')
+    with open('trace.json') as f:
+        trace = json.load(f)
+    os.remove('trace.json')
+    assert len(trace['traceEvents']) == len(profiler.events) + 1
+    model.dump('test.pkl')
+    new_model = gpmodel.GPRegressor.load('test.pkl')
+    os.remove('test.pkl')
+    assert new_model.profiler is None
+
+
+def test_classifier():
+    profiler = gpprofile.Profiler()
+    Y_class = np.where(Y > np.percentile(Y, 30), 1, -1)
+    model = gpmodel.GPClassifier(gpkernel.SEKernel(), profiler=profiler)
+    model.fit(X, Y_class)
+    assert profiler.counts['newton_iterations'] >= \
+        profiler.counts['objective'] > 0
+    assert 'cholesky' in profiler.summary()
+
+
+def test_multi_classifier():
+    profiler = gpprofile.Profiler()
+    Y_multi = np.zeros((n, 3))
+    Y_multi[range(n), np.digitize(Y, np.percentile(Y, [33, 67]))] = 1
+    model = gpmodel.GPMultiClassifier([gpkernel.SEKernel()
+                                       for _ in range(3)],
+                                      profiler=profiler)
+    model.fit(X, Y_multi)
+    summary = profiler.summary()
+    assert profiler.counts['objective'] == summary['objective']['calls'] > 0
+    assert profiler.counts['newton_iterations'] >= \
+        profiler.counts['objective']
+    for name in ['kernel.cov', 'cholesky', 'optimize']:
+        assert name in summary
+
+
+def test_approximate():
+    for model, phases in [
+            (gpmodel.SparseGPRegressor(gpkernel.SEKernel(), inducing=10),
+             ['kernel.cov', 'cholesky', 'solve_triangular']),
+            (gpmodel.IterativeGPRegressor(gpkernel.SEKernel(), tile_size=16,
+                                          precond_rank=10),
+             ['kernel.cov', 'kernel.grad', 'pcg']),
+            (gpmodel.OutOfCoreGPRegressor(gpkernel.SEKernel(), tile_size=16),
+             ['kernel.cov', 'kernel.grad', 'cholesky', 'solve_triangular'])]:
+        model.profiler = gpprofile.Profiler()
+        model.fit(X, Y)
+        model.predict(X_test)
+        summary = model.profiler.summary()
+        for name in phases:
+            assert name in summary
+
+
+if __name__ == "__main__":
+    test_phases()
+    test_regressor()
+    test_classifier()
+    test_multi_classifier()
+    test_approximate()
@@ -1,5 +1,7 @@
 import pytest
 import os
+import threading
+from concurrent import futures
 
 import pandas as pd
 import numpy as np
@@ -78,6 +80,93 @@ def test_ML():
     assert np.isclose(actual, model._log_ML(hypers))
 
 
+def test_ML_gradient():
+    model = gpmodel.GPRegressor(kernel)
+    model.kernel.fit(X)
+    model.normed_Y = model._normalize(Y)[2]
+    hypers = np.random.random(size=(3,)) + 0.5
+    ML, grad = model._log_ML(hypers, gradient=True)
+    assert np.isclose(ML, model._log_ML(hypers))
+    eps = 1e-6
+    for i in range(len(hypers)):
+        h_plus = hypers.copy()
+        h_plus[i] += eps
+        h_minus = hypers.copy()
+        h_minus[i] -= eps
+        fd = (model._log_ML(h_plus) - model._log_ML(h_minus)) / (2 * eps)
+        assert np.isclose(grad[i], fd, rtol=1e-4, atol=1e-4)
+
+
+def test_workspace():
+    model = gpmodel.GPRegressor(kernel)
+    model.kernel.fit(X)
+    model.normed_Y = model._normalize(Y)[2]
+    model._ell = len(Y)
+    hypers = np.random.random(size=(3,)) + 0.5
+    ML, grad = model._log_ML(hypers, gradient=True)
+    model._cache.clear()
+    model._fitting = True
+    ML_w, grad_w = model._log_ML(hypers, gradient=True)
+    assert np.isclose(ML_w, ML)
+    assert np.allclose(grad_w, grad)
+    assert model._K is None
+    assert model._cache[tuple(hypers)].L is None
+    assert model._log_ML(hypers, gradient=True)[0] == ML_w
+    work = model._work
+    model._log_ML(hypers + 0.1, gradient=True)
+    assert model._work is work
+    model._fitting = False
+    model._log_ML(hypers)
+    Ky = model._add_noise(model._K, hypers)
+    assert np.allclose(model._L, np.linalg.cholesky(Ky))
+    model = gpmodel.GPRegressor(kernel)
+    model.fit(X, Y)
+    assert model._work is None
+    assert not model._fitting
+    assert model._posterior.L is not None
+
+
+def test_LOO_log_p():
+    model = gpmodel.GPRegressor(kernel, objective='LOO_log_p')
+    assert model.objective == model._LOO_log_p
+    model.kernel.fit(X[:40])
+    model.X = X[:40]
+    model.Y = Y[:40]
+    model._set_targets()
+    hypers = np.random.random(size=(3,)) + 0.5
+    y = model.normed_Y
+    K = kernel.cov(X[:40], X[:40], hypers[1:]) + hypers[0] * np.eye(40)
+    mus = np.zeros(40)
+    vs = np.zeros(40)
+    for i in range(40):
+        keep = np.arange(40) != i
+        k = K[keep, i]
+        K_inv = np.linalg.inv(K[keep][:, keep])
+        mus[i] = k @ K_inv @ y[keep]
+        vs[i] = K[i, i] - k @ K_inv @ k
+    log_p = -0.5 * np.log(2 * np.pi * vs) - (y - mus) ** 2 / (2 * vs)
+    LOO, grad = model._LOO_log_p(hypers, gradient=True)
+    assert np.isclose(LOO, -np.sum(log_p))
+    model._posterior = model._factorize(hypers)
+    m, v = model.LOO_res()
+    assert np.allclose(m, mus * model.std + model.mean)
+    assert np.allclose(v, vs * model.std ** 2)
+    eps = 1e-6
+    for i in range(len(hypers)):
+        h_plus = hypers.copy()
+        h_plus[i] += eps
+        h_minus = hypers.copy()
+        h_minus[i] -= eps
+        fd = (model._LOO_log_p(h_plus) - model._LOO_log_p(h_minus)) / (2 * eps)
+        assert np.isclose(grad[i], fd, rtol=1e-4, atol=1e-4)
+    model.fit(X, Y)
+    assert np.isclose(model.LOO_log_p, model._LOO_log_p(model.hypers))
+    model.dump('test.pkl')
+    new_model = gpmodel.GPRegressor.load('test.pkl')
+    os.remove('test.pkl')
+    assert new_model.objective == new_model._LOO_log_p
+
+
 def test_fit():
     model = gpmodel.GPRegressor(kernel)
     model.fit(X, Y)
@@ -101,6 +190,168 @@ def test_fit():
     assert np.allclose(model._alpha, alpha)
 
 
+class NoGradKernel(gpkernel.BaseKernel):
+
+    """ A user-defined kernel without grad. """
+
+    def __init__(self):
+        self._se = gpkernel.SEKernel()
+        self._n_hypers = 2
+
+    def fit(self, X):
+        return self._se.fit(X)
+
+    def cov(self, X1=None, X2=None, hypers=(1.0, 1.0)):
+        return self._se.cov(X1, X2, hypers=hypers)
+
+
+def test_fit_without_grad():
+    no_grad = NoGradKernel()
+    assert not no_grad.has_grad()
+    assert kernel.has_grad()
+    assert gpkernel.SumKernel([gpkernel.SEKernel(), no_grad]).has_grad() \
+        is False
+    model = gpmodel.GPRegressor(no_grad)
+    model.fit(X, Y)
+    exact = gpmodel.GPRegressor(gpkernel.SEKernel())
+    exact.fit(X, Y)
+    assert np.isclose(model.ML, exact.ML, rtol=1e-3)
+
+
+def test_posterior():
+    model = gpmodel.GPRegressor(kernel)
+    model.fit(X, Y)
+    assert np.allclose(model._posterior.L, model._L)
+    m1, v1 = model.predict(X_test)
+    fact = model._factorize(model.hypers)
+    assert fact is model._posterior
+    model._log_ML(model.hypers * 2)
+    assert len(model._cache) == model.cache_size
+    m2, v2 = model.predict(X_test)
+    assert np.allclose(m1, m2)
+    assert np.allclose(v1, v2)
+    ML, grad = model._log_ML(model.hypers * 2, gradient=True)
+    assert model._factorize(model.hypers * 2).grad is grad
+    model._log_ML(model.hypers * 3)
+    model._log_ML(model.hypers * 4)
+    assert tuple(model.hypers) not in model._cache
+
+
+def test_add_observations():
+    model = gpmodel.GPRegressor(kernel)
+    model.fit(X[:190], Y[:190])
+    hypers = model.hypers.copy()
+    model.add_observations(X[190:], Y[190:])
+    assert np.allclose(model.hypers, hypers)
+    assert np.allclose(model.X, X)
+    assert np.allclose(model.Y, Y)
+    normed = (Y - model.mean) / model.std
+    K = kernel.cov(X, X, hypers[1:])
+    Ky = K + np.diag(hypers[0] * np.ones(n))
+    assert np.allclose(model.kernel.cov(hypers=hypers[1:]), K)
+    assert np.allclose(model._posterior.L, np.linalg.cholesky(Ky))
+    assert np.allclose(model._posterior.alpha[:, 0],
+                       np.linalg.solve(Ky, normed))
+    first = 0.5 * normed @ np.linalg.solve(Ky, normed)
+    second = 0.5 * np.linalg.slogdet(Ky)[1]
+    third = n / 2.0 * np.log(2 * np.pi)
+    assert np.isclose(model.ML, first + second + third)
+    k_star = kernel.cov(X_test, X, hypers[1:])
+    means = k_star @ np.linalg.solve(Ky, normed) * model.std + model.mean
+    m, _ = model.predict(X_test)
+    assert np.allclose(m, means)
+    model = gpmodel.GPRegressor(kernel, refit_every=5)
+    model.fit(X[:190], Y[:190])
+    model.add_observations(X[190:193], Y[190:193])
+    assert model._n_added == 3
+    model.add_observations(X[193:], Y[193:])
+    assert model._n_added == 0
+    assert np.isclose(model.mean, Y.mean())
+    assert np.isclose(model.ML, model._log_ML(model.hypers))
+
+
+def test_add_observations_failure(monkeypatch):
+    model = gpmodel.GPRegressor(kernel)
+    model.fit(X[:190], Y[:190])
+    post = model._posterior
+
+    def fail(A):
+        raise np.linalg.LinAlgError('Matrix is not positive definite')
+
+    monkeypatch.setattr(np.linalg, 'cholesky', fail)
+    with pytest.raises(np.linalg.LinAlgError):
+        model.add_observations(X[190:], Y[190:])
+    monkeypatch.undo()
+    # The model still matches its factorization
+    assert model._posterior is post
+    assert len(model.X) == len(model.Y) == len(model.normed_Y) == 190
+    assert model.kernel._saved.shape == (190, 190)
+    model.add_observations(X[190:], Y[190:])
+    assert np.allclose(model.X, X)
+
+
+def test_snapshot():
+    model = gpmodel.GPRegressor(kernel)
+    model.fit(X[:190], Y[:190])
+    snapshot = model._snapshot
+    assert snapshot is not model
+    assert snapshot._posterior is model._posterior
+    # Refitting changes the kernel in place, so the snapshot has its own
+    assert snapshot.kernel is not model.kernel
+    saved = snapshot.kernel._saved
+    m1, v1 = model.predict(X_test, return_cov=False)
+    # The objective overwrites the model's dependent values
+    model._log_ML(model.hypers * 2)
+    assert model._snapshot is snapshot
+    m2, v2 = model.predict(X_test, return_cov=False)
+    assert np.allclose(m1, m2)
+    assert np.allclose(v1, v2)
+    with futures.ThreadPoolExecutor(4) as pool:
+        rows = list(pool.map(lambda x: model.predict(x[None, :],
+                                                     return_cov=False),
+                             X_test))
+    assert np.allclose(np.concatenate([m for m, _ in rows]), m1)
+    assert np.allclose(np.concatenate([v for _, v in rows]), v1)
+    # Predictions during add_observations come from one fit or the other
+    results = []
+    done = threading.Event()
+
+    def predict():
+        while not done.is_set():
+            results.append(model.predict(X_test, return_cov=False)[0])
+
+    thread = threading.Thread(target=predict)
+    thread.start()
+    try:
+        model.add_observations(X[190:], Y[190:], refit_hypers=True)
+    finally:
+        done.set()
+        thread.join()
+    m3, _ = model.predict(X_test, return_cov=False)
+    assert model._snapshot is not snapshot
+    assert snapshot.kernel._saved is saved
+    assert len(model.kernel._saved) == len(X)
+    for m in results:
+        assert np.allclose(m, m1) or np.allclose(m, m3)
+
+
+def test_multistart():
+    model = gpmodel.GPRegressor(kernel)
+    model.fit(X, Y)
+    single_ML = model.ML
+    model = gpmodel.GPRegressor(kernel, n_starts=3, n_jobs=2)
+    model.fit(X, Y)
+    assert len(model.starts) == 3
+    assert np.allclose(model.starts[0].x0, 0.9)
+    best = min(model.starts, key=lambda r: r.fun)
+    assert np.allclose(model.hypers, best.x)
+    assert np.isclose(model.ML, best.fun)
+    assert model.ML <= single_ML + 1e-6
+    assert all(r.wall_time > 0 for r in model.starts)
+    for x0 in model.starts[1:]:
+        assert (x0.x0 >= 1e-5).all() and (x0.x0 <= 10).all()
+
+
 def test_predict():
     model = gpmodel.GPRegressor(kernel)
     model.fit(X, Y)
@@ -120,6 +371,26 @@ def test_predict():
     print(model.hypers[0])
     assert (np.abs(v - var) < 1e-1).all()
     assert np.allclose(means[:, 0], m, rtol=1.e-8, atol=1e-4)
+    m2, v2 = model.predict(X_test, return_cov=False)
+    assert np.allclose(m, m2)
+    assert np.allclose(v2, np.diag(v))
+    m3, s3 = model.predict(X_test, return_std=True)
+    assert np.allclose(s3, np.sqrt(np.diag(v)))
+
+
+def test_predict_iter():
+    model = gpmodel.GPRegressor(kernel)
+    model.fit(X, Y)
+    X_new = np.random.random(size=(23, d))
+    m, v = model.predict(X_new, return_cov=False)
+    chunks = list(model.predict_iter(X_new, chunk_size=10))
+    assert [len(c[0]) for c in chunks] == [10, 10, 3]
+    assert np.allclose(np.concatenate([c[0] for c in chunks]), m)
+    assert np.allclose(np.concatenate([c[1] for c in chunks]), v)
+    rows = (x for x in X_new)
+    chunks = list(model.predict_iter(rows, chunk_size=7))
+    assert np.allclose(np.concatenate([c[0] for c in chunks]), m)
+    assert np.allclose(np.concatenate([c[1] for c in chunks]), v)
 
 
 def test_pickles():
@@ -134,15 +405,88 @@ def test_pickles():
     assert np.allclose(v1, v2)
 
 
+def test_compact(tmp_path):
+    model = gpmodel.GPRegressor(kernel, mean_func=func)
+    model.fit(X, Y)
+    m1, v1 = model.predict(X_test)
+    model.dump_compact(str(tmp_path))
+    assert sorted(os.listdir(str(tmp_path))) == ['L.npy', 'X.npy',
+                                                 'alpha.npy', 'meta.pkl']
+    assert model.kernel._saved is not None
+    new_model = gpmodel.GPRegressor.load_compact(str(tmp_path))
+    assert isinstance(new_model._posterior.L, np.memmap)
+    assert isinstance(new_model.X, np.memmap)
+    assert new_model.kernel._saved is None
+    assert np.allclose(new_model.hypers, model.hypers)
+    m2, v2 = new_model.predict(X_test)
+    assert np.allclose(m1, m2)
+    assert np.allclose(v1, v2)
+    m3, v3 = new_model.predict(X_test, return_cov=False)
+    assert np.allclose(v3, np.diag(v1))
+    chunks = list(new_model.predict_iter(X_test, chunk_size=2))
+    assert np.allclose(np.concatenate([c[0] for c in chunks]), m1)
+    with pytest.raises(ValueError):
+        gpmodel.MultiTargetGPRegressor.load_compact(str(tmp_path))
+
+
+def test_float32():
+    hypers = np.array([0.04, 1.0, 0.5])
+    model = gpmodel.GPRegressor(gpkernel.SEKernel())
+    model.fit(X, Y)
+    model32 = gpmodel.GPRegressor(gpkernel.SEKernel(), dtype='float32')
+    model32.fit(X, Y)
+    assert model32.dtype == np.float32
+    assert model32.kernel._saved.dtype == np.float32
+    assert model32._K.dtype == np.float32
+    assert model32._L.dtype == np.float32
+    assert np.isclose(model32._log_ML(hypers), model._log_ML(hypers),
+                      rtol=1e-4)
+    model.hypers = model32.hypers
+    model._posterior = model._factorize(model.hypers)
+    m, v = model.predict(X_test, return_cov=False)
+    m32, v32 = model32.predict(X_test, return_cov=False)
+    assert np.allclose(m32, m, atol=1e-3)
+    assert np.allclose(v32, v, atol=1e-3)
+    chunks = list(model32.predict_iter(X_test, chunk_size=2))
+    assert np.allclose(np.concatenate([c[0] for c in chunks]), m32)
+
+
+def test_float32_jitter(monkeypatch):
+    model = gpmodel.GPRegressor(gpkernel.SEKernel(), dtype='float32')
+    model.fit(X, Y)
+
+    def indefinite(*args, **kwargs):
+        raise np.linalg.LinAlgError('not positive definite')
+
+    # Force the jitter fallback during a fit
+    monkeypatch.setattr(gpmodel.linalg, 'cholesky', indefinite)
+    model.fit(X, Y)
+    monkeypatch.undo()
+    assert model._L is not model._work
+    assert model._K is not None
+    assert model._posterior.K is not None
+    assert np.allclose(model._Ky, model._K + np.eye(len(X)) * model.hypers[0])
+    model.add_observations(X_test[:2], np.ones(2))
+    assert model._posterior.K.shape == (len(X) + 2, len(X) + 2)
+
+
 if __name__ == "__main__":
     test_init()
     test_normalize()
     test_K()
     test_ML()
+    test_ML_gradient()
+    test_workspace()
+    test_LOO_log_p()
     test_fit()
+    test_fit_without_grad()
+    test_posterior()
+    test_add_observations()
+    test_multistart()
     test_predict()
+    test_predict_iter()
     test_pickles()
+    test_float32()
     # To Do:
-    # Test LOO_res and LOO_log_p and fitting with LOO_log_p
     # Test with mean functions
     # Test with given variances
@@ -0,0 +1,228 @@
+import pytest
+import asyncio
+import json
+from concurrent import futures
+
+import numpy as np
+
+from gpmodel import gpkernel
+from gpmodel import gpmodel
+from gpmodel import gpserve
+from gpmodel import stringkernel
+
+np.random.seed(0)
+n = 40
+d = 3
+X = np.random.random(size=(n, d))
+Y = np.sin(3 * X[:, 0]) + X[:, 1]
+X_test = np.random.random(size=(6, d))
+
+model = gpmodel.GPRegressor(gpkernel.SEKernel())
+model.fit(X, Y)
+
+
+def test_batcher():
+    calls = []
+    predict = model.predict
+
+    def counted(X, **kwargs):
+        calls.append(len(X))
+        return predict(X, **kwargs)
+
+    batcher = gpserve.MicroBatcher(model, window=0.05)
+    batcher.model = type('Counted', (), {'predict': staticmethod(counted)})
+
+    async def run():
+        return await asyncio.gather(*[batcher.apredict(X_test[[i]])
+                                      for i in range(len(X_test))])
+
+    results = asyncio.run(run())
+    batcher.close()
+    assert calls == [len(X_test)]
+    E, var = model.predict(X_test, return_cov=False)
+    assert np.allclose(np.concatenate([m for m, _ in results]), E)
+    assert np.allclose(np.concatenate([v for _, v in results]), var)
+
+
+def test_max_batch():
+    batcher = gpserve.MicroBatcher(model, window=10.0, max_batch=4)
+
+    async def run():
+        return await asyncio.gather(batcher.apredict(X_test[:2]),
+                                    batcher.apredict(X_test[2:4]))
+
+    results = asyncio.run(asyncio.wait_for(run(), 5.0))
+    batcher.close()
+    E, _ = model.predict(X_test[:4], return_cov=False)
+    assert np.allclose(np.concatenate([m for m, _ in results]), E)
+
+
+def test_batcher_error():
+    batcher = gpserve.MicroBatcher(model)
+
+    async def run():
+        return await batcher.apredict(np.random.random(size=(2, d + 1)))
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+    batcher.close()
+
+
+def test_batcher_mixed_shapes():
+    batcher = gpserve.MicroBatcher(model, window=0.05)
+
+    async def run():
+        return await asyncio.gather(batcher.apredict(X_test[:2]),
+                                    batcher.apredict(np.ones((2, d + 1))),
+                                    return_exceptions=True)
+
+    good, bad = asyncio.run(asyncio.wait_for(run(), 5.0))
+    batcher.close()
+    assert isinstance(bad, ValueError)
+    E, _ = model.predict(X_test[:2], return_cov=False)
+    assert np.allclose(good[0], E)
+
+    # A batch that fails as a whole fails every request in it
+    batcher = gpserve.MicroBatcher(model, window=0.05)
+    batcher.model = type('Ragged', (), {})
+
+    async def run_ragged():
+        return await asyncio.gather(batcher.apredict(np.ones((2, 3))),
+                                    batcher.apredict(np.ones((2, 4))),
+                                    return_exceptions=True)
+
+    results = asyncio.run(asyncio.wait_for(run_ragged(), 5.0))
+    batcher.close()
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_batcher_sequences():
+    seqs = ['AGTTA', 'AGCTA', 'TTTGA', 'GGCAT', 'ACGTA', 'TTAGC',
+            'CATGA', 'GTACA', 'AGTCA', 'TGCAT']
+    y = np.random.random(len(seqs))
+    string_model = gpmodel.GPRegressor(
+        stringkernel.MismatchKernel(3, ['A', 'C', 'G', 'T'], 1))
+    string_model.fit(seqs, y)
+    batcher = gpserve.MicroBatcher(string_model, window=0.05)
+
+    async def run():
+        return await asyncio.gather(batcher.apredict(['AGTTT']),
+                                    batcher.apredict(['GGCAA', 'TTAGA']))
+
+    results = asyncio.run(asyncio.wait_for(run(), 5.0))
+    batcher.close()
+    E, var = string_model.predict(['AGTTT', 'GGCAA', 'TTAGA'],
+                                  return_cov=False)
+    assert np.allclose(np.concatenate([m for m, _ in results]), E)
+    assert np.allclose(np.concatenate([v for _, v in results]), var)
+
+
+def test_server():
+    async def run():
+        server, batchers = await gpserve.start_server({'gp': model},
+                                                      port=0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for i, x in enumerate(X_test):
+            request = {'id': i, 'model': 'gp', 'X': [x.tolist()]}
+            writer.write(json.dumps(request).encode() + b'\n')
+        writer.write(b'{"id": 10, "model": "missing", "X": []}\n')
+        await writer.drain()
+        responses = [json.loads(await reader.readline())
+                     for _ in range(len(X_test) + 1)]
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        for batcher in batchers.values():
+            batcher.close()
+        return {r['id']: r for r in responses}
+
+    responses = asyncio.run(run())
+    assert 'error' in responses[10]
+    E, var = model.predict(X_test, return_cov=False)
+    for i in range(len(X_test)):
+        assert np.isclose(responses[i]['mean'][0], E[i])
+        assert np.isclose(responses[i]['variance'][0], var[i])
+
+
+class ManualExecutor(object):
+
+    """ Runs each submitted call when run is called. """
+
+    def submit(self, fn, *args):
+        self.call = (fn, args)
+        self.future = futures.Future()
+        return self.future
+
+    def run(self):
+        fn, args = self.call
+        self.future.set_result(fn(*args))
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def test_managed_model():
+    fitted = gpmodel.GPRegressor(gpkernel.SEKernel())
+    fitted.fit(X[:30], Y[:30])
+    E, var = fitted.predict(X_test, return_cov=False)
+    executor = ManualExecutor()
+    managed = gpserve.ManagedModel(fitted, X[:30], Y[:30], refit_every=5,
+                                   executor=executor)
+    managed.add_observations(X[30:34], Y[30:34])
+    metrics = managed.metrics()
+    assert metrics['n_pending'] == 4
+    assert metrics['staleness'] > 0
+    assert not metrics['refitting']
+    managed.add_observations(X[34:35], Y[34:35])
+    assert managed.metrics()['refitting']
+    # The previous fit is served until the refit finishes
+    managed.add_observations(X[35:], Y[35:])
+    E2, var2 = managed.predict(X_test, return_cov=False)
+    assert managed.model is fitted
+    assert np.allclose(E2, E)
+    assert np.allclose(var2, var)
+    fn, (model, X_fit, Y_fit, variances) = executor.call
+    assert model is not fitted
+    assert model.kernel is not fitted.kernel
+    assert len(X_fit) == 35
+    assert np.allclose(model.guesses, fitted.hypers)
+    executor.run()
+    assert managed.model is model
+    assert len(managed.model.X) == 35
+    assert fitted.kernel._saved.shape == (30, 30)
+    assert np.allclose(fitted.predict(X_test, return_cov=False)[0], E)
+    metrics = managed.metrics()
+    assert metrics['n_refits'] == 1
+    assert metrics['n_fitted'] == 35
+    assert metrics['n_pending'] == n - 35
+    # The observations that arrived during the refit are due
+    assert metrics['refitting']
+    executor.run()
+    metrics = managed.metrics()
+    assert metrics['n_fitted'] == n
+    assert metrics['staleness'] == 0.0
+    assert not metrics['refitting']
+
+
+def test_managed_model_interval():
+    managed = gpserve.ManagedModel(gpmodel.GPRegressor(gpkernel.SEKernel()),
+                                   X[:30], Y[:30], refit_interval=0.0)
+    assert len(managed.model.X) == 30
+    managed.add_observations(X[30:], Y[30:])
+    managed.wait()
+    assert managed.error is None
+    assert len(managed.model.X) == n
+    assert managed.metrics()['n_refits'] == 1
+    managed.close()
+
+
+if __name__ == "__main__":
+    test_batcher()
+    test_max_batch()
+    test_batcher_error()
+    test_batcher_mixed_shapes()
+    test_batcher_sequences()
+    test_server()
+    test_managed_model()
+    test_managed_model_interval()
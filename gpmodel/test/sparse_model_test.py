@@ -0,0 +1,221 @@
+import pytest
+import os
+
+import numpy as np
+
+from gpmodel import gpkernel
+from gpmodel import gpmodel
+from gpmodel import gplinalg
+from gpmodel import stringkernel
+
+np.random.seed(0)
+n = 40
+d = 2
+X = np.random.random(size=(n, d))
+Y = np.sin(4 * X[:, 0]) + X[:, 1] + np.random.normal(scale=0.1, size=n)
+X_test = np.random.random(size=(5, d))
+kernel = gpkernel.SEKernel()
+hypers = np.array([0.1, 1.2, 0.4])
+
+
+def test_init():
+    model = gpmodel.SparseGPRegressor(kernel, inducing=10)
+    assert model.inducing == 10
+    assert model.objective == model._log_ML
+    with pytest.raises(ValueError):
+        gpmodel.SparseGPRegressor(kernel, selection='random')
+    with pytest.raises(ValueError):
+        gpmodel.SparseGPRegressor(kernel, approximation='DTC')
+    with pytest.raises(AttributeError):
+        gpmodel.SparseGPRegressor(kernel, objective='LOO_log_p')
+
+
+def test_pivoted_cholesky():
+    A = kernel.cov(X, X, hypers=hypers[1:])
+    L, pivots = gplinalg.pivoted_cholesky(np.diag(A), lambda j: A[:, j], n)
+    assert len(set(pivots)) == len(pivots)
+    assert np.allclose(L @ L.T, A, atol=1e-6)
+    L, pivots = gplinalg.pivoted_cholesky(np.diag(A), lambda j: A[:, j], 5)
+    assert L.shape == (n, 5)
+    assert np.allclose(L[pivots] @ L[pivots].T, A[np.ix_(pivots, pivots)])
+
+
+def test_select_inducing():
+    for selection in ['kmeans', 'greedy']:
+        model = gpmodel.SparseGPRegressor(kernel, inducing=8,
+                                          selection=selection)
+        inds = model._select_inducing(X)
+        assert len(inds) == 8
+        assert len(set(inds)) == 8
+    model = gpmodel.SparseGPRegressor(kernel, inducing=[0, 3, 5])
+    assert np.array_equal(model._select_inducing(X), [0, 3, 5])
+
+
+def test_exact_limit():
+    """ With every input inducing, both bounds are exact. """
+    exact = gpmodel.GPRegressor(kernel)
+    exact.X = X
+    exact.Y = Y
+    exact._ell = n
+    exact.kernel.fit(X)
+    exact._set_targets()
+    ML = exact._log_ML(hypers)
+    exact.hypers = hypers
+    exact._posterior = exact._factorize(hypers)
+    E, var = exact.predict(X_test)
+    for approx in ['VFE', 'FITC']:
+        model = gpmodel.SparseGPRegressor(gpkernel.SEKernel(),
+                                          inducing=np.arange(n),
+                                          approximation=approx)
+        model.X = X
+        model.Y = Y
+        model._ell = n
+        model._fit_kernel(X)
+        model._set_targets()
+        assert np.isclose(model._log_ML(hypers), ML, rtol=1e-5)
+        model.hypers = hypers
+        model._posterior = model._factorize(hypers)
+        E_s, var_s = model.predict(X_test)
+        assert np.allclose(E_s, E, atol=1e-4)
+        assert np.allclose(var_s, var, atol=1e-4)
+        E_m, var_m = model.predict(X_test, return_cov=False)
+        assert np.allclose(E_m, E_s)
+        assert np.allclose(var_m, np.diag(var_s))
+
+
+def test_fit():
+    for approx in ['VFE', 'FITC']:
+        model = gpmodel.SparseGPRegressor(gpkernel.SEKernel(), inducing=10,
+                                          approximation=approx)
+        model.fit(X, Y)
+        assert len(model.Z) == 10
+        assert len(model.hypers) == 3
+        assert np.isclose(model.ML, model._log_ML(model.hypers))
+        E, var = model.predict(X_test, return_cov=False)
+        chunks = list(model.predict_iter(X_test, chunk_size=2))
+        assert np.allclose(np.concatenate([c[0] for c in chunks]), E)
+        assert np.allclose(np.concatenate([c[1] for c in chunks]), var)
+        assert np.all(var > 0)
+    # the VFE objective bounds the exact objective from above
+    exact = gpmodel.GPRegressor(gpkernel.SEKernel())
+    exact.fit(X, Y)
+    model = gpmodel.SparseGPRegressor(gpkernel.SEKernel(), inducing=10)
+    model.fit(X, Y)
+    assert model._log_ML(exact.hypers) >= exact.ML - 1e-8
+
+
+def test_string_kernel():
+    seqs = np.random.randint(4, size=(12, 5))
+    y = np.random.normal(size=12)
+    S = np.eye(4) * 0.5 + 0.5
+    contacts = [(0, 2), (0, 4), (2, 3), (2, 4), (3, 4)]
+    wdk = stringkernel.WeightedDecompositionKernel(contacts, S, 5)
+    model = gpmodel.SparseGPRegressor(wdk, inducing=4, selection='greedy')
+    model.fit(seqs, y)
+    assert len(model.Z) == 4
+    E, var = model.predict(seqs, return_cov=False)
+    assert E.shape == (12,)
+    assert np.all(var > -1e-8)
+
+
+def test_random_features():
+    model = gpmodel.RandomFeatureGPRegressor(gpkernel.SEKernel(),
+                                             n_features=50, seed=1)
+    model.X = X
+    model.Y = Y
+    model._ell = n
+    assert model._fit_kernel(X) == 2
+    model._set_targets()
+    Phi = model.kernel.features(X, hypers=hypers[1:])
+    K = Phi @ Phi.T
+    Ky = K + hypers[0] * np.eye(n)
+    y = model.normed_Y
+    ML = 0.5 * y @ np.linalg.solve(Ky, y) + \
+        0.5 * np.linalg.slogdet(Ky)[1] + n / 2 * np.log(2 * np.pi)
+    assert np.isclose(model._log_ML(hypers), ML)
+    model.hypers = hypers
+    model._posterior = model._factorize(hypers)
+    E, var = model.predict(X_test)
+    Phi_s = model.kernel.features(X_test, hypers=hypers[1:])
+    k_star = Phi_s @ Phi.T
+    E_check = model.unnormalize(k_star @ np.linalg.solve(Ky, y))
+    var_check = Phi_s @ Phi_s.T - k_star @ np.linalg.solve(Ky, k_star.T)
+    assert np.allclose(E, E_check)
+    assert np.allclose(var, var_check * model.std ** 2)
+
+
+def test_random_features_fit():
+    model = gpmodel.RandomFeatureGPRegressor(gpkernel.ARDMaternKernel('5/2'),
+                                             n_features=100, seed=2)
+    model.fit(X, Y)
+    assert len(model.hypers) == 3
+    E, std = model.predict(X_test, return_std=True)
+    assert np.all(std > 0)
+    model.dump('test.pkl')
+    new_model = gpmodel.RandomFeatureGPRegressor.load('test.pkl')
+    os.remove('test.pkl')
+    new_model._fit_kernel(X)
+    E2, std2 = new_model.predict(X_test, return_std=True)
+    assert np.allclose(E, E2)
+    assert np.allclose(std, std2)
+
+
+def test_low_rank_string_kernel():
+    seqs = np.random.randint(4, size=(15, 5))
+    y = np.random.normal(size=15)
+    S = np.eye(4) * 0.5 + 0.5
+    contacts = [(0, 2), (0, 4), (2, 3), (2, 4), (3, 4)]
+    wdk = stringkernel.WeightedDecompositionKernel(contacts, S, 5)
+    multi = stringkernel.MultipleKernel(
+        [stringkernel.WeightedDecompositionKernel(contacts, S, 5),
+         stringkernel.WeightedDecompositionKernel(contacts, np.eye(4), 5)])
+    for base, h in [(wdk, np.array([0.2])),
+                    (multi, np.array([0.2, 0.7, 0.3, 1.0, 2.0]))]:
+        exact = gpmodel.GPRegressor(base)
+        exact.X = seqs
+        exact.Y = y
+        exact._ell = 15
+        exact.kernel.fit(seqs)
+        exact._set_targets()
+        ML = exact._log_ML(h)
+        kernel = gpkernel.LowRankKernel(base, max_rank=15, tol=0)
+        model = gpmodel.FeatureGPRegressor(kernel)
+        model.X = seqs
+        model.Y = y
+        model._ell = 15
+        model._fit_kernel(seqs)
+        model._set_targets()
+        assert np.isclose(model._log_ML(h), ML, rtol=1e-5)
+    model = gpmodel.FeatureGPRegressor(gpkernel.LowRankKernel(wdk,
+                                                              max_rank=6))
+    model.fit(seqs, y)
+    assert len(model.kernel._pivots) == 6
+    E, var = model.predict(seqs[:3])
+    assert var.shape == (3, 3)
+
+
+def test_low_rank_regressor():
+    kernel = gpkernel.LowRankKernel(gpkernel.SEKernel(), max_rank=20)
+    assert not kernel.has_grad()
+    model = gpmodel.GPRegressor(kernel)
+    model.fit(X, Y)
+    # Optimized by finite differences from the default guesses
+    assert model.ML <= model._log_ML(np.full(3, 0.9))
+    E, var = model.predict(X_test)
+    assert E.shape == (5, )
+    assert var.shape == (5, 5)
+    model.add_observations(X_test[:2], np.zeros(2))
+    assert len(model.kernel._X) == n + 2
+
+
+if __name__ == "__main__":
+    test_init()
+    test_pivoted_cholesky()
+    test_select_inducing()
+    test_exact_limit()
+    test_fit()
+    test_string_kernel()
+    test_random_features()
+    test_random_features_fit()
+    test_low_rank_string_kernel()
+    test_low_rank_regressor()
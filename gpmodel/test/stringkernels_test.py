@@ -4,6 +4,7 @@ import itertools
 from collections import Counter
 
 import numpy as np
+from scipy import sparse
 
 from gpmodel import stringkernel
 
@@ -60,6 +61,19 @@ def test_mkl():
     assert len(k._saved) == 2
     assert np.allclose(k._saved[0], k.kernels[0].cov(X1, X1))
     assert np.allclose(k._saved[1], k.kernels[1].cov(X1, X1))
+    assert np.allclose(k.diag(X1, hypers=h), np.diag(k.cov(X1, X1, hypers=h)))
+    for ke in kernels:
+        assert np.allclose(ke.diag(X1), np.diag(ke.cov(X1, X1)))
+    dK = k.grad(X1, X2, hypers=h)
+    assert dK.shape == (4, len(X1), len(X2))
+    assert np.allclose(dK[0], K1 ** g1)
+    assert np.allclose(dK[1], K2 ** g2)
+    assert np.allclose(dK[2], w1 * K1 ** g1 * np.log(K1))
+    assert np.allclose(dK[3], w2 * K2 ** g2 * np.log(K2))
+    assert np.allclose(k.grad(hypers=h), k.grad(X1, X1, hypers=h))
+    k.fit(X1[:1])
+    k.extend(X1[:1], X1[1:])
+    assert np.allclose(k.cov(hypers=h), k.cov(X1, X1, hypers=h))
 
 def naive_wdk(x1, x2, S, D, cutoff=4.5):
     subs = S[x1, x2]
@@ -92,8 +106,26 @@ def test_wdk():
     K2_star = np.expand_dims(np.sqrt(np.diag(K22)), 0)
     K12 = K12 / K1_star / K2_star
     k = stringkernel.WeightedDecompositionKernel(contacts, S, len(X1[0]))
+    adj = np.zeros((L, L))
+    for pos, neighbors in enumerate(graph):
+        for n in neighbors:
+            if n >= 0:
+                adj[pos, n] += 1
+    assert sparse.issparse(k.adj)
+    assert np.allclose(k.adj.toarray(), adj)
     K = k.cov(X1, X2)
     assert np.allclose(K, K12)
+    K_blocked = stringkernel.decomposition_cov(S, k.adj, X1, X2, block_size=2)
+    K_blocked /= np.sqrt(stringkernel.decomposition_diag(S, k.adj, X1))[:, None]
+    K_blocked /= np.sqrt(stringkernel.decomposition_diag(S, k.adj, X2))[None, :]
+    assert np.allclose(K_blocked, K12)
+    # Blocks of both X1 and X2 under a small memory budget
+    K_small = stringkernel.decomposition_cov(S, k.adj, X1, X2,
+                                             max_bytes=2 * L * 8)
+    K_dense = stringkernel.decomposition_cov(S, adj, X1, X2)
+    assert np.allclose(K_small, K_dense)
+    assert np.allclose(K_small, stringkernel.decomposition_cov(S, k.adj,
+                                                               X1, X2))
     nh = k.fit(X1)
     assert nh == 0.0
     assert np.allclose(k._saved, k.cov(X1, X1))
@@ -181,6 +213,17 @@ def test_mismatch_kernel():
     assert np.allclose(K12 * 0.2, kernel.cov(seqs1, seqs2, hypers=(0.2, )))
     # covariance from saved
     assert np.allclose(K11, kernel.cov())
+    assert np.allclose(kernel.diag(seqs2, hypers=(0.2, )),
+                       np.diag(kernel.cov(seqs2, seqs2, hypers=(0.2, ))))
+    # extending the saved kernel
+    kernel.fit(seqs2[:1])
+    kernel.extend(seqs2[:1], seqs2[1:])
+    assert np.allclose(kernel.cov(), naive_mismatch_kernel(k, m, A,
+                                                           seqs2, seqs2))
+    kernel.fit(seqs1)
+    # gradient
+    assert np.allclose(kernel.grad(seqs1, seqs2, hypers=(0.2, ))[0], K12)
+    assert np.allclose(kernel.grad(hypers=(0.2, ))[0], K11)
     # normalization
     # hyperparameters
 
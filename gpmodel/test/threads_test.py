@@ -0,0 +1,119 @@
+import pytest
+import threading
+
+import numpy as np
+
+from gpmodel import gpkernel
+from gpmodel import gpmodel
+from gpmodel import gpthreads
+
+np.random.seed(0)
+n = 40
+d = 3
+X = np.random.random(size=(n, d))
+Y = np.sin(3 * X[:, 0]) + X[:, 1]
+
+
+def blas_threads():
+    info = gpthreads.threadpoolctl.threadpool_info()
+    return [lib['num_threads'] for lib in info if lib['user_api'] == 'blas']
+
+
+class BudgetKernel(gpkernel.SEKernel):
+
+    def fit(self, X):
+        self.budget = gpthreads.current_budget().n_threads
+        return gpkernel.SEKernel.fit(self, X)
+
+
+def test_split():
+    budget = gpthreads.ThreadBudget(8)
+    assert budget.split(2) == (2, 4)
+    assert budget.split(3) == (3, 2)
+    assert budget.split(16) == (8, 1)
+    assert budget.split(0) == (1, 8)
+    assert gpthreads.ThreadBudget().n_threads == gpthreads.available_cores()
+    with pytest.raises(ValueError):
+        gpthreads.ThreadBudget(0)
+
+
+def test_budget():
+    assert gpthreads.current_budget().n_threads == \
+        gpthreads.available_cores()
+    with gpthreads.ThreadBudget(2) as outer:
+        assert gpthreads.current_budget() is outer
+        with gpthreads.ThreadBudget(1) as inner:
+            assert gpthreads.current_budget() is inner
+        assert gpthreads.current_budget() is outer
+    assert gpthreads.current_budget().n_threads == \
+        gpthreads.available_cores()
+
+
+def test_thread_budgets():
+    entered = threading.Barrier(2)
+    exited = threading.Barrier(2)
+    seen = {}
+
+    def run(n_threads, exit_first):
+        with gpthreads.ThreadBudget(n_threads) as budget:
+            entered.wait()
+            if not exit_first:
+                exited.wait()
+            seen[n_threads] = gpthreads.current_budget() is budget
+        if exit_first:
+            exited.wait()
+        seen[n_threads, 'after'] = gpthreads.current_budget().n_threads
+
+    threads = [threading.Thread(target=run, args=(2, True)),
+               threading.Thread(target=run, args=(3, False))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Each thread sees its own budget, however their exits interleave
+    assert seen[2] and seen[3]
+    assert seen[2, 'after'] == seen[3, 'after'] == \
+        gpthreads.available_cores()
+    assert gpthreads.current_budget().n_threads == \
+        gpthreads.available_cores()
+
+
+def test_blas_limits():
+    if gpthreads.threadpoolctl is None:
+        pytest.skip('threadpoolctl is not installed')
+    before = blas_threads()
+    with gpthreads.ThreadBudget(1):
+        assert all(t == 1 for t in blas_threads())
+    assert blas_threads() == before
+    with gpthreads.limit(1):
+        assert all(t == 1 for t in blas_threads())
+    assert blas_threads() == before
+
+
+def test_model_budget():
+    model = gpmodel.GPRegressor(gpkernel.SEKernel(), n_starts=2, n_jobs=2,
+                                n_threads=1)
+    model.fit(X, Y)
+    assert len(model.starts) == 2
+    single = gpmodel.GPRegressor(gpkernel.SEKernel(), n_threads=1)
+    single.fit(X, Y)
+    assert model.ML <= single.ML + 1e-6
+
+
+def test_fit_budget():
+    kernel = BudgetKernel()
+    model = gpmodel.GPRegressor(kernel, n_threads=1)
+    model.fit(X, Y)
+    # The budget covers fitting the kernel, not just the optimizer
+    assert kernel.budget == 1
+    assert gpthreads.current_budget().n_threads == \
+        gpthreads.available_cores()
+
+
+if __name__ == "__main__":
+    test_split()
+    test_budget()
+    test_thread_budgets()
+    test_blas_limits()
+    test_model_budget()
+    test_fit_budget()